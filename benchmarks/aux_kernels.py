@@ -0,0 +1,61 @@
+"""
+Benchmarks of methods for derived model variables (model_read_aux)
+
+Compares the iris cube arithmetic of pyaerocom.io.aux_read_cubes with the
+in-place kernels of suppl/ex_cfg_eval_iface/cube_read_methods.py on daily
+global 1x1 degree fields.
+"""
+import importlib.util
+import os
+
+METHODS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "suppl", "ex_cfg_eval_iface", "cube_read_methods.py")
+
+
+def _load_methods():
+    spec = importlib.util.spec_from_file_location("cube_read_methods",
+                                                  METHODS_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod.FUNS
+
+
+def _make_cube(var_name, num_days, seed):
+    import iris.coords
+    import iris.cube
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    data = rng.uniform(0.01, 1, (num_days, 180, 360)).astype(np.float32)
+    lats = iris.coords.DimCoord(np.arange(-89.5, 90), standard_name="latitude",
+                                units="degrees")
+    lons = iris.coords.DimCoord(np.arange(-179.5, 180),
+                                standard_name="longitude", units="degrees")
+    time = iris.coords.DimCoord(np.arange(num_days), standard_name="time",
+                                units="days since 2010-01-01")
+    return iris.cube.Cube(data, var_name=var_name, units="1",
+                          dim_coords_and_dims=[(time, 0), (lats, 1), (lons, 2)])
+
+
+class AuxKernels:
+    params = (["add_cubes", "subtract_cubes", "calc_ae"], ["iris", "fast"])
+    param_names = ["method", "impl"]
+    num_days = 365
+    # the fast methods modify the input, so each measurement must be a
+    # single call on fresh cubes: setup runs before every repeat, number=1
+    # makes every repeat one call and without warmup no call runs on
+    # already modified cubes
+    number = 1
+    warmup_time = 0
+
+    def setup(self, method, impl):
+        self.fun = _load_methods()[method if impl == "iris" else f"{method}_fast"]
+        self.cube1 = _make_cube("od550aer", self.num_days, 1)
+        self.cube2 = _make_cube("od870aer", self.num_days, 2)
+
+    def time_method(self, method, impl):
+        self.fun(self.cube1, self.cube2)
+
+    def peakmem_method(self, method, impl):
+        self.fun(self.cube1, self.cube2)
@@ -0,0 +1,62 @@
+"""
+Benchmarks of colocation (cf. getting_started_analysis and intro_emep)
+"""
+from .common import EMEP_DIR, MODEL_ID, OBS_ID, init_testdata
+
+
+class ColocateGriddedUngridded:
+    params = ([10, 100, 0],)
+    param_names = ["num_stations"]  # 0: all stations
+
+    def setup(self, num_stations):
+        pya = init_testdata()
+        from pyaerocom.colocation.colocation_utils import (
+            colocate_gridded_ungridded)
+
+        self.colocate = colocate_gridded_ungridded
+        self.model = pya.io.ReadGridded(MODEL_ID).read_var("od550aer",
+                                                           ts_type="monthly")
+        obs = pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+        if num_stations:
+            names = sorted(obs.unique_station_names)[:num_stations]
+            obs = obs.filter_by_meta(station_name=names)
+        self.obs = obs
+
+    def time_colocate_gridded_ungridded(self, num_stations):
+        self.colocate(self.model, self.obs, ts_type="monthly", start=2010,
+                      filter_name="ALL-noMOUNTAINS")
+
+    def peakmem_colocate_gridded_ungridded(self, num_stations):
+        self.colocate(self.model, self.obs, ts_type="monthly", start=2010,
+                      filter_name="ALL-noMOUNTAINS")
+
+
+class ColocatorRun:
+    params = (["TM5-AERONET", "EMEP-EBAS"],)
+    param_names = ["setup"]
+    timeout = 600
+
+    def setup(self, setup):
+        pya = init_testdata()
+        if setup == "TM5-AERONET":
+            stp = pya.ColocationSetup(
+                model_id=MODEL_ID, obs_id=OBS_ID, obs_vars="od550aer",
+                ts_type="monthly", model_ts_type_read="monthly",
+                filter_name="OCN", reanalyse_existing=True,
+                save_coldata=False, start="2010-01-01", stop="2011-01-01")
+        else:
+            stp = pya.ColocationSetup(
+                model_id="EMEP", obs_id="EBASSubset", obs_vars="concpm10",
+                model_data_dir=EMEP_DIR,
+                gridded_reader_id={"model": "ReadMscwCtm"},
+                ts_type="monthly", model_ts_type_read="monthly",
+                reanalyse_existing=True, save_coldata=False,
+                start="1999-01-01", stop="2000-01-01")
+        self.stp = stp
+        self.pya = pya
+
+    def time_colocator_run(self, setup):
+        self.pya.Colocator(self.stp).run()
+
+    def peakmem_colocator_run(self, setup):
+        self.pya.Colocator(self.stp).run()
@@ -0,0 +1,51 @@
+"""
+Helpers shared by all benchmarks
+
+All benchmarks run on the testdata-minimal dataset that is also used in the
+tutorials. Benchmarks are skipped if the dataset is not available.
+"""
+import os
+
+TESTDATA_DIR = os.environ.get(
+    "PYAEROCOM_TESTDATA",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "data", "testdata-minimal"))
+
+MODEL_ID = "TM5-met2010_CTRL-TEST"
+OBS_ID = "AeronetSunV3Lev2.daily"
+EMEP_DIR = os.path.join(TESTDATA_DIR, "modeldata", "EMEP_1999")
+EBAS_DIR = os.path.join(TESTDATA_DIR, "obsdata", "EBASMultiColumn")
+
+# Benchmark cache variants: "cold" disables the pyaerocom cache (or uses a
+# fresh reader), "warm" reads from the primed cache (or a reused reader)
+CACHE_VARIANTS = ["cold", "warm"]
+
+
+def init_testdata():
+    """Register testdata-minimal in pyaerocom (skip benchmark if missing)
+
+    Raising NotImplementedError in setup makes asv skip the benchmark.
+    """
+    if not os.path.isdir(TESTDATA_DIR):
+        raise NotImplementedError(
+            f"testdata-minimal not found at {TESTDATA_DIR}, run "
+            "'pya getsampledata' or set PYAEROCOM_TESTDATA")
+    import pyaerocom as pya
+
+    moddir = os.path.join(TESTDATA_DIR, "modeldata")
+    if moddir not in pya.const.DATA_SEARCH_DIRS:
+        pya.const.add_data_search_dir(moddir)
+    if "EBASSubset" not in pya.const.OBSLOCS_UNGRIDDED:
+        pya.const.add_ungridded_obs(obs_id="EBASSubset", data_dir=EBAS_DIR,
+                                    reader=pya.io.ReadEbas)
+    return pya
+
+
+def station_coords(num):
+    """Deterministic set of station coordinates spread over the globe"""
+    import numpy as np
+
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(-80, 80, num)
+    lons = rng.uniform(-179, 179, num)
+    return lats, lons
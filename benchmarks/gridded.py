@@ -0,0 +1,76 @@
+"""
+Benchmarks of gridded reading and processing (cf. getting_started_analysis)
+"""
+from .common import CACHE_VARIANTS, MODEL_ID, init_testdata, station_coords
+
+
+class ReadGriddedVar:
+    params = (CACHE_VARIANTS, ["daily", "monthly"])
+    param_names = ["cache", "ts_type"]
+
+    def setup(self, cache, ts_type):
+        self.pya = init_testdata()
+        self.reader = self.pya.io.ReadGridded(MODEL_ID)
+        if cache == "warm":
+            self.reader.read_var("od550aer", ts_type=ts_type)
+
+    def _reader(self, cache):
+        if cache == "cold":
+            return self.pya.io.ReadGridded(MODEL_ID)
+        return self.reader
+
+    def time_read_var(self, cache, ts_type):
+        self._reader(cache).read_var("od550aer", ts_type=ts_type)
+
+    def peakmem_read_var(self, cache, ts_type):
+        self._reader(cache).read_var("od550aer", ts_type=ts_type)
+
+
+class GriddedProcessing:
+    params = ([(10, 20), (5, 5), (2, 3)],)
+    param_names = ["res_deg"]
+
+    def setup(self, res_deg):
+        pya = init_testdata()
+        self.data = pya.io.ReadGridded(MODEL_ID).read_var("od550aer",
+                                                          ts_type="daily")
+
+    def time_regrid(self, res_deg):
+        lat_res, lon_res = res_deg
+        self.data.regrid(lat_res_deg=lat_res, lon_res_deg=lon_res)
+
+    def peakmem_regrid(self, res_deg):
+        lat_res, lon_res = res_deg
+        self.data.regrid(lat_res_deg=lat_res, lon_res_deg=lon_res)
+
+    def time_regrid_resample_yearly(self, res_deg):
+        lat_res, lon_res = res_deg
+        self.data.regrid(lat_res_deg=lat_res,
+                         lon_res_deg=lon_res).resample_time("yearly")
+
+
+class GriddedResampleTime:
+    params = (["monthly", "yearly"],)
+    param_names = ["to_ts_type"]
+
+    def setup(self, to_ts_type):
+        pya = init_testdata()
+        self.data = pya.io.ReadGridded(MODEL_ID).read_var("od550aer",
+                                                          ts_type="daily")
+
+    def time_resample_time(self, to_ts_type):
+        self.data.resample_time(to_ts_type)
+
+
+class GriddedToTimeSeries:
+    params = ([1, 10, 100],)
+    param_names = ["num_stations"]
+
+    def setup(self, num_stations):
+        pya = init_testdata()
+        self.data = pya.io.ReadGridded(MODEL_ID).read_var("od550aer",
+                                                          ts_type="monthly")
+        self.lats, self.lons = station_coords(num_stations)
+
+    def time_to_time_series(self, num_stations):
+        self.data.to_time_series(latitude=self.lats, longitude=self.lons)
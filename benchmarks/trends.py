@@ -0,0 +1,63 @@
+"""
+Benchmarks of trend computation (cf. getting_started_analysis)
+"""
+from .common import OBS_ID, init_testdata
+
+
+class ComputeTrend:
+    params = ([10, 20, 40],)
+    param_names = ["num_years"]
+
+    def setup(self, num_years):
+        import numpy as np
+        import pandas as pd
+
+        pya = init_testdata()
+        self.te = pya.trends_engine.TrendsEngine
+        # monthly series of La Paz (as in tutorial), tiled to num_years
+        station = pya.io.ReadUngridded(OBS_ID).read(
+            vars_to_retrieve="od550aer")["La_Paz"]
+        ts = station.resample_time("od550aer", ts_type="monthly")["od550aer"]
+        values = np.resize(ts.values, num_years * 12)
+        self.start_year = 2019 - num_years + 1
+        index = pd.date_range(f"{self.start_year}-01-01", periods=len(values),
+                              freq="MS")
+        self.series = pd.Series(values, index=index)
+
+    def time_compute_trend(self, num_years):
+        self.te.compute_trend(data=self.series, start_year=self.start_year,
+                              stop_year=2019, ts_type="monthly",
+                              min_num_yrs=7)
+
+
+class ComputeTrendsBatch:
+    """Trends of all stations and the periods of the trends config at once
+    (utils/trends_batch.py)"""
+    params = ([100, 1000],)
+    param_names = ["num_stations"]
+    periods = ["1995-2014", "2001-2010", "2002-2012", "1995-2017",
+               "2002-2017", "1980-2019"]
+
+    def setup(self, num_stations):
+        import os
+        import sys
+
+        import numpy as np
+        import pandas as pd
+        import xarray as xr
+
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "utils"))
+        from trends_batch import compute_trends_batch
+
+        self.compute = compute_trends_batch
+        rng = np.random.default_rng(42)
+        time = pd.date_range("1980-01-01", "2019-12-01", freq="MS")
+        values = 0.2 + 0.001 * np.arange(len(time)) + rng.normal(
+            0, 0.05, (num_stations, len(time)))
+        values[rng.random(values.shape) < 0.3] = np.nan
+        self.data = xr.DataArray(values, dims=("station_name", "time"),
+                                 coords={"time": time})
+
+    def time_compute_trends_batch(self, num_stations):
+        self.compute(self.data, self.periods, slope_alpha=0.68)
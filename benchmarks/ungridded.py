@@ -0,0 +1,68 @@
+"""
+Benchmarks of ungridded reading and processing (cf. getting_started_analysis)
+"""
+from .common import CACHE_VARIANTS, OBS_ID, init_testdata
+
+
+class ReadUngridded:
+    params = (CACHE_VARIANTS,)
+    param_names = ["cache"]
+
+    def setup(self, cache):
+        self.pya = init_testdata()
+        self.pya.const.CACHING = cache == "warm"
+        if cache == "warm":
+            # make sure the cache file exists
+            self.pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+
+    def teardown(self, cache):
+        self.pya.const.CACHING = True
+
+    def time_read(self, cache):
+        self.pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+
+    def peakmem_read(self, cache):
+        self.pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+
+
+class UngriddedToStationData:
+    params = (["daily", "monthly"],)
+    param_names = ["freq"]
+
+    def setup(self, freq):
+        pya = init_testdata()
+        self.data = pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+
+    def time_to_station_data(self, freq):
+        self.data.to_station_data("La_Paz", start=2010, freq=freq)
+
+    def time_station_resample_time(self, freq):
+        self.data["La_Paz"].resample_time(var_name="od550aer", ts_type=freq)
+
+
+class ResampleAllStations:
+    """Resampling of all stations: per station (pandas) vs. batched on the
+    data array (utils/ungridded_resample.py)"""
+    params = (["monthly", "yearly"],)
+    param_names = ["freq"]
+
+    def setup(self, freq):
+        import os
+        import sys
+
+        pya = init_testdata()
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "utils"))
+        from ungridded_resample import resample_ungridded
+
+        self.resample = resample_ungridded
+        self.data = pya.io.ReadUngridded(OBS_ID).read(vars_to_retrieve="od550aer")
+        self.constraints = dict(yearly=dict(monthly=1), monthly=dict(daily=1))
+
+    def time_per_station(self, freq):
+        for name in self.data.unique_station_names:
+            self.data.to_station_data(name, freq=freq,
+                                      min_num_obs=self.constraints)
+
+    def time_batched(self, freq):
+        self.resample(self.data, "od550aer", freq, min_num_obs=self.constraints)
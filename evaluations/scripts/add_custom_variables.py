@@ -90,9 +90,9 @@ const.register_custom_variables(variables)
 # %%
 def calc_elecmentalcarbon(concecCoarse, concecFine):
 
-    elementalcarbon = concecCoarse.copy(deep=True) + concecFine.copy(
-        deep=True
-    )  # Adds the two variables
+    # Adds the two variables. The sum is a new array, so there is no need to copy
+    # the inputs. If the inputs are lazy (dask) arrays, the sum stays lazy.
+    elementalcarbon = concecCoarse + concecFine
     elementalcarbon.attrs["units"] = "ug C m-3"  # Make sure the unit is correct
     return elementalcarbon
 
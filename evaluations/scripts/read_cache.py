@@ -0,0 +1,216 @@
+"""
+Memoisation of model reads shared by all derived and evaluated variables
+
+Each evaluated variable triggers its own ReadGridded.read_var call, and
+derived variables (model_read_aux) read their inputs again, e.g. od550dust
+and od550ss for od550gt1aer, or od550aer read directly and as input of
+ang4487aer via calc_ae (see read_dependencies.py). Since aeroval creates a
+new reader for every (model, obs) combination, the same files are read and
+decoded several times per run.
+
+enable_read_cache patches ReadGridded._load_var, which reads and decodes
+the files of one variable (directly read variables as well as the inputs
+of computed ones), keyed on (data_id, variable, ts_type, start, stop,
+vert_which) and the remaining read options. Which inputs are read how
+often is known in advance from the dependency graph of model_read_aux and
+model_use_vars of the jobs that are run (:func:`count_reads`, cf.
+read_dependencies.build_read_graph): an input is read once, kept while
+consumers remain, and evicted when its last consumer has read it. Inputs
+that are not part of the graph are not cached. Results computed from
+inputs are not cached. Earlier consumers get copies, since colocation may
+modify the data (e.g. outlier removal), the last one gets the cached
+object.
+
+Example::
+
+    from read_cache import count_reads, enable_read_cache
+
+    cache = enable_read_cache()
+    cache.add_reads(count_reads(CFG, jobs))
+    for obs_name, var_name, model_name in jobs:
+        proc.run(model_name=model_name, obs_name=obs_name, var_list=[var_name])
+    print(cache)
+"""
+
+import functools
+import inspect
+from collections import Counter
+
+#: Read method of ReadGridded that is cached
+READ_METHOD = "_load_var"
+
+#: Arguments of the read method that are part of the main key
+KEY_ARGS = ["var_name", "ts_type", "start", "stop", "vert_which"]
+
+#: Arguments of the read method that are applied to the cached data
+IGNORE_ARGS = ["self", "rename_var"]
+
+_ORIGINAL = {}
+
+_CACHES = {}
+
+
+class ReadCache:
+    """Cache of read variables, evicted once no consumer needs them
+
+    Attributes
+    ----------
+    remaining : Counter
+        (data_id, var_name) -> number of reads still to come
+    hits, misses : int
+        number of reads served from the cache / read from files
+    """
+
+    def __init__(self):
+        self.remaining = Counter()
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return (f"ReadCache({len(self)} variables, {sum(self.remaining.values())} "
+                f"pending reads, {self.hits} hits, {self.misses} misses)")
+
+    def add_reads(self, counts):
+        """Register upcoming reads (cf. :func:`count_reads`)"""
+        self.remaining.update(counts)
+
+    def get(self, key, read):
+        """Cached result of key, calls read() if not cached
+
+        The first two entries of key are (data_id, var_name).
+        """
+        group = key[:2]
+        if self.remaining[group] <= 0:
+            # not part of the dependency graph
+            self.misses += 1
+            return read()
+        self.remaining[group] -= 1
+        if key in self._data:
+            self.hits += 1
+            data = self._data[key]
+        else:
+            self.misses += 1
+            data = read()
+        if self.remaining[group] == 0:
+            # last consumer
+            del self.remaining[group]
+            for k in [k for k in self._data if k[:2] == group]:
+                del self._data[k]
+            return data
+        self._data[key] = data
+        return _copy(data)
+
+    def clear(self):
+        self.remaining.clear()
+        self._data.clear()
+
+
+def _copy(data):
+    return data.copy() if hasattr(data, "copy") else data
+
+
+def count_reads(cfg, jobs):
+    """Number of reads of each model input variable of a list of jobs
+
+    Parameters
+    ----------
+    cfg : dict
+        experiment config
+    jobs : list
+        (obs_name, var_name, model_name) jobs that are run, jobs of superobs
+        entries read no model data
+
+    Returns
+    -------
+    Counter
+        (model_id, var_name) -> number of reads
+    """
+    from read_dependencies import build_read_graph
+    from run_parallel import _get_opt
+
+    counts = Counter()
+    for obs_name, var_name, model_name in jobs:
+        if _get_opt(cfg["obs_cfg"][obs_name], "is_superobs"):
+            continue
+        model_cfg = cfg["model_cfg"][model_name]
+        model_var = model_cfg.get("model_use_vars", {}).get(var_name, var_name)
+        model_id = model_cfg.get("model_id", model_name)
+        for var in build_read_graph(model_cfg, [(var_name, model_var)]):
+            counts[(model_id, var)] += 1
+    return counts
+
+
+def _make_key(reader, args):
+    main = tuple(str(args.pop(name, None)) for name in KEY_ARGS)
+    kwargs = args.pop("kwargs", {})
+    for name in IGNORE_ARGS:
+        args.pop(name, None)
+    other = tuple(sorted((k, repr(v)) for k, v in {**args, **kwargs}.items()))
+    return (getattr(reader, "data_id", None),) + main + other
+
+
+def _cached(fun, cache):
+    signature = inspect.signature(fun)
+
+    @functools.wraps(fun)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        rename_var = bound.arguments.get("rename_var")
+        if "rename_var" in bound.arguments:
+            bound.arguments["rename_var"] = None
+        key = _make_key(self, dict(bound.arguments))
+        data = cache.get(key, lambda: fun(*bound.args, **bound.kwargs))
+        if rename_var is not None:
+            data.var_name = rename_var
+        return data
+
+    return wrapper
+
+
+def enable_read_cache(cls=None):
+    """Cache reads of all readers of a class (default: ReadGridded)
+
+    Parameters
+    ----------
+    cls : type, optional
+        reader class (default: pyaerocom.io.ReadGridded)
+
+    Returns
+    -------
+    ReadCache
+        cache (shared by all instances of cls), reads need to be registered
+        with :func:`ReadCache.add_reads` to be cached
+    """
+    if cls is None:
+        from pyaerocom.io import ReadGridded as cls
+    disable_read_cache(cls)
+    cache = ReadCache()
+    fun = cls.__dict__[READ_METHOD]
+    _ORIGINAL[cls] = fun
+    setattr(cls, READ_METHOD, _cached(fun, cache))
+    _CACHES[cls] = cache
+    return cache
+
+
+def get_read_cache(cls=None):
+    """Cache of a reader class, enabled if not enabled yet (cf.
+    :func:`enable_read_cache`)"""
+    if cls is None:
+        from pyaerocom.io import ReadGridded as cls
+    if cls in _CACHES:
+        return _CACHES[cls]
+    return enable_read_cache(cls)
+
+
+def disable_read_cache(cls=None):
+    """Restore the original read method of a class"""
+    if cls is None:
+        from pyaerocom.io import ReadGridded as cls
+    if cls in _ORIGINAL:
+        setattr(cls, READ_METHOD, _ORIGINAL.pop(cls))
+    _CACHES.pop(cls, None)
@@ -0,0 +1,102 @@
+"""
+Show which model variables an aeroval experiment reads, and how often
+
+Derived model variables (model_read_aux) and renamed variables
+(model_use_vars) are resolved into a dependency graph of the variables
+that are actually read from the model files. Inputs that are required by
+several evaluated variables (e.g. od550dust and od550ss for od550gt1aer,
+or od550aer read directly and as input of ang4487aer) are read and decoded
+once per consumer unless reads are cached (see read_cache.py), which this
+script makes visible.
+
+Usage:
+
+python read_dependencies.py my_cfg.py
+"""
+
+import argparse
+from collections import defaultdict
+
+from run_parallel import get_jobs, load_cfg
+
+
+# %%
+def _model_cfg(cfg):
+    # older configs (e.g. cfg_aerocom_example.py) use model_config / obs_config
+    return cfg["model_cfg"] if "model_cfg" in cfg else cfg["model_config"]
+
+
+def get_model_vars(cfg):
+    """Evaluated model variable names per model
+
+    Returns
+    -------
+    dict
+        model name -> list of (obs variable, model variable) pairs, where
+        the model variable name may differ due to model_use_vars
+    """
+    if "obs_cfg" not in cfg:
+        cfg = dict(cfg, obs_cfg=cfg["obs_config"])
+    obs_vars = sorted({var_name for _, var_name in get_jobs(cfg)})
+    result = {}
+    for model_name, model_cfg in _model_cfg(cfg).items():
+        use_vars = model_cfg.get("model_use_vars", {})
+        result[model_name] = [(var, use_vars.get(var, var)) for var in obs_vars]
+    return result
+
+
+def build_read_graph(model_cfg, model_vars):
+    """Dependency graph of one model
+
+    Parameters
+    ----------
+    model_cfg : dict
+        config of model (model_read_aux is used)
+    model_vars : list
+        (obs variable, model variable) pairs, cf. :func:`get_model_vars`
+
+    Returns
+    -------
+    dict
+        variable read from file -> list of evaluated (obs) variables that
+        need it
+    """
+    aux = model_cfg.get("model_read_aux", {})
+    consumers = defaultdict(list)
+
+    def resolve(var, consumer, seen=()):
+        if var in seen:
+            raise ValueError(f"Circular dependency for {var}")
+        if var in aux:
+            for required in aux[var]["vars_required"]:
+                resolve(required, consumer, seen + (var,))
+        else:
+            consumers[var].append(consumer)
+
+    for obs_var, model_var in model_vars:
+        resolve(model_var, obs_var)
+    return dict(consumers)
+
+
+def print_read_graph(cfg):
+    """Print inputs read per model and inputs that are read several times"""
+    for model_name, model_vars in get_model_vars(cfg).items():
+        model_cfg = _model_cfg(cfg)[model_name]
+        graph = build_read_graph(model_cfg, model_vars)
+        model_id = model_cfg.get("model_id", model_name)
+        num_reads = sum(len(c) for c in graph.values())
+        print(f"\n{model_name} ({model_id}): {len(graph)} variables, {num_reads} reads")
+        for var, consumers in sorted(graph.items()):
+            flag = "  <- read multiple times" if len(consumers) > 1 else ""
+            print(f"  {var:<20} needed by {', '.join(consumers)}{flag}")
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show model variables read by an experiment")
+    parser.add_argument("cfg_file", help="Python file defining the experiment config")
+    parser.add_argument("--cfg-name", default="CFG", help="Name of config dict in cfg_file")
+    args = parser.parse_args()
+
+    cfg, _ = load_cfg(args.cfg_file, args.cfg_name)
+    print_read_graph(cfg)
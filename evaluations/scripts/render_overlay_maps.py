@@ -0,0 +1,417 @@
+"""
+Render overlay (pixel) maps of an experiment in parallel, with caching
+
+Map generation (add_model_maps / only_model_maps) renders every
+(model or obs, variable, time step) frame one after the other and redoes
+projection and colour setup for every frame. This script renders the
+overlay frames of the entries in plot_types (see overlay_maps.ipynb):
+
+- the colour mapping (colormap and normalisation from the variable
+  definition) and the projection of the grid onto the output images
+  (index arrays mapping image pixels to grid cells) are computed once per
+  (entry, variable) and sent once to each worker process, which then only
+  receives the frames,
+- frames are rendered directly from data to RGBA images (no matplotlib
+  figures) in a process pool,
+- frames whose input files and plot settings did not change since the last
+  run are skipped (hashes are stored in a manifest next to the images).
+  The hashes are computed from the file information of the reader before
+  any data is read, and only years with outdated frames are read, and
+- optionally, Web Mercator tiles (z/x/y.png) are written for the zoom
+  levels covering the boundaries of the experiment.
+
+Frames are written to <json_basedir>/<proj_id>/<exp_id>/overlay_frames/
+<entry>-<var>/<date>.<overlay_save_format> (and tiles/<date>/z/x/y.png).
+
+Usage:
+
+python render_overlay_maps.py my_cfg.py --n-workers 8
+python render_overlay_maps.py my_cfg.py --tiles 3 6
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from run_parallel import load_cfg
+
+#: Name of file storing hashes of rendered frames
+MANIFEST_FILE = "_manifest.json"
+
+#: Edge length of map tiles in pixels
+TILE_SIZE = 256
+
+#: Default image height in pixels (width follows from the boundaries)
+IMAGE_HEIGHT = 1024
+
+
+# %%
+def get_entries(cfg):
+    """(entry name, data id, data dir, ts_type read, var names) of entries
+    with overlay plots"""
+    entries = []
+    for name, types in cfg.get("plot_types", {}).items():
+        if "overlay" not in types:
+            continue
+        if name in cfg["model_cfg"]:
+            mcfg = cfg["model_cfg"][name]
+            use_vars = mcfg.get("model_use_vars", {})
+            obs_vars = sorted({v for o in cfg["obs_cfg"].values() for v in _obs_vars(o)})
+            entries.append((name, mcfg["model_id"], mcfg.get("model_data_dir"),
+                            mcfg.get("model_ts_type_read"),
+                            [use_vars.get(v, v) for v in obs_vars]))
+        elif name in cfg["obs_cfg"]:
+            ocfg = cfg["obs_cfg"][name]
+            entries.append((name, ocfg["obs_id"], ocfg.get("obs_data_dir"),
+                            ocfg.get("obs_ts_type_read"), _obs_vars(ocfg)))
+        else:
+            raise ValueError(f"{name} in plot_types is neither model nor obs entry")
+    return entries
+
+
+def _obs_vars(obs_cfg):
+    obs_vars = obs_cfg["obs_vars"]
+    return [obs_vars] if isinstance(obs_vars, str) else list(obs_vars)
+
+
+def get_boundaries(cfg):
+    bounds = cfg.get("boundaries") or {}
+    if not isinstance(bounds, dict):
+        bounds = dict(bounds)
+    return (bounds.get("west", -180), bounds.get("east", 180),
+            bounds.get("south", -90), bounds.get("north", 90))
+
+
+def source_files(data_id, data_dir, var_name, years):
+    """Input files of a variable per year, without reading any data
+
+    Files that do not belong to one of the years (e.g. climatologies) are
+    assigned to all years.
+
+    Returns
+    -------
+    dict
+        year -> list of (path, size, mtime) of files, sorted by path
+    """
+    from pyaerocom.io import ReadGridded
+
+    reader = ReadGridded(data_id, data_dir=data_dir)
+    info = reader.file_info
+    if info is None:
+        return {}
+    info = info[info["var_name"] == var_name]
+    by_year = {year: [] for year in years}
+    for year, filename in zip(info["year"], info["filename"]):
+        stat = os.stat(os.path.join(reader.data_dir, filename))
+        entry = (filename, stat.st_size, stat.st_mtime)
+        for target in [year] if year in by_year else years:
+            by_year[target].append(entry)
+    return {year: sorted(files) for year, files in by_year.items() if files}
+
+
+def read_frames(data_id, data_dir, ts_type_read, var_name, freq, start, stop,
+                boundaries):
+    """Read data of one entry and variable, resampled to map frequency
+
+    Returns
+    -------
+    xarray.DataArray
+        data (time, lat, lon), cropped to boundaries, latitudes descending
+    """
+    from pyaerocom.io import ReadGridded
+
+    reader = ReadGridded(data_id, data_dir=data_dir)
+    data = reader.read_var(var_name, ts_type=ts_type_read, start=start, stop=stop)
+    data = data.resample_time(freq).to_xarray()
+    lat, lon = data.dims[-2], data.dims[-1]
+    west, east, south, north = boundaries
+    data = data.sortby(lat, ascending=False).sortby(lon)
+    return data.sel({lat: slice(north, south), lon: slice(west, east)})
+
+
+def get_color_setup(var_name):
+    """Colormap and normalisation of a variable (cf. map_cbar_levels)"""
+    import matplotlib.colors as mcolors
+    from matplotlib import colormaps
+    from pyaerocom import const
+
+    var = const.VARS[var_name]
+    cmap = colormaps[getattr(var, "map_cmap", None) or "coolwarm"]
+    levels = getattr(var, "map_cbar_levels", None)
+    if levels:
+        norm = mcolors.BoundaryNorm(levels, cmap.N, extend="both")
+        edges = np.asarray(levels, dtype=float)
+    else:
+        norm = mcolors.Normalize(getattr(var, "map_vmin", None) or 0,
+                                 getattr(var, "map_vmax", None) or 1)
+        edges = np.linspace(norm.vmin, norm.vmax, 255)
+    # lookup table: one colour per bin between edges, plus under / over
+    width = edges[-1] - edges[0]
+    points = np.concatenate([[edges[0] - width], (edges[:-1] + edges[1:]) / 2,
+                             [edges[-1] + width]])
+    lut = (cmap(norm(points)) * 255).astype(np.uint8)
+    return dict(edges=edges, lut=lut)
+
+
+def _nearest(coord, values):
+    # coord is monotonic (ascending or descending)
+    order = np.argsort(coord)
+    pos = np.clip(np.searchsorted(coord[order], values), 1, len(coord) - 1)
+    left, right = order[pos - 1], order[pos]
+    idx = np.where(np.abs(coord[left] - values) <= np.abs(coord[right] - values),
+                   left, right)
+    half = np.abs(np.diff(coord)).max() / 2
+    outside = (values < coord.min() - half) | (values > coord.max() + half)
+    return np.where(outside, -1, idx)
+
+
+def image_index(lats, lons, boundaries, height=IMAGE_HEIGHT):
+    """Grid indices of image pixels (equirectangular image of boundaries)"""
+    west, east, south, north = boundaries
+    width = int(round(height * (east - west) / (north - south)))
+    pix_lat = north - (np.arange(height) + 0.5) * (north - south) / height
+    pix_lon = west + (np.arange(width) + 0.5) * (east - west) / width
+    return _nearest(lats, pix_lat), _nearest(lons, pix_lon)
+
+
+def tile_indices(lats, lons, boundaries, zoom):
+    """Grid indices of pixels of all Web Mercator tiles of a zoom level
+
+    Returns
+    -------
+    dict
+        (x, y) -> (row index, column index) of grid cells for each pixel
+    """
+    west, east, south, north = boundaries
+    n = 2 ** zoom
+
+    def tile_x(lon):
+        return int(np.clip((lon + 180) / 360 * n, 0, n - 1))
+
+    def tile_y(lat):
+        lat = np.deg2rad(np.clip(lat, -85.0511, 85.0511))
+        return int(np.clip((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n, 0, n - 1))
+
+    result = {}
+    pix = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    for x in range(tile_x(west), tile_x(east) + 1):
+        pix_lon = (x + pix) / n * 360 - 180
+        cols = _nearest(lons, pix_lon)
+        for y in range(tile_y(north), tile_y(south) + 1):
+            pix_lat = np.rad2deg(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pix) / n))))
+            result[(x, y)] = (_nearest(lats, pix_lat), cols)
+    return result
+
+
+def to_rgba(values, color_setup):
+    """Map data values to RGBA using lookup table of colour bins (NaN and
+    out-of-grid pixels are transparent)"""
+    bins = np.searchsorted(color_setup["edges"], values, side="right")
+    rgba = color_setup["lut"][bins]
+    rgba[~np.isfinite(values), 3] = 0
+    return rgba
+
+
+def _sample(frame, rows, cols):
+    values = frame[np.clip(rows, 0, None)[:, None], np.clip(cols, 0, None)[None, :]]
+    values[(rows < 0)[:, None] | (cols < 0)[None, :]] = np.nan
+    return values
+
+
+def render_frame(frame, path, color_setup, index, tiles=None, tile_dir=None):
+    """Render one frame as image (and tiles)"""
+    from PIL import Image
+
+    Image.fromarray(to_rgba(_sample(frame, *index), color_setup)).save(path)
+    for (zoom, x, y), (rows, cols) in (tiles or {}).items():
+        tile_path = os.path.join(tile_dir, str(zoom), str(x), f"{y}.png")
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        Image.fromarray(to_rgba(_sample(frame, rows, cols), color_setup)).save(tile_path)
+    return path
+
+
+#: Rendering state of worker processes (cf. :func:`_init_worker`)
+_WORKER = {}
+
+
+def _init_worker(color_setup, index, tiles):
+    # called once per worker process, so that the colour setup and index
+    # arrays are not sent with every frame
+    _WORKER.update(color_setup=color_setup, index=index, tiles=tiles)
+
+
+def _render_worker(frame, path, tile_dir):
+    return render_frame(frame, path, _WORKER["color_setup"], _WORKER["index"],
+                        _WORKER["tiles"], tile_dir)
+
+
+def frame_hash(date, files, settings):
+    """Hash of a frame from its date, the input files of its year and the
+    plot settings"""
+    content = json.dumps([date, files, settings], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _up_to_date(manifest, year, files, settings, framedir, fmt):
+    dates = [date for date in manifest if date.startswith(str(year))]
+    return bool(dates) and all(
+        manifest[date] == frame_hash(date, files, settings)
+        and os.path.exists(os.path.join(framedir, f"{date}.{fmt}"))
+        for date in dates)
+
+
+def render_variable(entry, var_name, freq, years, boundaries, framedir, fmt="png",
+                    zoom_levels=None, n_workers=1, force=False):
+    """Render outdated overlay frames of one entry and variable
+
+    Parameters
+    ----------
+    entry : tuple
+        (entry name, data id, data dir, ts_type read), cf. :func:`get_entries`
+    var_name : str
+        variable
+    freq : str
+        frequency of frames
+    years : list
+        years covered by the experiment
+    boundaries : tuple
+        west, east, south, north
+    framedir : str
+        output directory
+    fmt : str
+        image format
+    zoom_levels : list, optional
+        zoom levels of map tiles (default: no tiles)
+    n_workers : int
+        number of processes rendering frames
+    force : bool
+        if True, unchanged frames are rendered, too
+
+    Returns
+    -------
+    tuple
+        number of frames and number of rendered frames
+    """
+    _, data_id, data_dir, ts_type_read = entry
+    color_setup = get_color_setup(var_name)
+    settings = dict(boundaries=boundaries, fmt=fmt, zoom_levels=zoom_levels, freq=freq,
+                    lut=color_setup["lut"].tolist(), edges=color_setup["edges"].tolist())
+    os.makedirs(framedir, exist_ok=True)
+    manifest_path = os.path.join(framedir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    files = source_files(data_id, data_dir, var_name, years)
+    outdated = [year for year in sorted(files)
+                if force or not _up_to_date(manifest, year, files[year], settings,
+                                            framedir, fmt)]
+    skipped = {str(year) for year in files if year not in outdated}
+    num_frames = sum(date[:4] in skipped for date in manifest)
+    num_rendered = 0
+    pool, initialised = None, False
+    try:
+        for year in outdated:
+            data = read_frames(data_id, data_dir, ts_type_read, var_name, freq,
+                               year, year + 1, boundaries)
+            if not initialised:
+                # computed once, reused for all frames (same grid in all years)
+                lats = data[data.dims[-2]].values
+                lons = data[data.dims[-1]].values
+                index = image_index(lats, lons, boundaries)
+                tiles = {(z, *xy): idx for z in zoom_levels or []
+                         for xy, idx in tile_indices(lats, lons, boundaries, z).items()}
+                if n_workers > 1:
+                    pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                               initargs=(color_setup, index, tiles))
+                else:
+                    _init_worker(color_setup, index, tiles)
+                initialised = True
+            todo = []
+            for i, time in enumerate(data.time.values):
+                date = str(time)[:10].replace("-", "")
+                frame = data.isel(time=i).values.astype(np.float32)
+                todo.append((date, (frame, os.path.join(framedir, f"{date}.{fmt}"),
+                                    os.path.join(framedir, "tiles", date))))
+            if pool is not None:
+                futures = [pool.submit(_render_worker, *args) for _, args in todo]
+                for future in futures:
+                    future.result()
+            else:
+                for _, args in todo:
+                    _render_worker(*args)
+            for date in [d for d in manifest if d.startswith(str(year))]:
+                del manifest[date]
+            manifest.update((date, frame_hash(date, files[year], settings))
+                            for date, _ in todo)
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            num_frames += len(todo)
+            num_rendered += len(todo)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return num_frames, num_rendered
+
+
+def render_overlay_maps(cfg_file, cfg_name="CFG", n_workers=1, zoom_levels=None,
+                        force=False):
+    """Render overlay frames of all entries, variables and time steps
+
+    Parameters
+    ----------
+    cfg_file : str
+        python file defining the experiment config
+    cfg_name : str
+        name of config dict in cfg_file
+    n_workers : int
+        number of processes rendering frames
+    zoom_levels : list, optional
+        zoom levels of map tiles (default: no tiles)
+    force : bool
+        if True, unchanged frames are rendered, too
+
+    Returns
+    -------
+    int
+        number of rendered frames
+    """
+    cfg, _ = load_cfg(cfg_file, cfg_name)
+    freq = cfg.get("maps_freq", "monthly")
+    fmt = cfg.get("overlay_save_format", "png")
+    boundaries = get_boundaries(cfg)
+    years = [int(y) for p in cfg["periods"] for y in str(p).split("-")]
+    years = list(range(min(years), max(years) + 1))
+    outdir = os.path.join(cfg["json_basedir"], cfg["proj_id"], cfg["exp_id"],
+                          "overlay_frames")
+
+    num_rendered = 0
+    for name, data_id, data_dir, ts_type_read, var_names in get_entries(cfg):
+        for var_name in var_names:
+            framedir = os.path.join(outdir, f"{name}-{var_name}")
+            num_frames, num = render_variable(
+                (name, data_id, data_dir, ts_type_read), var_name, freq, years,
+                boundaries, framedir, fmt, zoom_levels, n_workers, force)
+            print(f"{name} / {var_name}: {num_frames} frames, {num} rendered")
+            num_rendered += num
+    return num_rendered
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render overlay maps of an experiment")
+    parser.add_argument("cfg_file", help="Python file defining the experiment config")
+    parser.add_argument("--cfg-name", default="CFG", help="Name of config dict in cfg_file")
+    parser.add_argument("--n-workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes rendering frames")
+    parser.add_argument("--tiles", nargs="+", type=int, default=None, metavar="ZOOM",
+                        help="Also write map tiles for these zoom levels")
+    parser.add_argument("--force", action="store_true", help="Render unchanged frames, too")
+    args = parser.parse_args()
+
+    render_overlay_maps(args.cfg_file, args.cfg_name, args.n_workers, args.tiles, args.force)
@@ -0,0 +1,322 @@
+"""
+Incrementally update an aeroval experiment when input data changed
+
+Rerunning a full experiment with reanalyse_existing=True (e.g. each year
+when a new data year arrives) recomputes all colocations and JSON files.
+This script computes a fingerprint for each (obs, var, model, period)
+of the experiment, from
+
+- the model files that are read for the variable (including the inputs of
+  derived variables in model_read_aux), restricted to the years of the
+  period (path, size and modification time),
+- the data revision of the observation dataset, and
+- the config entries that affect the results of the combination,
+
+and reruns only the periods whose fingerprint changed since the last run:
+the combination is re-colocated for the full time range of the experiment
+(so that time series stay complete), but statistics, maps and scatter
+plots are only recomputed for the outdated periods, and the statistics of
+the other periods are kept in the heatmap files. The output of all other
+combinations is left untouched. Fingerprints are stored next to the JSON output of the
+experiment (<json_basedir>/<proj_id>/<exp_id>/.fingerprints.json), so they
+are removed together with the output they describe (e.g. by a full run
+with clear_existing_json=True), and are updated after each successful job,
+so an interrupted update can be continued.
+
+Note that the data revision of an observation network is not resolved by
+year: a new data year of a network marks all periods of all combinations
+of that network as outdated, while new model files only affect the
+periods that cover them. Statistics of periods that are removed from the
+config remain in the heatmap files until a full run.
+
+The config file must define a dict CFG and must not run the experiment on
+import (see run_parallel.py).
+
+Usage:
+
+python run_incremental.py my_cfg.py --dry-run   # list outdated periods
+python run_incremental.py my_cfg.py
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pyaerocom.aeroval import EvalSetup, ExperimentProcessor
+
+from read_cache import count_reads, get_read_cache
+from read_dependencies import build_read_graph
+from run_parallel import get_jobs, load_cfg
+
+#: config entries that do not affect the results of a combination
+IGNORE_KEYS = {
+    "obs_cfg", "model_cfg", "periods", "clear_existing_json", "reanalyse_existing",
+    "raise_exceptions", "exp_name", "exp_descr", "exp_pi", "public",
+}
+
+#: Name of file storing the fingerprints in the output directory of an
+#: experiment
+STATE_FILE = ".fingerprints.json"
+
+
+# %%
+def get_state_file(cfg):
+    """File storing the fingerprints of an experiment"""
+    json_basedir = cfg.get("json_basedir")
+    if json_basedir is None:
+        json_basedir = EvalSetup(**cfg).path_manager.json_basedir
+    return os.path.join(json_basedir, cfg["proj_id"], cfg["exp_id"],
+                        STATE_FILE)
+
+
+def load_state(cfg):
+    path = get_state_file(cfg)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(cfg, state):
+    path = get_state_file(cfg)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def _job_key(obs_name, var_name, model_name, period):
+    return f"{obs_name}/{var_name}/{model_name}/{period}"
+
+
+def _json_default(obj):
+    # e.g. custom functions in model_read_aux
+    if callable(obj):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', repr(obj))}"
+    return str(obj)
+
+
+def get_years(periods):
+    """Range of years covered by periods (e.g. ["2010", "2005-2015"])"""
+    years = [int(y) for period in periods for y in str(period).split("-")]
+    return min(years), max(years)
+
+
+def model_files(model_cfg, var_names, years):
+    """Model files read for variables (path, size, mtime), sorted by path
+
+    Uses the file inventory of ReadGridded, if available for the model,
+    else all files in model_data_dir.
+    """
+    files = []
+    try:
+        from pyaerocom.io import ReadGridded
+
+        reader = ReadGridded(model_cfg["model_id"],
+                             data_dir=model_cfg.get("model_data_dir"))
+        info = reader.file_info
+        info = info[info["var_name"].isin(var_names)]
+        if "year" in info:
+            info = info[info["year"].between(*years)]
+        files = [os.path.join(reader.data_dir, f) for f in info["filename"]]
+    except Exception:
+        data_dir = model_cfg.get("model_data_dir")
+        if data_dir is None:
+            raise
+        for root, _, names in os.walk(data_dir):
+            files.extend(os.path.join(root, name) for name in names)
+    result = []
+    for path in sorted(set(files)):
+        stat = os.stat(path)
+        result.append([path, stat.st_size, stat.st_mtime])
+    return result
+
+
+def _get(obs_cfg, key):
+    # obs entries may be dicts or ObsEntry objects (cf. get_jobs)
+    return obs_cfg.get(key) if isinstance(obs_cfg, dict) else getattr(obs_cfg, key, None)
+
+
+def obs_revision(obs_cfg):
+    """Data revision of an observation dataset"""
+    obs_id = _get(obs_cfg, "obs_id")
+    if _get(obs_cfg, "obs_type") == "pyaro" or _get(obs_cfg, "pyaro_config"):
+        # pyaro readers do not provide revisions, use config only
+        return None
+    try:
+        from pyaerocom.io import ReadUngridded
+
+        return str(ReadUngridded(obs_id).get_lowlevel_reader(obs_id).data_revision)
+    except Exception as e:
+        print(f"Warning: could not determine revision of {obs_id} ({e})")
+        return None
+
+
+def compute_fingerprints(cfg):
+    """Fingerprints of all (obs, var, model, period) of an experiment
+
+    Returns
+    -------
+    dict
+        "<obs_name>/<var_name>/<model_name>/<period>" -> fingerprint
+    """
+    settings = {k: v for k, v in cfg.items() if k not in IGNORE_KEYS}
+    revisions, files, fingerprints = {}, {}, {}
+    for obs_name, var_name in get_jobs(cfg):
+        obs_cfg = cfg["obs_cfg"][obs_name]
+        if obs_name not in revisions:
+            revisions[obs_name] = obs_revision(obs_cfg)
+        for model_name, model_cfg in cfg["model_cfg"].items():
+            model_var = model_cfg.get("model_use_vars", {}).get(var_name, var_name)
+            read_vars = sorted(build_read_graph(model_cfg, [(var_name, model_var)]))
+            for period in cfg["periods"]:
+                years = get_years([period])
+                key = (model_name, tuple(read_vars), years)
+                if key not in files:
+                    files[key] = model_files(model_cfg, read_vars, years)
+                content = json.dumps(
+                    [settings, obs_cfg, model_cfg, revisions[obs_name], files[key]],
+                    sort_keys=True, default=_json_default)
+                fingerprints[_job_key(obs_name, var_name, model_name, period)] = \
+                    hashlib.sha1(content.encode()).hexdigest()
+    return fingerprints
+
+
+def get_outdated(fingerprints, state, force=False):
+    """Outdated periods of each combination
+
+    Parameters
+    ----------
+    fingerprints : dict
+        current fingerprints, cf. :func:`compute_fingerprints`
+    state : dict
+        fingerprints of the last run
+    force : bool
+        if True, all periods are outdated
+
+    Returns
+    -------
+    dict
+        (obs_name, var_name, model_name) -> list of outdated periods
+    """
+    outdated = defaultdict(list)
+    for key, fp in fingerprints.items():
+        if force or state.get(key) != fp:
+            obs_name, var_name, model_name, period = key.split("/", 3)
+            outdated[(obs_name, var_name, model_name)].append(period)
+    return dict(outdated)
+
+
+def merge_periods(old, new):
+    """Heatmap statistics of a model variable with new periods replaced
+
+    Parameters
+    ----------
+    old, new : dict
+        region -> "<period>-<season>" -> statistics
+    """
+    return {region: {**old.get(region, {}), **new.get(region, {})}
+            for region in {**old, **new}}
+
+
+@contextmanager
+def keep_other_periods():
+    """Keep heatmap statistics of periods that are not recomputed
+
+    aeroval replaces the statistics of all periods of a model variable in
+    the heatmap files (ExperimentOutput.add_heatmap_entry). While in this
+    context, new statistics are merged into the existing ones instead.
+    """
+    from pyaerocom.aeroval.experiment_output import ExperimentOutput
+
+    original = ExperimentOutput.add_heatmap_entry
+
+    def add_heatmap_entry(self, entry, frequency, network, obsvar, layer, modelname, modvar):
+        old = self.avdb.get_glob_stats(self.proj_id, self.exp_id, frequency, default={})
+        for key in (obsvar, network, layer, modelname, modvar):
+            old = old.get(key, {})
+        original(self, merge_periods(old, entry), frequency, network, obsvar, layer,
+                 modelname, modvar)
+
+    ExperimentOutput.add_heatmap_entry = add_heatmap_entry
+    try:
+        yield
+    finally:
+        ExperimentOutput.add_heatmap_entry = original
+
+
+def run_incremental(cfg_file, cfg_name="CFG", dry_run=False, force=False):
+    """Rerun periods of combinations of an experiment whose inputs changed
+
+    Parameters
+    ----------
+    cfg_file : str
+        python file defining the experiment config
+    cfg_name : str
+        name of config dict in cfg_file
+    dry_run : bool
+        if True, only print outdated periods
+    force : bool
+        if True, all periods are rerun
+
+    Returns
+    -------
+    dict
+        (obs_name, var_name, model_name) -> list of periods that were (or
+        would be) rerun
+    """
+    cfg, _ = load_cfg(cfg_file, cfg_name)
+    state = load_state(cfg)
+    fingerprints = compute_fingerprints(cfg)
+    outdated = get_outdated(fingerprints, state, force)
+    num_outdated = sum(len(periods) for periods in outdated.values())
+    print(f"{num_outdated} of {len(fingerprints)} periods outdated")
+    for (obs_name, var_name, model_name), periods in outdated.items():
+        print(f"  {model_name} / {obs_name} / {var_name}: {', '.join(periods)}")
+    if dry_run or not outdated:
+        return outdated
+
+    # only outdated combinations are run, so existing colocated data files
+    # of those can be recomputed, everything else remains untouched
+    cfg["reanalyse_existing"] = True
+    cfg["clear_existing_json"] = False
+    # colocate the full time range of the experiment, also when only some
+    # periods are outdated
+    first, last = get_years(cfg["periods"])
+    cfg.setdefault("start", first)
+    cfg.setdefault("stop", last + 1)
+    get_read_cache().add_reads(count_reads(cfg, list(outdated)))
+    procs = {}
+    with keep_other_periods():
+        for (obs_name, var_name, model_name), periods in outdated.items():
+            if tuple(periods) not in procs:
+                procs[tuple(periods)] = ExperimentProcessor(EvalSetup(**dict(cfg, periods=periods)))
+            procs[tuple(periods)].run(
+                model_name=model_name,
+                obs_name=obs_name,
+                var_list=[var_name],
+                update_interface=False,
+            )
+            for period in periods:
+                key = _job_key(obs_name, var_name, model_name, period)
+                state[key] = fingerprints[key]
+            save_state(cfg, state)
+    # remove periods and combinations that are no longer part of the experiment
+    save_state(cfg, {k: v for k, v in state.items() if k in fingerprints})
+    ExperimentProcessor(EvalSetup(**cfg)).update_interface()
+    return outdated
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update aeroval experiment")
+    parser.add_argument("cfg_file", help="Python file defining the experiment config")
+    parser.add_argument("--cfg-name", default="CFG", help="Name of config dict in cfg_file")
+    parser.add_argument("--dry-run", action="store_true", help="Only list outdated combinations")
+    parser.add_argument("--force", action="store_true", help="Rerun all combinations")
+    args = parser.parse_args()
+
+    run_incremental(args.cfg_file, args.cfg_name, args.dry_run, args.force)
@@ -0,0 +1,193 @@
+"""
+Run an aeroval experiment with several processes
+
+The (model, obs, var) combinations of an experiment are independent and
+can be colocated and written in parallel. Jobs are grouped by observation
+network and variable, i.e. each worker reads an observation dataset once
+(subsequent reads for the other models come from the pyaerocom cache) and
+runs all models for it. Since the timeseries JSON files contain all models
+of an (obs, var) combination, this also makes sure that no two processes
+write to the same timeseries file. Files shared by all jobs (e.g. the
+heatmaps) are updated under the file lock of aerovaldb. Superobs entries (is_superobs) combine
+the colocated data of their member networks and are therefore run after
+all other jobs have finished. Model maps (add_model_maps / only_model_maps)
+do not depend on the observations and are generated once at the end, before
+menu and experiment config are updated, as in the serial run.
+
+The config file must define a dict CFG (see add_custom_variables.py) and
+must not run the experiment on import (use `if __name__ == "__main__":`).
+The number of workers can be set with the CLI option --n-workers or with
+the option "n_workers" in CFG, e.g.
+
+CFG["n_workers"] = 8
+
+Usage:
+
+python run_parallel.py my_cfg.py --n-workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import runpy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pyaerocom import const
+from pyaerocom.aeroval import EvalSetup, ExperimentProcessor
+
+from read_cache import count_reads, get_read_cache
+
+
+# %%
+def load_cfg(cfg_file, cfg_name="CFG"):
+    """Load experiment config dict from python file
+
+    Returns a copy of the config without the option n_workers, which is
+    not an option of EvalSetup.
+    """
+    cfg = dict(runpy.run_path(cfg_file, run_name="cfg")[cfg_name])
+    n_workers = cfg.pop("n_workers", None)
+    return cfg, n_workers
+
+
+def _get_opt(obs_cfg, key):
+    # obs entries may be dicts or ObsEntry objects
+    return obs_cfg.get(key) if isinstance(obs_cfg, dict) else getattr(obs_cfg, key, None)
+
+
+def get_jobs(cfg):
+    """List of (obs_name, var_name) jobs of an experiment config"""
+    jobs = []
+    for obs_name, obs_cfg in cfg["obs_cfg"].items():
+        obs_vars = _get_opt(obs_cfg, "obs_vars")
+        if isinstance(obs_vars, str):
+            obs_vars = [obs_vars]
+        jobs.extend((obs_name, var_name) for var_name in obs_vars)
+    return jobs
+
+
+def split_superobs_jobs(cfg, jobs):
+    """Split jobs into jobs of regular and of superobs entries
+
+    Superobs entries (is_superobs=True) are computed from the colocated data
+    of their members, so they can only run once those jobs have finished.
+
+    Returns
+    -------
+    tuple
+        (regular jobs, superobs jobs)
+    """
+    regular, superobs = [], []
+    for obs_name, var_name in jobs:
+        if _get_opt(cfg["obs_cfg"][obs_name], "is_superobs"):
+            superobs.append((obs_name, var_name))
+        else:
+            regular.append((obs_name, var_name))
+    return regular, superobs
+
+
+def run_job(cfg_file, cfg_name, obs_name, var_name, model_names=None):
+    """Run all models for one observation network and variable
+
+    Runs in a worker process. The config is loaded in the worker, since it
+    may contain objects that cannot be pickled (e.g. custom functions in
+    model_read_aux).
+    """
+    cfg, _ = load_cfg(cfg_file, cfg_name)
+    # JSON files shared by jobs (e.g. heatmaps of all variables) are updated
+    # under a file lock of aerovaldb
+    os.environ["AVDB_USE_LOCKING"] = "1"
+    # existing output is deleted once before starting the workers
+    cfg["clear_existing_json"] = False
+    # model maps are generated once after all jobs (cf. run_model_maps)
+    cfg["add_model_maps"] = False
+    cfg["only_model_maps"] = False
+    model_names = model_names or list(cfg["model_cfg"])
+    # model inputs shared by several variables of this job are read once
+    get_read_cache().add_reads(
+        count_reads(cfg, [(obs_name, var_name, model_name) for model_name in model_names]))
+    proc = ExperimentProcessor(EvalSetup(**cfg))
+    for model_name in model_names:
+        proc.run(
+            model_name=model_name,
+            obs_name=obs_name,
+            var_list=[var_name],
+            update_interface=False,
+        )
+    return obs_name, var_name
+
+
+def run_model_maps(cfg):
+    """Generate model maps of all models and variables of an experiment"""
+    cfg = dict(cfg, only_model_maps=True, clear_existing_json=False)
+    ExperimentProcessor(EvalSetup(**cfg)).run(update_interface=False)
+
+
+def _run_jobs(cfg_file, cfg_name, jobs, n_workers):
+    if n_workers == 1:
+        for obs_name, var_name in jobs:
+            run_job(cfg_file, cfg_name, obs_name, var_name)
+        return
+    # workers are spawned, forking a process that has used threads (e.g.
+    # dask, netCDF) may deadlock
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(run_job, cfg_file, cfg_name, obs_name, var_name)
+            for obs_name, var_name in jobs
+        ]
+        for future in as_completed(futures):
+            obs_name, var_name = future.result()
+            print(f"Finished {obs_name} / {var_name}")
+
+
+def run_parallel(cfg_file, n_workers=None, cfg_name="CFG"):
+    """Run experiment defined in config file using a process pool
+
+    Parameters
+    ----------
+    cfg_file : str
+        python file defining the experiment config
+    n_workers : int, optional
+        number of worker processes (default: option n_workers in config
+        or 1)
+    cfg_name : str
+        name of config dict in cfg_file
+
+    Returns
+    -------
+    ExperimentProcessor
+        processor of the experiment (after updating the interface)
+    """
+    cfg, cfg_workers = load_cfg(cfg_file, cfg_name)
+    n_workers = n_workers or cfg_workers or 1
+    jobs = [] if cfg.get("only_model_maps", False) else get_jobs(cfg)
+    proc = ExperimentProcessor(EvalSetup(**cfg))
+    if cfg.get("clear_existing_json", False):
+        # done once here, workers must not delete each others output
+        proc.exp_output.delete_experiment_data(also_coldata=False)
+    # created once here, workers creating them concurrently may fail
+    coldata_dir = proc.cfg.path_manager.get_coldata_dir()
+    for model_name in cfg["model_cfg"]:
+        os.makedirs(os.path.join(coldata_dir, model_name), exist_ok=True)
+    if const.CACHING is False:
+        print("Warning: caching is disabled, observations will be read once per model")
+
+    # superobs entries need the colocated data of their members
+    for batch in split_superobs_jobs(cfg, jobs):
+        _run_jobs(cfg_file, cfg_name, batch, n_workers)
+    if cfg.get("add_model_maps", False) or cfg.get("only_model_maps", False):
+        run_model_maps(cfg)
+    proc.update_interface()
+    return proc
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run aeroval experiment in parallel")
+    parser.add_argument("cfg_file", help="Python file defining the experiment config")
+    parser.add_argument("--n-workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--cfg-name", default="CFG", help="Name of config dict in cfg_file")
+    args = parser.parse_args()
+
+    run_parallel(args.cfg_file, args.n_workers, args.cfg_name)
@@ -0,0 +1,232 @@
+"""
+Run an aeroval experiment in independent shards (e.g. on several nodes)
+
+The (obs, var, model) combinations of an experiment are distributed over a
+number of shards. Each shard can run as a separate process or batch job and
+writes its JSON output into its own directory below the json_basedir of
+the experiment (<json_basedir>/_shards/<shard>). Colocated data files are
+written directly into coldata_basedir (file names are unique per
+combination), so reanalyse_existing works as in a normal run. When all
+shards are finished, the merge step combines the shard outputs into
+json_basedir (JSON files written by several shards, e.g. heatmap
+statistics, are merged key by key, in shard order, and the entry of a model
+is replaced as a whole, as pyaerocom does when writing it), deletes the existing experiment output first if clear_existing_json is set,
+and updates menu and experiment config.
+
+Superobs entries (is_superobs) are computed from the colocated data of
+their members, which may be processed by any shard. They are therefore not
+part of any shard, but run in the merge step, as are the model maps
+(add_model_maps / only_model_maps).
+
+The config file must define a dict CFG and must not run the experiment on
+import (see run_parallel.py).
+
+Usage on a batch system (e.g. as array job with 10 tasks, followed by a
+dependent merge job):
+
+python run_sharded.py my_cfg.py run --num-shards 10 --shard $TASK_ID
+python run_sharded.py my_cfg.py merge --num-shards 10
+
+Usage on a single machine, with processes standing in for nodes:
+
+python run_sharded.py my_cfg.py local --num-shards 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from pyaerocom.aeroval import EvalSetup, ExperimentProcessor
+
+from read_cache import count_reads, get_read_cache
+from run_parallel import get_jobs, load_cfg, run_model_maps, split_superobs_jobs
+
+
+# %%
+def get_shard_jobs(cfg, shard, num_shards):
+    """List of (obs_name, var_name, model_name) jobs of one shard
+
+    Jobs are sorted and distributed round robin, so that every shard gets
+    the same jobs on every node. Jobs of superobs entries are run in the
+    merge step (see :func:`merge_shards`) and not included.
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Invalid shard {shard} (num_shards={num_shards})")
+    if cfg.get("only_model_maps", False):
+        return []
+    regular, _ = split_superobs_jobs(cfg, get_jobs(cfg))
+    jobs = sorted(
+        (obs_name, var_name, model_name)
+        for obs_name, var_name in regular
+        for model_name in cfg["model_cfg"]
+    )
+    return jobs[shard::num_shards]
+
+
+def get_shard_dir(cfg, shard):
+    """JSON output directory of a shard"""
+    return os.path.join(cfg["json_basedir"], "_shards", f"{shard:04d}")
+
+
+def run_shard(cfg_file, shard, num_shards, cfg_name="CFG"):
+    """Run all jobs of one shard
+
+    Parameters
+    ----------
+    cfg_file : str
+        python file defining the experiment config
+    shard : int
+        index of shard (0 <= shard < num_shards)
+    num_shards : int
+        total number of shards
+    cfg_name : str
+        name of config dict in cfg_file
+    """
+    cfg, _ = load_cfg(cfg_file, cfg_name)
+    jobs = get_shard_jobs(cfg, shard, num_shards)
+    outdir = get_shard_dir(cfg, shard)
+    # output of previous runs of this shard
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.makedirs(outdir)
+    cfg["json_basedir"] = outdir
+    cfg["clear_existing_json"] = False
+    cfg["add_model_maps"] = False
+    cfg["only_model_maps"] = False
+    get_read_cache().add_reads(count_reads(cfg, jobs))
+    proc = ExperimentProcessor(EvalSetup(**cfg))
+    for obs_name, var_name, model_name in jobs:
+        print(f"Shard {shard}: running {model_name} / {obs_name} / {var_name}")
+        proc.run(
+            model_name=model_name,
+            obs_name=obs_name,
+            var_list=[var_name],
+            update_interface=False,
+        )
+
+
+def merge_json(target, source, replace_keys=()):
+    """Recursively merge source into target dict (in place)
+
+    Values in source overwrite values in target, except for dicts, which
+    are merged. Lists are never merged. Entries of replace_keys (e.g. model
+    names, the level at which pyaerocom writes complete entries, such as
+    time series of a model or heatmap statistics of a model variable) are
+    replaced as a whole, so that no outdated values of a previous run
+    remain.
+    """
+    for key, value in source.items():
+        if (isinstance(value, dict) and isinstance(target.get(key), dict)
+                and key not in replace_keys):
+            merge_json(target[key], value, replace_keys)
+        else:
+            target[key] = value
+    return target
+
+
+def _merge_file(src, dst, replace_keys=()):
+    if not src.endswith(".json") or not os.path.exists(dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(src, dst)
+        return
+    with open(dst) as f:
+        data = json.load(f)
+    with open(src) as f:
+        new = json.load(f)
+    if isinstance(data, dict) and isinstance(new, dict):
+        data = merge_json(data, new, replace_keys)
+    else:
+        data = new
+    with open(dst, "w") as f:
+        json.dump(data, f)
+
+
+def merge_shards(cfg_file, num_shards, cfg_name="CFG", keep_shards=False):
+    """Merge output of all shards, run superobs entries and model maps and
+    update menu and experiment config
+
+    Parameters
+    ----------
+    cfg_file : str
+        python file defining the experiment config
+    num_shards : int
+        total number of shards
+    cfg_name : str
+        name of config dict in cfg_file
+    keep_shards : bool
+        if True, the shard directories are not deleted after merging
+
+    Returns
+    -------
+    ExperimentProcessor
+        processor of the experiment (after updating the interface)
+    """
+    cfg, _ = load_cfg(cfg_file, cfg_name)
+    shard_dirs = [get_shard_dir(cfg, shard) for shard in range(num_shards)]
+    missing = [d for d in shard_dirs if not os.path.isdir(d)]
+    if missing:
+        raise FileNotFoundError(f"Output of shards missing: {missing}")
+    proc = ExperimentProcessor(EvalSetup(**cfg))
+    if cfg.get("clear_existing_json", False):
+        proc.exp_output.delete_experiment_data(also_coldata=False)
+    for shard_dir in shard_dirs:
+        for root, _, files in os.walk(shard_dir):
+            for name in sorted(files):
+                src = os.path.join(root, name)
+                rel = os.path.relpath(src, shard_dir)
+                _merge_file(src, os.path.join(cfg["json_basedir"], rel),
+                            set(cfg["model_cfg"]))
+    if not cfg.get("only_model_maps", False):
+        # superobs need the colocated data of their members from all shards
+        _, superobs = split_superobs_jobs(cfg, get_jobs(cfg))
+        superobs_proc = ExperimentProcessor(EvalSetup(**dict(
+            cfg, clear_existing_json=False, add_model_maps=False)))
+        for obs_name, var_name in superobs:
+            print(f"Running superobs {obs_name} / {var_name}")
+            superobs_proc.run(obs_name=obs_name, var_list=[var_name],
+                              update_interface=False)
+    if cfg.get("add_model_maps", False) or cfg.get("only_model_maps", False):
+        run_model_maps(cfg)
+    proc.update_interface()
+    if not keep_shards:
+        shutil.rmtree(os.path.join(cfg["json_basedir"], "_shards"))
+    return proc
+
+
+def run_local(cfg_file, num_shards, cfg_name="CFG", keep_shards=False):
+    """Run all shards as separate processes on this machine and merge"""
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), cfg_file, "run",
+             "--num-shards", str(num_shards), "--shard", str(shard),
+             "--cfg-name", cfg_name]
+        )
+        for shard in range(num_shards)
+    ]
+    failed = [shard for shard, p in enumerate(procs) if p.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed")
+    return merge_shards(cfg_file, num_shards, cfg_name, keep_shards)
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run aeroval experiment in shards")
+    parser.add_argument("cfg_file", help="Python file defining the experiment config")
+    parser.add_argument("command", choices=["run", "merge", "local"])
+    parser.add_argument("--num-shards", type=int, required=True, help="Number of shards")
+    parser.add_argument("--shard", type=int, default=None, help="Shard to run (command run)")
+    parser.add_argument("--cfg-name", default="CFG", help="Name of config dict in cfg_file")
+    parser.add_argument("--keep-shards", action="store_true", help="Keep shard output after merging")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.shard is None:
+            parser.error("--shard is required for command run")
+        run_shard(args.cfg_file, args.shard, args.num_shards, args.cfg_name)
+    elif args.command == "merge":
+        merge_shards(args.cfg_file, args.num_shards, args.cfg_name, args.keep_shards)
+    else:
+        run_local(args.cfg_file, args.num_shards, args.cfg_name, args.keep_shards)
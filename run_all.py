@@ -7,11 +7,20 @@ Script used to convert all notebooks into restructured text
 #import nbformat
 import argparse
 import nbconvert, nbformat
+import pyaerocom
 from pyaerocom import const
 from nbconvert.preprocessors import ExecutePreprocessor
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, redirect_stderr
+import csv
 import fnmatch
+import hashlib
+import json
 import shutil
 import os
+import re
+import threading
+import time
 
 lustre_avail = const.has_access_lustre
 user_server_avail = const.has_access_users_database
@@ -24,6 +33,35 @@ OUT_DIR = "../pyaerocom/docs/"
 
 RUN_PREFIX = ['tut', 'add']
 
+# Directory for per-notebook execution logs (used with --jobs)
+LOG_DIR = os.path.join(SOURCE_DIR, 'logs')
+
+# File storing runtimes (in s) of previous executions, used to start the
+# longest running notebooks first when executing in parallel
+RUNTIMES_FILE = os.path.join(SOURCE_DIR, '.runtimes.json')
+
+# Directory where per-notebook cell profiles are stored (used with --profile)
+PROFILE_DIR = os.path.join(SOURCE_DIR, 'profile')
+
+# Combined cell profiling report (written as .json and .csv)
+PROFILE_REPORT = 'profile_report'
+
+# Fields of cell profiling records
+PROFILE_FIELDS = ['notebook', 'index', 'execution_count', 'wall_time', 
+                  'cpu_time', 'peak_rss_mb', 'source']
+
+# File storing content hashes of notebooks that were successfully executed
+# and converted (notebooks with unchanged hash are not rebuilt)
+BUILD_CACHE_FILE = os.path.join(SOURCE_DIR, '.build_cache.json')
+
+# Working directory of the kernel when executing notebooks (relative paths 
+# in notebooks are resolved against it)
+EXEC_PATH = '.'
+
+# Regular expression used to find string literals in code cells that may
+# refer to input files
+_STRING_LITERAL = re.compile(r"""['"]([^'"\n]+)['"]""")
+
 RUN_IF = {'add01_intro_time_handling.ipynb': lustre_avail,
           'add02_read_ebas_nasa_ames.ipynb': lustre_avail,
           'add03_ebas_database_browser.ipynb': lustre_avail,
@@ -66,16 +104,214 @@ def init_single_notebook_resources(notebook_filename):
 
     return resources
 
-def execute_and_save_notebook(file):
+def _hash_file(path, hasher):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+
+def compute_notebook_hash(notebook_filename):
+    """Compute hash that determines whether a notebook needs to be rebuilt
+
+    The hash is computed from the source of all code cells (i.e. outputs 
+    and markdown do not matter), the installed pyaerocom version and the
+    content of all existing files referenced by string literals in the code
+    cells (e.g. demo datasets). Relative paths are resolved against 
+    :attr:`EXEC_PATH`, the working directory of the kernel.
+
+    Parameters
+    ----------
+    notebook_filename : str
+        path of notebook
+
+    Returns
+    -------
+    str
+        hex digest of hash
+    """
+    with open(notebook_filename) as f:
+        nb = nbformat.read(f, as_version=4)
+    hasher = hashlib.sha256()
+    hasher.update(pyaerocom.__version__.encode())
+    for cell in nb.cells:
+        if cell.cell_type != 'code':
+            continue
+        hasher.update(cell.source.encode())
+        for ref in _STRING_LITERAL.findall(cell.source):
+            path = os.path.join(EXEC_PATH, ref)
+            if os.path.isfile(path):
+                hasher.update(ref.encode())
+                _hash_file(path, hasher)
+    return hasher.hexdigest()
+
+def load_build_cache(file=BUILD_CACHE_FILE):
+    """Load build cache (empty dict if unavailable)"""
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_build_cache(cache, file=BUILD_CACHE_FILE):
+    """Save build cache"""
+    with open(file, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+def get_output_paths(notebook_filename, outdir):
+    """Get paths of RST file and output files directory of a notebook"""
+    name = os.path.splitext(os.path.basename(notebook_filename))[0]
+    return [os.path.join(outdir, name + '.rst'), os.path.join(outdir, name)]
+
+def delete_outputs(paths):
+    """Delete files and directories (if they exist)"""
+    for item in paths:
+        if os.path.isdir(item):
+            shutil.rmtree(item)
+        elif os.path.exists(item):
+            os.remove(item)
+        else:
+            continue
+        print("Deleted: {}".format(item))
+
+def find_stale_outputs(outdir, patterns, notebooks):
+    """Find converted output in outdir that has no source notebook anymore
+
+    Parameters
+    ----------
+    outdir : str
+        output directory
+    patterns : list
+        filename patterns of converted notebooks (e.g. tut[0-9]*.ipynb)
+    notebooks : list
+        names of all available source notebooks
+
+    Returns
+    -------
+    list
+        paths of outputs without corresponding source notebook
+    """
+    names = [os.path.splitext(f)[0] for f in notebooks]
+    stale = []
+    for pattern in patterns:
+        pattern = os.path.splitext(pattern)[0] + '*'
+        for x in fnmatch.filter(os.listdir(outdir), pattern):
+            if os.path.splitext(x)[0] not in names:
+                stale.append(os.path.join(outdir, x))
+    return sorted(set(stale))
+
+class _PeakMemoryMonitor(threading.Thread):
+    """Thread that polls the resident memory of a process (and children)"""
+    def __init__(self, proc, interval=0.05):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+        
+    def _rss(self):
+        import psutil
+        try:
+            procs = [self.proc] + self.proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs)
+        except psutil.Error:
+            return 0
+        
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop_event.wait(self.interval)
+    
+    def stop(self):
+        """Stop monitoring and return peak memory in bytes"""
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, self._rss())
+
+class ProfilingExecutePreprocessor(ExecutePreprocessor):
+    """Execute preprocessor that records runtime and memory of each cell
+    
+    Wall time is measured on the client side, CPU time (user + system, 
+    including child processes) and peak resident memory are measured for
+    the kernel process using psutil. The records are accessible via
+    :attr:`cell_profiles` after execution.
+    """
+    def preprocess(self, nb, resources=None, km=None):
+        self.cell_profiles = []
+        self._kernel_proc = None
+        return super().preprocess(nb, resources, km)
+    
+    def _get_kernel_proc(self):
+        import psutil
+        if self._kernel_proc is None:
+            try:
+                pid = self.km.provisioner.pid
+            except AttributeError: # older versions of jupyter_client
+                pid = self.km.kernel.pid
+            self._kernel_proc = psutil.Process(pid)
+        return self._kernel_proc
+    
+    @staticmethod
+    def _cpu_time(proc):
+        t = proc.cpu_times()
+        return t.user + t.system + t.children_user + t.children_system
+    
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type != 'code':
+            return super().preprocess_cell(cell, resources, index)
+        proc = self._get_kernel_proc()
+        monitor = _PeakMemoryMonitor(proc)
+        monitor.start()
+        cpu0 = self._cpu_time(proc)
+        t0 = time.perf_counter()
+        try:
+            return super().preprocess_cell(cell, resources, index)
+        finally:
+            wall = time.perf_counter() - t0
+            cpu = self._cpu_time(proc) - cpu0
+            peak = monitor.stop()
+            lines = cell.source.strip().splitlines()
+            self.cell_profiles.append(dict(
+                index=index, 
+                execution_count=cell.get('execution_count'),
+                wall_time=wall,
+                cpu_time=cpu,
+                peak_rss_mb=peak / 1024**2,
+                source=lines[0] if lines else ''))
+
+def execute_and_save_notebook(file, profile_file=None):
+    """Execute notebook and save it (including output)
+    
+    Parameters
+    ----------
+    file : str
+        path of notebook
+    profile_file : str, optional
+        if specified, runtime and memory usage of each cell is recorded 
+        and written to this file (json)
+    
+    Returns
+    -------
+    bool
+        True if execution was successful, else False
+    """
     try:
         print("Executing notebook: {}".format(file))
         with open(file) as f:
             nb = nbformat.read(f, as_version=4)
-            
-        ep = ExecutePreprocessor(kernel_name="python3")
-        ep.timeout = 600
-        ep.preprocess(nb, {'metadata': {'path': '.'}})
         
+        if profile_file is not None:
+            ep = ProfilingExecutePreprocessor(kernel_name="python3")
+        else:
+            ep = ExecutePreprocessor(kernel_name="python3")
+        ep.timeout = 600
+        try:
+            ep.preprocess(nb, {'metadata': {'path': EXEC_PATH}})
+        finally:
+            if profile_file is not None:
+                name = os.path.basename(file)
+                for rec in ep.cell_profiles:
+                    rec['notebook'] = name
+                with open(profile_file, 'w') as f:
+                    json.dump(ep.cell_profiles, f, indent=2)
         
         with open(file, 'wt') as f:
             nbformat.write(nb, f)
@@ -84,7 +320,153 @@ def execute_and_save_notebook(file):
     except Exception as e:
         print("Failed: {}".format(repr(e)))
         return False
+
+def get_profile_file(notebook_filename, profile_dir=PROFILE_DIR):
+    """Get path of cell profile file of a notebook"""
+    name = os.path.splitext(os.path.basename(notebook_filename))[0]
+    return os.path.join(profile_dir, name + '.json')
+
+def write_profile_report(files, outname=PROFILE_REPORT, 
+                         profile_dir=PROFILE_DIR, top=10):
+    """Combine cell profiles of notebooks into one report
+    
+    Writes all records into <outname>.json and <outname>.csv and prints 
+    the cells with the longest wall time.
+    
+    Parameters
+    ----------
+    files : list
+        notebooks to be included (notebooks without profile are ignored)
+    outname : str
+        path of report files, without file extension
+    profile_dir : str
+        directory containing cell profiles of individual notebooks
+    top : int
+        number of cells printed in summary
+    
+    Returns
+    -------
+    list
+        all cell profile records
+    """
+    records = []
+    for f in files:
+        try:
+            with open(get_profile_file(f, profile_dir)) as fp:
+                records.extend(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    with open(outname + '.json', 'w') as fp:
+        json.dump(records, fp, indent=2)
+    with open(outname + '.csv', 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=PROFILE_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
     
+    print('\n--------------\nSLOWEST CELLS (TOP {})\n--------------\n'.format(top))
+    print('{:>9} {:>9} {:>10}  {}'.format('wall [s]', 'cpu [s]', 'peak [MB]', 
+                                         'notebook [cell]: source'))
+    for rec in sorted(records, key=lambda r: -r['wall_time'])[:top]:
+        print('{:9.2f} {:9.2f} {:10.1f}  {} [{}]: {}'.format(
+            rec['wall_time'], rec['cpu_time'], rec['peak_rss_mb'],
+            rec['notebook'], rec['index'], rec['source'][:60]))
+    print('\nProfiling report written to {}.json / .csv'.format(outname))
+    return records
+
+def execute_notebook_logged(file, logfile, profile_file=None):
+    """Execute notebook and redirect all output into a logfile
+
+    Used as worker function in the process pool when running with --jobs.
+
+    Parameters
+    ----------
+    file : str
+        path of notebook
+    logfile : str
+        path of logfile to which stdout and stderr are written
+    profile_file : str, optional
+        passed to :func:`execute_and_save_notebook`
+
+    Returns
+    -------
+    tuple
+        notebook path, success (bool) and runtime in s
+    """
+    t0 = time.time()
+    with open(logfile, 'w') as log:
+        with redirect_stdout(log), redirect_stderr(log):
+            ok = execute_and_save_notebook(file, profile_file)
+    return (file, ok, time.time() - t0)
+
+def load_runtimes(file=RUNTIMES_FILE):
+    """Load runtimes of previous executions (empty dict if unavailable)"""
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_runtimes(runtimes, file=RUNTIMES_FILE):
+    """Save runtimes of executed notebooks"""
+    with open(file, 'w') as f:
+        json.dump(runtimes, f, indent=2, sort_keys=True)
+
+def sort_by_runtime(files, runtimes):
+    """Sort notebooks such that the longest running ones come first
+
+    Notebooks without recorded runtime are put first, since they may be
+    arbitrarily slow.
+    """
+    return sorted(files, key=lambda f: -runtimes.get(f, float('inf')))
+
+def execute_notebooks_parallel(files, jobs, logdir=LOG_DIR, profile=False):
+    """Execute notebooks concurrently in a process pool
+
+    Parameters
+    ----------
+    files : list
+        notebook filenames (relative to :attr:`SOURCE_DIR`)
+    jobs : int
+        number of worker processes
+    logdir : str
+        directory where one logfile per notebook is written
+    profile : bool
+        if True, cell profiles are written into :attr:`PROFILE_DIR`
+
+    Returns
+    -------
+    tuple
+        lists of successful and failed notebooks and dictionary with
+        runtimes of all executed notebooks
+    """
+    os.makedirs(logdir, exist_ok=True)
+    success, failed, runtimes = [], [], {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for f in files:
+            fp = os.path.join(SOURCE_DIR, f)
+            logfile = os.path.join(logdir, '{}.log'.format(os.path.splitext(f)[0]))
+            print("Executing notebook: {} (log: {})".format(fp, logfile))
+            profile_file = get_profile_file(f) if profile else None
+            futures[pool.submit(execute_notebook_logged, fp, logfile, 
+                                profile_file)] = f
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                _, ok, dt = future.result()
+            except Exception as e:
+                print("Failed: {} ({})".format(f, repr(e)))
+                failed.append(f)
+                continue
+            runtimes[f] = dt
+            if ok:
+                print("Success: {} ({:.1f} s)".format(f, dt))
+                success.append(f)
+            else:
+                print("Failed: {} ({:.1f} s)".format(f, dt))
+                failed.append(f)
+    return (success, failed, runtimes)
+
 
 if __name__=="__main__":
     
@@ -103,7 +485,28 @@ if __name__=="__main__":
                         default=False,
                         help=("Delete all existing converted notebooks "
                               "in output direcory (i.e. all files and folders "
-                              "with trailing number)"))
+                              "with trailing number)). Implies --force"))
+    
+    parser.add_argument('--force', action='store_true',
+                        default=False,
+                        help=("Rebuild all notebooks, even if unchanged "
+                              "since last build"))
+    
+    parser.add_argument('--jobs', '-j', default=1, type=int,
+                        help=("Number of notebooks executed in parallel "
+                              "(output of each notebook is written into "
+                              "a logfile in {})".format(LOG_DIR)))
+    
+    parser.add_argument('--profile', action='store_true',
+                        default=False,
+                        help=("Record wall time, CPU time and peak memory of "
+                              "each executed cell and write report to "
+                              "{}.json / .csv. Implies --force, so that the "
+                              "report covers all notebooks".format(PROFILE_REPORT)))
+    
+    parser.add_argument('--profile-top', default=10, type=int,
+                        help=("Number of slowest cells listed in profiling "
+                              "summary"))
     
     args = parser.parse_args()
     
@@ -127,30 +530,61 @@ if __name__=="__main__":
                 else:
                     skipped.append(f)
         
-    success, failed = [], []
+    success, failed, unchanged = [], [], []
     conv_success, conv_fail = [], []
     if files:
         if args.clearold:
             ### DELETE OLD NOTEBOOKS (if applicable)
+            old = []
             for pattern in patterns:
+                pattern = os.path.splitext(pattern)[0] + '*'
                 matches = fnmatch.filter(os.listdir(outdir), pattern)
-            old = [os.path.join(outdir, x) for x in matches]
-            for item in old:
-                try:
-                    os.remove(item)
-                except:
-                    shutil.rmtree(item)
-                print("Deleted: {}".format(item))
+                old.extend(os.path.join(outdir, x) for x in matches)
+            delete_outputs(sorted(set(old)))
+            build_cache = {}
+        else:
+            ### DELETE OUTPUT OF REMOVED NOTEBOOKS
+            delete_outputs(find_stale_outputs(outdir, patterns, 
+                                              os.listdir(SOURCE_DIR)))
+            build_cache = load_build_cache()
+        
+        ### CHECK WHICH NOTEBOOKS CHANGED
+        hashes = {}
+        for f in files:
+            hashes[f] = compute_notebook_hash(os.path.join(SOURCE_DIR, f))
+        if not (args.force or args.clearold or args.profile):
+            unchanged = [f for f in files if build_cache.get(f) == hashes[f]
+                         and os.path.exists(get_output_paths(f, outdir)[0])]
+            files = [f for f in files if not f in unchanged]
         
         ### RUN ALL NOTEBOOKS
         EXEC = not args.noexec
         if EXEC:
-            for f in files:
-                fp = os.path.join(SOURCE_DIR, f)
-                if execute_and_save_notebook(fp):
-                    success.append(f)
-                else:
-                    failed.append(f)
+            runtimes = load_runtimes()
+            if args.profile:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+            if args.jobs > 1:
+                (success, failed, 
+                 new_runtimes) = execute_notebooks_parallel(
+                     sort_by_runtime(files, runtimes), args.jobs, 
+                     profile=args.profile)
+                runtimes.update(new_runtimes)
+                # report in the same order as for serial execution
+                success.sort(key=files.index)
+                failed.sort(key=files.index)
+            else:
+                for f in files:
+                    fp = os.path.join(SOURCE_DIR, f)
+                    t0 = time.time()
+                    profile_file = get_profile_file(f) if args.profile else None
+                    if execute_and_save_notebook(fp, profile_file):
+                        success.append(f)
+                    else:
+                        failed.append(f)
+                    runtimes[f] = time.time() - t0
+            save_runtimes(runtimes)
+            if args.profile:
+                write_profile_report(files, top=args.profile_top)
         
         if not args.noconv:                
             converter = nbconvert.RSTExporter()
@@ -161,6 +595,7 @@ if __name__=="__main__":
             for f in files:
                 fp = os.path.join(SOURCE_DIR, f)
                 try:
+                    delete_outputs(get_output_paths(fp, outdir))
                     resources = init_single_notebook_resources(fp)
                     (body, resources) = converter.from_file(fp, 
                                                             resources=resources)
@@ -170,6 +605,15 @@ if __name__=="__main__":
                 except Exception as e:
                     conv_fail.append(f)
                     print("Failed to convert {} (Error: {})".format(f, repr(e)))
+        
+        ### UPDATE BUILD CACHE (only fully rebuilt notebooks)
+        if EXEC and not args.noconv:
+            for f in files:
+                if f in success and f in conv_success:
+                    build_cache[f] = hashes[f]
+                else:
+                    build_cache.pop(f, None)
+            save_build_cache(build_cache)
          
     print('\n\n')
     print('\n--------------\nSKIPPED NOTEBOOK\n--------------\n')
@@ -177,6 +621,11 @@ if __name__=="__main__":
         print(f)
     print()
     
+    print('\n--------------\nUNCHANGED NOTEBOOK (NOT REBUILT)\n--------------\n')
+    for f in unchanged:
+        print(f)
+    print()
+    
     print('\n--------------\nEXECUTION SUCCESSFUL\n--------------\n')
     for f in success:
         print(f)
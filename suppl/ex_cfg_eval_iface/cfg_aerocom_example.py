@@ -96,10 +96,10 @@ model_config = {
             model_read_aux={
                     'od550gt1aer'   : dict(
                             vars_required=['od550dust', 'od550ss'],
-                            fun='add_cubes'),
+                            fun='add_cubes_fast'),
                     'ang4487aer'    : dict(
                             vars_required=['od550aer', 'od870aer'],
-                            fun='calc_ae')
+                            fun='calc_ae_fast')
                     },
             
     ),
@@ -113,7 +113,7 @@ model_config = {
             model_read_aux={
                 'scatc550dryaer': {'vars_required' : ['ec550dryaer', 
                                                       'abs550dryaer'],
-                                   'fun': 'subtract_cubes'}
+                                   'fun': 'subtract_cubes_fast'}
             },
     
     ),
@@ -126,7 +126,7 @@ model_config = {
             model_use_vars={'abs550aer'      : 'od550bc'},
             model_read_aux={
                     'od550gt1aer': {'vars_required' : ['od550dust', 'od550ss'],
-                                    'fun':'add_cubes'}}
+                                    'fun':'add_cubes_fast'}}
     )
 },
 
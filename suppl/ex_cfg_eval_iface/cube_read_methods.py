@@ -3,10 +3,176 @@
 """
 Additional methods that may be used to compute additional variables when reading
 gridded data
+
+The *_fast methods compute the same quantities as the methods from
+pyaerocom.io.aux_read_cubes, but directly on the data arrays of the input
+cubes, without intermediate cubes (the result is written into the data of
+the first input cube, which is returned, the second cube is not modified).
+If numba is installed, the kernels are compiled into parallel ufuncs
+(which release the GIL), else numpy ufuncs with preallocated output are
+used. Cubes with lazy data are not loaded: the result is a lazy (dask)
+expression of the same kernel. Integer data is promoted to float.
 """
-from pyaerocom.io.aux_read_cubes import (add_cubes, subtract_cubes, 
+import numpy as np
+from pyaerocom.io.aux_read_cubes import (add_cubes, subtract_cubes,
                                          compute_angstrom_coeff_cubes)
+from pyaerocom.varnameinfo import VarNameInfo
+
+try:
+    import numba
+except ImportError: # numba is optional
+    numba = None
+
+def _angstrom(od1, od2, factor):
+    return -np.log(od1 / od2) * factor
+
+def _add(a, b, scale):
+    return (a + b) * scale
+
+def _subtract(a, b, scale):
+    return (a - b) * scale
+
+def _divide(a, b, scale):
+    return a / b * scale
+
+if numba is not None:
+    _SIGS = ['float32(float32, float32, float32)',
+             'float64(float64, float64, float64)']
+
+    _KERNELS = {fun: numba.vectorize(_SIGS, target='parallel')(fun)
+                for fun in (_angstrom, _add, _subtract, _divide)}
+else:
+    def _angstrom_kernel(od1, od2, factor, out):
+        np.divide(od1, od2, out=out)
+        np.log(out, out=out)
+        return np.multiply(out, -factor, out=out)
+
+    def _add_kernel(a, b, scale, out):
+        np.add(a, b, out=out)
+        return np.multiply(out, scale, out=out)
+
+    def _subtract_kernel(a, b, scale, out):
+        np.subtract(a, b, out=out)
+        return np.multiply(out, scale, out=out)
+
+    def _divide_kernel(a, b, scale, out):
+        np.divide(a, b, out=out)
+        return np.multiply(out, scale, out=out)
+
+    _KERNELS = {_angstrom: _angstrom_kernel, _add: _add_kernel,
+                _subtract: _subtract_kernel, _divide: _divide_kernel}
+
+def _apply_lazy(fun, cube1, cube2, scalar, convert_units):
+    import dask.array as da
+
+    data2 = cube2.core_data()
+    if convert_units and cube1.units != cube2.units:
+        data2 = da.map_blocks(cube2.units.convert, da.asarray(data2),
+                              cube1.units, dtype=data2.dtype)
+    dtype = np.promote_types(np.result_type(cube1.dtype, cube2.dtype),
+                             np.float32)
+    data1 = da.asarray(cube1.core_data()).astype(dtype)
+    data2 = da.asarray(data2).astype(dtype)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return fun(data1, data2, dtype.type(scalar))
+
+def _apply_inplace(fun, cube1, cube2, scalar, convert_units=False):
+    """Apply kernel of fun to data of two cubes and write result into cube1
+
+    The names and attributes of cube1 are reset, since they describe the
+    input and not the result (as in iris cube arithmetic). If convert_units
+    is True, the data of cube2 is converted into the units of cube1 (cube2
+    itself is not modified).
+    """
+    if cube1.shape != cube2.shape:
+        raise ValueError('Cubes have different shapes: {} and {}'
+                         .format(cube1.shape, cube2.shape))
+    if cube1.has_lazy_data() or cube2.has_lazy_data():
+        cube1.data = _apply_lazy(fun, cube1, cube2, scalar, convert_units)
+    else:
+        data1 = cube1.data
+        data2 = cube2.data
+        mask = np.ma.mask_or(np.ma.getmask(data1), np.ma.getmask(data2))
+        arr1 = np.ma.getdata(data1)
+        arr2 = np.ma.getdata(data2)
+        if convert_units and cube1.units != cube2.units:
+            # returns a converted copy
+            arr2 = cube2.units.convert(arr2, cube1.units)
+        # the result is written into arr1, which is only possible (without
+        # truncation) if it is a float array of sufficient precision
+        dtype = np.promote_types(np.result_type(arr1.dtype, arr2.dtype),
+                                 np.float32)
+        arr1 = arr1.astype(dtype, copy=False)
+        arr2 = arr2.astype(dtype, copy=False)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if numba is not None:
+                _KERNELS[fun](arr1, arr2, dtype.type(scalar), out=arr1)
+            else:
+                _KERNELS[fun](arr1, arr2, dtype.type(scalar), arr1)
+        if mask is not np.ma.nomask:
+            arr1 = np.ma.masked_array(arr1, mask=mask)
+        cube1.data = arr1
+    cube1.standard_name = None
+    cube1.long_name = None
+    cube1.attributes = {}
+    return cube1
+
+def add_cubes_fast(cube1, cube2):
+    """Add data of cube2 to cube1 (fast version of add_cubes)"""
+    return _apply_inplace(_add, cube1, cube2, 1, convert_units=True)
+
+def subtract_cubes_fast(cube1, cube2):
+    """Subtract data of cube2 from cube1 (fast version of subtract_cubes)"""
+    return _apply_inplace(_subtract, cube1, cube2, 1,
+                          convert_units=True)
+
+def compute_angstrom_coeff_cubes_fast(cube1, cube2, lambda1=None,
+                                      lambda2=None):
+    """Compute Angstrom coefficient from two AOD cubes (fast version)
+
+    Parameters
+    ----------
+    cube1, cube2 : iris.cube.Cube
+        AODs at wavelengths lambda1 and lambda2 (if not provided, the
+        wavelengths are taken from the variable names)
+    lambda1, lambda2 : float, optional
+        wavelengths in nm
+
+    Returns
+    -------
+    iris.cube.Cube
+        cube1, containing the Angstrom coefficient
+    """
+    if lambda1 is None:
+        lambda1 = VarNameInfo(cube1.var_name).wavelength_nm
+    if lambda2 is None:
+        lambda2 = VarNameInfo(cube2.var_name).wavelength_nm
+    factor = 1 / np.log(lambda1 / lambda2)
+    cube1 = _apply_inplace(_angstrom, cube1, cube2, factor)
+    cube1.units = '1'
+    return cube1
+
+def dry_from_ambient_fast(cube, growth_factor):
+    """Convert ambient to dry quantity by dividing by hygroscopic growth
+
+    Parameters
+    ----------
+    cube : iris.cube.Cube
+        ambient quantity (e.g. scattering coefficient)
+    growth_factor : iris.cube.Cube
+        hygroscopic growth factor (ambient / dry), same shape as cube
+
+    Returns
+    -------
+    iris.cube.Cube
+        cube, containing the dry quantity
+    """
+    return _apply_inplace(_divide, cube, growth_factor, 1)
 
 FUNS = {'add_cubes'         : add_cubes,
         'subtract_cubes'    : subtract_cubes,
-        'calc_ae'           : compute_angstrom_coeff_cubes}
+        'calc_ae'           : compute_angstrom_coeff_cubes,
+        'add_cubes_fast'    : add_cubes_fast,
+        'subtract_cubes_fast' : subtract_cubes_fast,
+        'calc_ae_fast'      : compute_angstrom_coeff_cubes_fast,
+        'dry_from_ambient_fast' : dry_from_ambient_fast}
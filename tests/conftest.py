@@ -0,0 +1,58 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# utility scripts are not installed as package, make them importable
+for subdir in ("utils", os.path.join("evaluations", "scripts")):
+    path = os.path.join(ROOT, subdir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope="session")
+def synthetic_data(tmp_path_factory):
+    """Small synthetic model and observation data readable by pyaerocom
+
+    Two models (monthly AeroCom files of concpm10 and concpm25, 2010-2011)
+    and daily observations of 4 stations in a CSV file that is read with
+    the pyaro csv_timeseries reader (obs_id "synobs").
+    """
+    np = pytest.importorskip("numpy")
+    pd = pytest.importorskip("pandas")
+    xr = pytest.importorskip("xarray")
+    PyaroConfig = pytest.importorskip("pyaerocom.io.pyaro.pyaro_config").PyaroConfig
+
+    root = tmp_path_factory.mktemp("synthetic")
+    rng = np.random.default_rng(0)
+    lat = np.arange(-89.0, 90, 2.0)
+    lon = np.arange(-179.0, 180, 2.0)
+    model_dirs = {}
+    for model_id in ["TESTMODEL1", "TESTMODEL2"]:
+        model_dirs[model_id] = path = root / model_id / "renamed"
+        path.mkdir(parents=True)
+        for year in [2010, 2011]:
+            time = pd.date_range(f"{year}-01-01", periods=12, freq="MS")
+            for var in ["concpm10", "concpm25"]:
+                values = rng.random((len(time), len(lat), len(lon))).astype("float32") * 20
+                data = xr.DataArray(values, dims=("time", "lat", "lon"), name=var,
+                                    coords=dict(time=time, lat=lat, lon=lon),
+                                    attrs=dict(units="ug m-3"))
+                data.lat.attrs.update(units="degrees_north", standard_name="latitude")
+                data.lon.attrs.update(units="degrees_east", standard_name="longitude")
+                data.to_dataset().to_netcdf(
+                    path / f"aerocom3_{model_id}_{var}_Surface_{year}_monthly.nc")
+
+    stations = [("S1", 10.5, 59.5), ("S2", 5.2, 45.1), ("S3", -70.3, 40.7), ("S4", 120.0, 30.0)]
+    days = pd.date_range("2010-01-01", "2011-12-31", freq="D")
+    rows = [(var, name, lon, lat, rng.random() * 20, "ug m-3", day, day + pd.Timedelta("1D"))
+            for var in ["concpm10", "concpm25"] for name, lon, lat in stations for day in days]
+    obs_file = root / "obs.csv"
+    pd.DataFrame(rows).to_csv(obs_file, header=False, index=False)
+    pyaro_config = PyaroConfig(name="synobs", reader_id="csv_timeseries",
+                               filename_or_obj_or_url=str(obs_file), filters={})
+    return SimpleNamespace(root=root, model_dirs=model_dirs, obs_file=obs_file,
+                           pyaro_config=pyaro_config)
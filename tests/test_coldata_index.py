@@ -0,0 +1,30 @@
+from coldata_index import parse_filename, query, update_index
+
+NAME = ("od550bc_abs550aer_MOD-TM5_AP3-CTRL_REF-AeronetSunV3L2.daily"
+        "_20100101_20101231_monthly_WORLD-wMOUNTAINS")
+
+
+def test_parse_filename():
+    meta = parse_filename(f"{NAME}.nc")
+    assert meta["mod_var"] == "od550bc" and meta["obs_var"] == "abs550aer"
+    assert meta["model_id"] == "TM5_AP3-CTRL"
+    assert meta["obs_id"] == "AeronetSunV3L2.daily"
+    assert (meta["start"], meta["stop"]) == ("2010-01-01", "2010-12-31")
+    assert (meta["ts_type"], meta["filter_name"]) == ("monthly", "WORLD-wMOUNTAINS")
+    assert meta["layer_start"] is None and meta["layer_end"] is None
+
+
+def test_parse_filename_vertical_layer():
+    meta = parse_filename(f"{NAME}_0.0-2.5km.nc")
+    assert meta["filter_name"] == "WORLD-wMOUNTAINS"
+    assert (meta["layer_start"], meta["layer_end"]) == (0.0, 2.5)
+
+
+def test_index_profile_files(tmp_path):
+    exp = tmp_path / "exp"
+    exp.mkdir()
+    for suffix in ("", "_0-2km", "_2-4km"):
+        (exp / f"{NAME}{suffix}.nc").touch()
+    assert update_index(str(tmp_path), read_headers=False) == (3, 0)
+    records = query(str(tmp_path), obs_var="abs550aer", layer_start=2.0)
+    assert [r["path"].endswith("_2-4km.nc") for r in records] == [True]
@@ -0,0 +1,82 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("dask")
+
+from coldata_lazy import calc_statistics_lazy, open_coldata, to_netcdf_chunked
+
+
+def _coldata(obs, mod):
+    return xr.DataArray(
+        np.stack([obs, mod]),
+        dims=("data_source", "time", "station_name"),
+        coords={"data_source": ["obs", "mod"],
+                "station_name": [f"s{i}" for i in range(obs.shape[1])]},
+        attrs={"ts_type": "hourly", "var_name": "concpm10"},
+    ).chunk({"time": 1000})
+
+
+def test_float32_precision():
+    rng = np.random.default_rng(0)
+    obs = (1000 + rng.random((20000, 3))).astype(np.float32)
+    mod = (obs + rng.normal(0, 0.1, obs.shape)).astype(np.float32)
+    stats = calc_statistics_lazy(_coldata(obs, mod))
+    o, m = obs.astype(np.float64).ravel(), mod.astype(np.float64).ravel()
+    assert stats["refdata_std"] == pytest.approx(o.std(), rel=1e-6)
+    assert stats["R"] == pytest.approx(np.corrcoef(o, m)[0, 1], rel=1e-6)
+    assert stats["nmb"] == pytest.approx((m - o).sum() / o.sum(), rel=1e-6)
+
+
+def test_min_num_valid():
+    obs = np.array([[1.0, 1.0], [2.0, np.nan], [3.0, np.nan]])
+    mod = np.array([[2.0, 2.0], [2.0, 1.0], [4.0, 1.0]])
+    stats = calc_statistics_lazy(_coldata(obs, mod), dim="time", min_num_valid=2)
+    np.testing.assert_allclose(stats.nmb.values, [2 / 6, np.nan])
+    np.testing.assert_allclose(stats.num_valid.values, [3, 1])
+
+
+def test_totnum_counts_all_points():
+    rng = np.random.default_rng(1)
+    obs = rng.random((100, 5))
+    obs[:3] = np.nan
+    stats = calc_statistics_lazy(_coldata(obs, rng.random((100, 5))))
+    assert stats["totnum"] == 500
+    assert stats["num_valid"] == 485
+
+
+SAVENAME = ("concpm10_concpm10_MOD-EMEP_REF-EBAS_20100101_20101231_hourly_"
+            "ALL-wMOUNTAINS.nc")
+META = {"min_num_obs": {"daily": {"hourly": 6}}, "filter_name": "ALL-wMOUNTAINS",
+        "obs_is_clim": None, "ts_type": "hourly", "var_name": ["concpm10", "concpm10"]}
+
+
+def _located(obs, mod):
+    data = _coldata(obs, mod).compute()
+    n = obs.shape[1]
+    data = data.assign_coords(
+        time=np.datetime64("2010-01-01T00", "h") + np.arange(obs.shape[0]),
+        latitude=("station_name", np.linspace(40, 60, n)),
+        longitude=("station_name", np.linspace(0, 20, n)))
+    data.attrs.update(META)
+    return data.rename("concpm10")
+
+
+def test_netcdf_round_trip(tmp_path):
+    pyaerocom = pytest.importorskip("pyaerocom")
+    rng = np.random.default_rng(2)
+    data = _located(rng.random((24, 3)), rng.random((24, 3)))
+    path = tmp_path / SAVENAME
+    to_netcdf_chunked(data, path)
+    coldata = pyaerocom.ColocatedData(data=str(path))
+    assert coldata.data.attrs["min_num_obs"] == META["min_num_obs"]
+    assert coldata.data.attrs["obs_is_clim"] is None
+
+    # files written by pyaerocom
+    other = tmp_path / "pyaerocom"
+    other.mkdir()
+    pyaerocom.ColocatedData(data=data).to_netcdf(str(other), savename=SAVENAME)
+    lazy = open_coldata(str(other / SAVENAME))
+    assert lazy.data.attrs["min_num_obs"] == META["min_num_obs"]
+    assert lazy.data.attrs["obs_is_clim"] is None
+    assert not any(key.startswith("CONV!") for key in lazy.data.attrs)
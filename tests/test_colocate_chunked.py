@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("xarray")
+
+from colocate_chunked import MARKER_DIR, block_complete, get_time_blocks
+
+SETUP = dict(obs_vars=["concpm10", "concpm25"], start="2010", stop="2012")
+
+
+def test_get_time_blocks():
+    blocks = get_time_blocks("2010-06-01", "2012-01-01", "yearly")
+    assert blocks == [(pd.Timestamp("2010-06-01"), pd.Timestamp("2011-01-01")),
+                      (pd.Timestamp("2011-01-01"), pd.Timestamp("2012-01-01"))]
+
+
+def test_block_complete(tmp_path):
+    block = get_time_blocks("2010", "2011")[0]
+    assert not block_complete(SETUP, block, tmp_path)
+    files = [f"concpm10__concpm10/{name}" for name in ["2010010100-2011010100.nc"]]
+    files.append("concpm25__concpm25/2010010100-2011010100.nc")
+    for rel in files:
+        (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel).touch()
+    # files without marker, e.g. run interrupted before all pairs were written
+    assert not block_complete(SETUP, block, tmp_path)
+    (tmp_path / MARKER_DIR).mkdir()
+    with open(tmp_path / MARKER_DIR / "2010010100-2011010100.json", "w") as f:
+        json.dump(dict(obs_vars=SETUP["obs_vars"], files=files), f)
+    assert block_complete(SETUP, block, tmp_path)
+    # new variable in setup
+    assert not block_complete(dict(SETUP, obs_vars=["concpm10", "concso4"]), block, tmp_path)
+    (tmp_path / files[1]).unlink()
+    assert not block_complete(SETUP, block, tmp_path)
+
+
+def test_same_as_single_colocator_run(synthetic_data, tmp_path):
+    pytest.importorskip("pyaerocom")
+    np = pytest.importorskip("numpy")
+    from pyaerocom import ColocationSetup, Colocator
+
+    from colocate_chunked import colocate_chunked
+
+    setup = dict(model_id="TESTMODEL1", obs_id="synobs", obs_vars=["concpm10", "concpm25"],
+                 pyaro_config=synthetic_data.pyaro_config,
+                 model_data_dir=str(synthetic_data.model_dirs["TESTMODEL1"]),
+                 ts_type="monthly", start="2010-01-01", stop="2012-01-01",
+                 basedir_coldata=str(tmp_path / "coldata"))
+    chunked = colocate_chunked(setup, tmp_path / "blocks", freq="yearly")
+    assert len(list((tmp_path / "blocks" / "concpm10__concpm10").glob("*.nc"))) == 2
+
+    colocator = Colocator(ColocationSetup(**dict(setup, save_coldata=False, keep_data=True)))
+    colocator.run()
+    for var in ["concpm10", "concpm25"]:
+        expected = colocator.data[var][var].data
+        expected = expected.isel(time=expected.time.values < np.datetime64("2012-01-01"))
+        assert expected.sizes["time"] == 24 and expected.sizes["station_name"] == 4
+        assert not np.isnan(expected.values).any()
+        result = chunked[var][var].data.load()
+        assert result.dims == expected.dims
+        np.testing.assert_array_equal(result.time.values, expected.time.values)
+        result = result.sel(station_name=expected.station_name.values)
+        np.testing.assert_allclose(result.values, expected.values)
+        for coord in ["latitude", "longitude"]:
+            np.testing.assert_allclose(result[coord].values, expected[coord].values)
@@ -0,0 +1,71 @@
+import importlib.util
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+iris = pytest.importorskip("iris")
+pytest.importorskip("pyaerocom")
+import iris.cube  # noqa: E402
+
+METHODS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "suppl", "ex_cfg_eval_iface", "cube_read_methods.py")
+
+
+@pytest.fixture(scope="module")
+def funs():
+    spec = importlib.util.spec_from_file_location("cube_read_methods", METHODS_FILE)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod.FUNS
+
+
+def _cube(values, units, var_name):
+    return iris.cube.Cube(np.array(values, dtype=np.float32), var_name=var_name,
+                          units=units, long_name=var_name,
+                          attributes={"source": var_name})
+
+
+def test_add_cubes_fast(funs):
+    cube1 = _cube([1, 2], "ug m-3", "concecFine")
+    cube2 = _cube([1000, 2000], "ng m-3", "concecCoarse")
+    result = funs["add_cubes_fast"](cube1, cube2)
+    np.testing.assert_allclose(result.data, [2, 4])
+    assert result.long_name is None and result.attributes == {}
+    # second input is not modified
+    assert str(cube2.units) == "ng m-3"
+    np.testing.assert_allclose(cube2.data, [1000, 2000])
+
+
+def test_fast_methods_match_iris(funs):
+    for name in ["add_cubes", "subtract_cubes"]:
+        expected = funs[name](_cube([3, 4], "1", "a"), _cube([1, 2], "1", "b"))
+        result = funs[f"{name}_fast"](_cube([3, 4], "1", "a"), _cube([1, 2], "1", "b"))
+        np.testing.assert_allclose(result.data, expected.data)
+
+
+def test_calc_ae_fast_matches_iris(funs):
+    od550 = [[0.3, 0.2], [0.1, 0.05]]
+    od870 = [[0.1, 0.08], [0.04, 0.02]]
+    expected = funs["calc_ae"](_cube(od550, "1", "od550aer"), _cube(od870, "1", "od870aer"))
+    result = funs["calc_ae_fast"](_cube(od550, "1", "od550aer"), _cube(od870, "1", "od870aer"))
+    assert np.isfinite(result.data).all()
+    np.testing.assert_allclose(result.data, expected.data, rtol=1e-6)
+
+
+def test_fast_methods_promote_integers(funs):
+    cube1 = iris.cube.Cube(np.array([1, 2]), var_name="a", units="1")
+    cube2 = iris.cube.Cube(np.array([0.5, 0.5]), var_name="b", units="1")
+    result = funs["add_cubes_fast"](cube1, cube2)
+    np.testing.assert_allclose(result.data, [1.5, 2.5])
+
+
+def test_fast_methods_keep_lazy_data(funs):
+    da = pytest.importorskip("dask.array")
+    cube1 = _cube([1, 2], "ug m-3", "concecFine")
+    cube2 = _cube([1000, 2000], "ng m-3", "concecCoarse")
+    cube1.data = da.from_array(cube1.data)
+    cube2.data = da.from_array(cube2.data)
+    result = funs["add_cubes_fast"](cube1, cube2)
+    assert result.has_lazy_data() and cube2.has_lazy_data()
+    np.testing.assert_allclose(result.data, [2, 4])
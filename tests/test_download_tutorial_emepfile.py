@@ -0,0 +1,111 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from download_tutorial_emepfile import download_file
+
+DATA = bytes(range(256)) * 400
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA, supports "Range: bytes=<start>-" requests
+
+    Options of the server: truncate_at (send only part of the data),
+    ignore_range, report_size (Content-Range of 416 responses).
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get("Range"))
+        start = 0
+        if self.headers.get("Range") and not server.ignore_range:
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+            if start >= len(DATA):
+                self.send_response(416)
+                if server.report_size:
+                    self.send_header("Content-Range", f"bytes */{len(DATA)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA) - start))
+        self.end_headers()
+        stop = len(DATA) if server.truncate_at is None else server.truncate_at
+        self.wfile.write(DATA[start:stop])
+        server.truncate_at = None
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.ranges, server.truncate_at = [], None
+    server.ignore_range, server.report_size = False, True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/file.nc"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download(server, tmp_path):
+    path = download_file(server.url, tmp_path / "file.nc", chunk_size=1000,
+                         sha256=hashlib.sha256(DATA).hexdigest())
+    assert path.read_bytes() == DATA
+    assert not (tmp_path / "file.nc.part").exists()
+
+
+def test_resume_with_range(server, tmp_path):
+    server.truncate_at = 30000
+    # connection closed before all data was sent
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download_file(server.url, tmp_path / "file.nc", chunk_size=1000)
+    part = tmp_path / "file.nc.part"
+    assert 0 < part.stat().st_size < len(DATA)
+    offset = part.stat().st_size
+    download_file(server.url, tmp_path / "file.nc")
+    assert server.ranges == [None, f"bytes={offset}-"]
+    assert (tmp_path / "file.nc").read_bytes() == DATA
+
+
+def test_restart_if_range_ignored(server, tmp_path):
+    server.ignore_range = True
+    (tmp_path / "file.nc.part").write_bytes(b"x" * 100)
+    download_file(server.url, tmp_path / "file.nc")
+    assert (tmp_path / "file.nc").read_bytes() == DATA
+
+
+@pytest.mark.parametrize("report_size", [True, False])
+def test_complete_part_file_is_verified(server, tmp_path, report_size):
+    server.report_size = report_size
+    (tmp_path / "file.nc.part").write_bytes(DATA)
+    download_file(server.url, tmp_path / "file.nc", sha256=hashlib.sha256(DATA).hexdigest())
+    assert (tmp_path / "file.nc").read_bytes() == DATA
+    # restarted if the server does not report the size
+    assert len(server.ranges) == (1 if report_size else 2)
+
+
+def test_size_mismatch(server, tmp_path):
+    part = tmp_path / "file.nc.part"
+    part.write_bytes(DATA + b"garbage")
+    with pytest.raises(IOError, match="larger"):
+        download_file(server.url, tmp_path / "file.nc")
+    assert not part.exists()
+    assert not (tmp_path / "file.nc").exists()
+
+
+def test_checksum_mismatch(server, tmp_path):
+    with pytest.raises(IOError, match="Checksum"):
+        download_file(server.url, tmp_path / "file.nc", sha256="0" * 64)
+    assert not (tmp_path / "file.nc.part").exists()
+    assert not (tmp_path / "file.nc").exists()
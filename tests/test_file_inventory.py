@@ -0,0 +1,21 @@
+import shutil
+
+from file_inventory import find_files, update_inventory
+
+FILE = "aerocom3_{}_od550aer_Column_2010_monthly.nc"
+
+
+def test_remove_dir_matches_prefix_only(tmp_path):
+    search_dir = tmp_path / "data"
+    for name in ("TM5_CTRL", "TM5xCTRL"):
+        renamed = search_dir / name / "renamed"
+        renamed.mkdir(parents=True)
+        (renamed / FILE.format(name)).touch()
+    db_path = str(tmp_path / "cache" / "file_inventory.sqlite")
+    update_inventory([str(search_dir)], db_path)
+    assert len(find_files(db_path=db_path)) == 2
+
+    # "_" is a wildcard in LIKE patterns
+    shutil.rmtree(search_dir / "TM5_CTRL")
+    update_inventory([str(search_dir)], db_path)
+    assert [rec["data_id"] for rec in find_files(db_path=db_path)] == ["TM5xCTRL"]
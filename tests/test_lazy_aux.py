@@ -0,0 +1,68 @@
+import tracemalloc
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+xr = pytest.importorskip("xarray")
+dask = pytest.importorskip("dask")
+pytest.importorskip("netCDF4")
+
+from lazy_aux import compute_aux, lazy_aux
+
+
+def calc_elecmentalcarbon(concecCoarse, concecFine):
+    # as in evaluations/scripts/add_custom_variables.py
+    elementalcarbon = concecCoarse + concecFine
+    elementalcarbon.attrs["units"] = "ug C m-3"
+    return elementalcarbon
+
+
+@pytest.fixture(scope="module")
+def hourly_file(tmp_path_factory):
+    """Three years of hourly data of two variables (EMEP names)"""
+    path = tmp_path_factory.mktemp("emep") / "Base_hour.nc"
+    time = pd.date_range("2018-01-01", "2021-01-01", freq="h", inclusive="left")
+    shape = (len(time), 10, 10)
+    rng = np.random.default_rng(1)
+    ds = xr.Dataset(
+        {var: (("time", "lat", "lon"), rng.random(shape, dtype=np.float32),
+               {"units": "ug C m-3"})
+         for var in ("SURF_ug_ECCOARSE", "SURF_ug_ECFINE")},
+        coords={"time": time, "lat": np.arange(10.0), "lon": np.arange(10.0)},
+    )
+    ds.to_netcdf(path)
+    return path, ds
+
+
+def test_lazy_aux_keeps_dask(hourly_file):
+    path, _ = hourly_file
+    with xr.open_dataset(path) as ds:
+        fun = lazy_aux(calc_elecmentalcarbon, chunks={"time": 744})
+        result = fun(ds.SURF_ug_ECCOARSE, ds.SURF_ug_ECFINE)
+        assert result.chunks is not None
+        assert result.chunks[0][0] == 744
+        assert result.attrs["units"] == "ug C m-3"
+
+
+def test_compute_aux_bounded_memory(hourly_file, tmp_path):
+    path, ds = hourly_file
+    var_bytes = ds.SURF_ug_ECCOARSE.nbytes
+    outfile = tmp_path / "elementalcarbon.nc"
+    with dask.config.set(scheduler="synchronous"):
+        tracemalloc.start()
+        try:
+            result = compute_aux(path, calc_elecmentalcarbon,
+                                 ["SURF_ug_ECCOARSE", "SURF_ug_ECFINE"],
+                                 outfile=outfile, chunks={"time": 744},
+                                 var_name="elementalcarbon")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    # loading the inputs would need two full variables (plus the result)
+    assert peak < var_bytes / 4
+    with result:
+        np.testing.assert_allclose(
+            result.isel(time=slice(9000, 9100)).values,
+            (ds.SURF_ug_ECCOARSE + ds.SURF_ug_ECFINE).isel(time=slice(9000, 9100)).values,
+            rtol=1e-6)
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+fcntl = pytest.importorskip("fcntl")
+
+from manage_cachedir import list_entries, mark_used, prune, using_cache
+
+
+def _write(path, size=100, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"0" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    os.utime(os.path.dirname(path), (mtime, mtime))
+
+
+@pytest.fixture
+def cachedir(tmp_path):
+    day = 86400
+    _write(tmp_path / "parquet" / "obs1" / "part-0.parquet", age=10 * day)
+    _write(tmp_path / "parquet" / "obs2" / "part-0.parquet", age=10 * day)
+    _write(tmp_path / "region_masks" / "abc.npz", age=10 * day)
+    _write(tmp_path / "file_inventory.sqlite", age=10 * day)
+    _write(tmp_path / "file_inventory.sqlite-journal", age=10 * day)
+    return str(tmp_path)
+
+
+def test_list_entries(cachedir):
+    entries = {os.path.relpath(path, cachedir): size
+               for path, size, _ in list_entries(cachedir)}
+    assert entries == {
+        os.path.join("parquet", "obs1"): 100,
+        os.path.join("parquet", "obs2"): 100,
+        os.path.join("region_masks", "abc.npz"): 100,
+        "file_inventory.sqlite": 200,
+    }
+
+
+def test_prune_recorded_use(cachedir):
+    mark_used(os.path.join(cachedir, "parquet", "obs1"), cachedir)
+    removed = prune(cachedir, max_age=1)
+    assert sorted(os.path.relpath(path, cachedir) for path in removed) == [
+        "file_inventory.sqlite",
+        os.path.join("parquet", "obs2"),
+        os.path.join("region_masks", "abc.npz"),
+    ]
+    assert os.path.exists(os.path.join(cachedir, "parquet", "obs1"))
+    assert not os.path.exists(os.path.join(cachedir, "file_inventory.sqlite-journal"))
+
+
+def test_prune_dry_run_while_in_use(cachedir):
+    with using_cache(cachedir):
+        removed = prune(cachedir, max_size=0, min_age=0, dry_run=True)
+    assert len(removed) == 4
+    assert len(list_entries(cachedir)) == 4
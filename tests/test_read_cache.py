@@ -0,0 +1,138 @@
+import pytest
+
+from read_cache import count_reads, disable_read_cache, enable_read_cache
+
+
+class DummyData:
+    def __init__(self, var_name, ts_type):
+        self.var_name, self.ts_type = var_name, ts_type
+
+    def copy(self):
+        return DummyData(self.var_name, self.ts_type)
+
+
+class DummyReader:
+    """Stands in for ReadGridded, computes derived variables from inputs"""
+
+    AUX = {"ang4487aer": ["od440aer", "od870aer"], "od550gt1aer": ["od550aer", "od550lt1aer"]}
+
+    reads = []
+
+    def __init__(self, data_id):
+        self.data_id = data_id
+
+    def _load_var(self, var_name, ts_type=None, start=None, stop=None,
+                  vert_which=None, rename_var=None, **kwargs):
+        DummyReader.reads.append((self.data_id, var_name, ts_type))
+        data = DummyData(var_name, ts_type)
+        if rename_var is not None:
+            data.var_name = rename_var
+        return data
+
+    def read_var(self, var_name, start=None, stop=None, ts_type=None,
+                 vert_which=None, rename_var=None):
+        for required in self.AUX.get(var_name, []):
+            self._load_var(required, ts_type, start, stop, vert_which)
+        if var_name in self.AUX:
+            return DummyData(var_name, ts_type)
+        return self._load_var(var_name, ts_type, start, stop, vert_which, rename_var)
+
+
+CFG = dict(
+    obs_cfg={"AERONET": dict(obs_vars=["od550aer", "od550gt1aer"]),
+             "MERGED": dict(obs_vars=["od550aer"], is_superobs=True)},
+    model_cfg={"TM5": dict(model_id="TM5-met2010",
+                           model_read_aux={"od550gt1aer": dict(
+                               vars_required=["od550aer", "od550lt1aer"])}),
+               "EMEP": dict(model_id="EMEP", model_use_vars={"od550gt1aer": "od550dust"})},
+)
+
+
+@pytest.fixture
+def cache():
+    DummyReader.reads = []
+    cache = enable_read_cache(cls=DummyReader)
+    yield cache
+    disable_read_cache(DummyReader)
+
+
+def test_count_reads():
+    jobs = [(obs_name, var_name, model_name)
+            for obs_name, var_name in [("AERONET", "od550aer"), ("AERONET", "od550gt1aer"),
+                                       ("MERGED", "od550aer")]
+            for model_name in ["TM5", "EMEP"]]
+    assert count_reads(CFG, jobs) == {
+        ("TM5-met2010", "od550aer"): 2, ("TM5-met2010", "od550lt1aer"): 1,
+        ("EMEP", "od550aer"): 1, ("EMEP", "od550dust"): 1}
+
+
+def test_each_input_read_once(cache):
+    cache.add_reads({("TM5", "od550aer"): 4, ("TM5", "od550lt1aer"): 2})
+    # new reader per combination, as in aeroval
+    for var in ["od550aer", "od550gt1aer", "od550aer", "od550gt1aer"]:
+        data = DummyReader("TM5").read_var(var, ts_type="monthly", start=2010)
+        assert data.var_name == var
+    assert sorted(DummyReader.reads) == [("TM5", "od550aer", "monthly"),
+                                         ("TM5", "od550lt1aer", "monthly")]
+    assert cache.hits == 4
+    # all consumers done
+    assert len(cache) == 0
+    assert not cache.remaining
+
+
+def test_evicted_after_last_consumer(cache):
+    cache.add_reads({("TM5", "od550aer"): 2})
+    reader = DummyReader("TM5")
+    first = reader.read_var("od550aer")
+    assert len(cache) == 1
+    last = reader.read_var("od550aer")
+    assert len(cache) == 0
+    assert last is not first
+    # no consumer left, read again
+    reader.read_var("od550aer")
+    assert len(DummyReader.reads) == 2
+
+
+def test_inputs_not_in_graph_not_cached(cache):
+    reader = DummyReader("TM5")
+    reader.read_var("od550aer")
+    reader.read_var("od550aer")
+    assert len(DummyReader.reads) == 2
+    assert len(cache) == 0
+
+
+def test_key(cache):
+    cache.add_reads({("TM5", "od550aer"): 10, ("EMEP", "od550aer"): 10})
+    reader = DummyReader("TM5")
+    reader.read_var("od550aer", ts_type="monthly")
+    reader.read_var("od550aer", ts_type="daily")
+    reader.read_var("od550aer", None, None, "monthly")   # positional args
+    reader.read_var("od550aer", ts_type="monthly", vert_which="Surface")
+    DummyReader("EMEP").read_var("od550aer", ts_type="monthly")
+    assert len(DummyReader.reads) == 4
+
+
+def test_rename_var_applied_to_cached_data(cache):
+    cache.add_reads({("TM5", "od550dust"): 3})
+    reader = DummyReader("TM5")
+    assert reader.read_var("od550dust").var_name == "od550dust"
+    assert reader.read_var("od550dust", rename_var="od550gt1aer").var_name == "od550gt1aer"
+    assert reader.read_var("od550dust").var_name == "od550dust"
+    assert len(DummyReader.reads) == 1
+
+
+def test_returns_copies(cache):
+    cache.add_reads({("TM5", "od550aer"): 3})
+    reader = DummyReader("TM5")
+    first = reader.read_var("od550aer")
+    first.var_name = "modified"
+    assert reader.read_var("od550aer").var_name == "od550aer"
+
+
+def test_disable(cache):
+    cache.add_reads({("TM5", "od550aer"): 2})
+    disable_read_cache(DummyReader)
+    reader = DummyReader("TM5")
+    reader.read_var("od550aer")
+    reader.read_var("od550aer")
+    assert len(DummyReader.reads) == 2
@@ -0,0 +1,75 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("pyaerocom")
+
+from region_masks import (_rect_mask, assign_stations, assign_stations_rect, get_region_masks,
+                          regional_means)
+
+LATS = np.arange(-89.0, 90, 2.0)
+LONS = np.arange(-179.0, 180, 2.0)
+
+
+def test_masks_and_weights(tmp_path):
+    masks = get_region_masks(LATS, LONS, ["EUROPE", "NAFRICA"], cachedir=str(tmp_path))
+    assert masks.regions == ["EUROPE", "NAFRICA"]
+    europe = masks["EUROPE"]
+    assert europe.shape == (len(LATS), len(LONS))
+    lat_ok = (LATS >= 40) & (LATS <= 72)
+    lon_ok = (LONS >= -10) & (LONS <= 40)
+    np.testing.assert_array_equal(europe, lat_ok[:, None] & lon_ok[None, :])
+    np.testing.assert_allclose(masks.weights.sum(axis=(1, 2)), 1)
+    assert (masks.weights[~masks.masks] == 0).all()
+    # higher weight of cells closer to the equator
+    weights = masks.weights[0][europe].reshape(lat_ok.sum(), -1)[:, 0]
+    assert (np.diff(weights) < 0).all()
+
+
+def test_disk_cache_round_trip(tmp_path, monkeypatch):
+    import region_masks
+
+    masks = get_region_masks(LATS, LONS, ["EUROPE", "NAFRICA"], cachedir=str(tmp_path))
+    monkeypatch.setattr(region_masks, "_CACHE", {})
+    loaded = get_region_masks(LATS, LONS, ["EUROPE", "NAFRICA"], cachedir=str(tmp_path))
+    assert loaded is not masks
+    assert [type(name) for name in loaded.regions] == [str, str]
+    assert loaded.regions == masks.regions
+    np.testing.assert_array_equal(loaded["NAFRICA"], masks["NAFRICA"])
+    np.testing.assert_array_equal(loaded.weights, masks.weights)
+
+
+def test_regional_means(tmp_path):
+    masks = get_region_masks(LATS, LONS, ["EUROPE"], cachedir=str(tmp_path))
+    values = np.ones((2, len(LATS), len(LONS)))
+    values[1] = 2
+    values[1, masks["EUROPE"]] = np.nan
+    values[1, np.argmax(LATS >= 40), np.argmax(LONS >= -10)] = 3
+    data = xr.DataArray(values, dims=("time", "lat", "lon"))
+    means = regional_means(data, masks)
+    assert means.dims == ("time", "region")
+    # weights renormalised to cells with data
+    np.testing.assert_allclose(means.values[:, 0], [1, 3])
+
+
+def test_date_line():
+    mask = _rect_mask(LATS, LONS, (-10, 10), (170, -170))
+    lon_ok = mask.any(axis=0)
+    assert LONS[lon_ok].tolist() == [-179, -177, -175, -173, -171, 171, 173, 175, 177, 179]
+    inside = assign_stations_rect([60, 60, 60, 0], [175, -175, 0, 175], ["RBU", "EUROPE"])
+    assert inside.tolist() == [[True, False], [True, False], [False, True], [False, False]]
+
+
+def test_region_without_range(tmp_path):
+    with pytest.raises(ValueError, match="WORLD"):
+        get_region_masks(LATS, LONS, ["WORLD"], cachedir=str(tmp_path))
+    with pytest.raises(ValueError, match="WORLD"):
+        assign_stations_rect([0], [0], ["WORLD"])
+
+
+def test_assign_stations():
+    box = pytest.importorskip("shapely").box
+    regions = {"A": box(0, 0, 10, 10), "B": box(5, 5, 20, 20), "C": box(170, -10, 180, 10)}
+    result = assign_stations([1, 6, 15, 30, 0], [1, 6, 15, 30, -185], regions)
+    # overlap: first region, -185 wrapped to 175
+    assert result.tolist() == ["A", "A", "B", None, "C"]
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("PIL")
+mpl = pytest.importorskip("matplotlib")
+
+import render_overlay_maps as rom
+
+BOUNDARIES = (-10, 10, 40, 60)
+YEARS = [2019, 2020]
+
+
+@pytest.fixture
+def fake_reader(monkeypatch):
+    files = {year: [(f"var_{year}.nc", 100, 1.0)] for year in YEARS}
+    reads = []
+
+    def read_frames(data_id, data_dir, ts_type_read, var_name, freq, start, stop,
+                    boundaries):
+        reads.append(start)
+        time = np.array([f"{start}-{m:02d}-01" for m in range(1, 13)],
+                        dtype="datetime64[ns]")
+        values = np.random.default_rng(start).random((12, 20, 20))
+        return xr.DataArray(values, dims=("time", "lat", "lon"),
+                            coords={"time": time, "lat": np.linspace(59.5, 40.5, 20),
+                                    "lon": np.linspace(-9.5, 9.5, 20)})
+
+    def color_setup(var_name):
+        edges = np.linspace(0, 1, 11)
+        lut = (mpl.colormaps["viridis"](np.linspace(0, 1, 12)) * 255).astype(np.uint8)
+        return dict(edges=edges, lut=lut)
+
+    monkeypatch.setattr(rom, "source_files", lambda *args: files)
+    monkeypatch.setattr(rom, "read_frames", read_frames)
+    monkeypatch.setattr(rom, "get_color_setup", color_setup)
+    return files, reads
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_render_variable_skips_unchanged_without_reading(fake_reader, tmp_path, n_workers):
+    files, reads = fake_reader
+    entry = ("MODEL", "MODEL-ID", None, None)
+    args = (entry, "od550aer", "monthly", YEARS, BOUNDARIES, str(tmp_path))
+    assert rom.render_variable(*args, n_workers=n_workers) == (24, 24)
+    assert reads == YEARS
+    assert os.path.exists(tmp_path / "20200101.png")
+
+    assert rom.render_variable(*args, n_workers=n_workers) == (24, 0)
+    assert reads == YEARS
+
+    # new files of one year only rerender that year
+    files[2020] = [("var_2020.nc", 200, 2.0)]
+    assert rom.render_variable(*args, n_workers=n_workers) == (24, 12)
+    assert reads == YEARS + [2020]
@@ -0,0 +1,64 @@
+import json
+import os
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyaerocom")
+
+from run_incremental import (get_outdated, get_state_file, keep_other_periods, load_state,
+                             save_state)
+
+
+def test_state_in_experiment_output(tmp_path):
+    cfg = dict(proj_id="proj", exp_id="exp", json_basedir=str(tmp_path))
+    path = get_state_file(cfg)
+    assert os.path.dirname(path) == os.path.join(str(tmp_path), "proj", "exp")
+    assert load_state(cfg) == {}
+    save_state(cfg, {"EBAS/concpm10/EMEP/2010": "abc"})
+    assert load_state(cfg) == {"EBAS/concpm10/EMEP/2010": "abc"}
+
+
+def test_get_outdated():
+    fingerprints = {"EBAS/concpm10/EMEP/2010": "a", "EBAS/concpm10/EMEP/2011": "b",
+                    "EBAS/concpm10/EMEP/2005-2011": "c", "EBAS/concpm10/TM5/2011": "d"}
+    state = {"EBAS/concpm10/EMEP/2010": "a", "EBAS/concpm10/EMEP/2011": "old",
+             "EBAS/concpm10/TM5/2011": "d"}
+    assert get_outdated(fingerprints, state) == {
+        ("EBAS", "concpm10", "EMEP"): ["2011", "2005-2011"]}
+    assert len(get_outdated(fingerprints, state, force=True)) == 2
+
+
+class FakeAvdb:
+    def __init__(self, glob_stats):
+        self.glob_stats = glob_stats
+
+    @contextmanager
+    def lock(self):
+        yield
+
+    def get_glob_stats(self, project, experiment, frequency, default=None):
+        return json.loads(json.dumps(self.glob_stats))
+
+    def put_glob_stats(self, glob_stats, project, experiment, frequency):
+        self.glob_stats = json.loads(json.dumps(glob_stats))
+
+
+def test_keep_other_periods():
+    from pyaerocom.aeroval.experiment_output import ExperimentOutput
+
+    old = {"ALL": {"2010-all": {"nmb": 0.1}, "2011-all": {"nmb": 0.2}}}
+    output = SimpleNamespace(proj_id="proj", exp_id="exp", avdb=FakeAvdb(
+        {"concpm10": {"EBAS": {"Surface": {"EMEP": {"concpm10": old}}}}}))
+    args = ("monthly", "EBAS", "concpm10", "Surface", "EMEP", "concpm10")
+    new = {"ALL": {"2011-all": {"nmb": 0.3}}, "EUROPE": {"2011-all": {"nmb": 0.4}}}
+    with keep_other_periods():
+        ExperimentOutput.add_heatmap_entry(output, new, *args)
+    stats = output.avdb.glob_stats["concpm10"]["EBAS"]["Surface"]["EMEP"]["concpm10"]
+    assert stats == {"ALL": {"2010-all": {"nmb": 0.1}, "2011-all": {"nmb": 0.3}},
+                     "EUROPE": {"2011-all": {"nmb": 0.4}}}
+    # original method restored, replaces all periods
+    ExperimentOutput.add_heatmap_entry(output, new, *args)
+    stats = output.avdb.glob_stats["concpm10"]["EBAS"]["Surface"]["EMEP"]["concpm10"]
+    assert stats == new
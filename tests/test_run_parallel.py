@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pyaerocom")
+
+from pyaerocom.aeroval import EvalSetup, ExperimentProcessor
+from run_parallel import get_jobs, load_cfg, run_parallel, split_superobs_jobs
+
+CFG = dict(
+    obs_cfg={
+        "AERONET-SDA": dict(obs_id="AeronetSDAV3Lev2.daily", obs_vars=["od550aer"],
+                            only_superobs=True),
+        "AERONET-Sun": dict(obs_id="AeronetSunV3Lev2.daily", obs_vars=["od550aer", "ang4487aer"],
+                            only_superobs=True),
+        "AERONET-MERGED": dict(obs_id=["AERONET-SDA", "AERONET-Sun"], obs_vars=["od550aer"],
+                               is_superobs=True),
+    },
+)
+
+
+def test_split_superobs_jobs():
+    regular, superobs = split_superobs_jobs(CFG, get_jobs(CFG))
+    assert regular == [("AERONET-SDA", "od550aer"), ("AERONET-Sun", "od550aer"),
+                       ("AERONET-Sun", "ang4487aer")]
+    assert superobs == [("AERONET-MERGED", "od550aer")]
+
+
+CFG_FILE = """
+from pyaerocom.io.pyaro.pyaro_config import PyaroConfig
+
+CFG = dict(
+    proj_id="proj",
+    exp_id="exp",
+    json_basedir={json_basedir!r},
+    coldata_basedir={coldata_basedir!r},
+    periods=["2010", "2010-2011"],
+    ts_type="monthly",
+    freqs=["monthly"],
+    main_freq="monthly",
+    regions_how="country",
+    raise_exceptions=True,
+    obs_cfg=dict(
+        SYN=dict(obs_id="synobs", obs_vars=["concpm10", "concpm25"], obs_vert_type="Surface",
+                 ts_type="daily", pyaro_config=PyaroConfig(
+                     name="synobs", reader_id="csv_timeseries",
+                     filename_or_obj_or_url={obs_file!r}, filters={{}})),
+    ),
+    model_cfg=dict(
+        M1=dict(model_id="TESTMODEL1", model_data_dir={model1!r}),
+        M2=dict(model_id="TESTMODEL2", model_data_dir={model2!r}),
+    ),
+)
+"""
+
+
+# entries that differ between runs (time of processing, output directories
+# in the experiment config)
+IGNORE_KEYS = {"processed_utc", "json_basedir", "coldata_basedir", "path_manager"}
+
+
+def _drop_keys(obj):
+    if isinstance(obj, dict):
+        return {k: _drop_keys(v) for k, v in obj.items() if k not in IGNORE_KEYS}
+    if isinstance(obj, list):
+        return [_drop_keys(v) for v in obj]
+    return obj
+
+
+def _read_json_tree(path):
+    result = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name)) as f:
+                result[os.path.relpath(os.path.join(root, name), path)] = _drop_keys(json.load(f))
+    return result
+
+
+def test_same_output_as_serial_run(synthetic_data, tmp_path):
+    cfg_file = tmp_path / "cfg.py"
+    cfg_file.write_text(CFG_FILE.format(
+        json_basedir=str(tmp_path / "parallel"), coldata_basedir=str(tmp_path / "coldata_parallel"),
+        obs_file=str(synthetic_data.obs_file),
+        model1=str(synthetic_data.model_dirs["TESTMODEL1"]),
+        model2=str(synthetic_data.model_dirs["TESTMODEL2"])))
+    cfg, _ = load_cfg(str(cfg_file))
+    cfg.update(json_basedir=str(tmp_path / "serial"), coldata_basedir=str(tmp_path / "coldata_serial"))
+    ExperimentProcessor(EvalSetup(**cfg)).run()
+
+    run_parallel(str(cfg_file), n_workers=2)
+
+    serial = _read_json_tree(tmp_path / "serial")
+    parallel = _read_json_tree(tmp_path / "parallel")
+    assert os.path.join("proj", "exp", "hm", "glob_stats_monthly.json") in serial
+    assert sorted(parallel) == sorted(serial)
+    for name, content in serial.items():
+        assert parallel[name] == content, name
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyaerocom")
+
+from run_sharded import _merge_file, get_shard_jobs, merge_json
+
+
+def test_get_shard_jobs_excludes_superobs():
+    cfg = dict(
+        obs_cfg={
+            "AERONET-SDA": dict(obs_id="AeronetSDAV3Lev2.daily", obs_vars=["od550aer"]),
+            "AERONET-Sun": dict(obs_id="AeronetSunV3Lev2.daily",
+                                obs_vars=["od550aer", "ang4487aer"]),
+            "AERONET-MERGED": dict(obs_id=["AERONET-SDA", "AERONET-Sun"],
+                                   obs_vars=["od550aer"], is_superobs=True),
+        },
+        model_cfg={"EMEP": {}, "TM5": {}},
+    )
+    jobs = [job for shard in range(3) for job in get_shard_jobs(cfg, shard, 3)]
+    assert len(jobs) == 6
+    assert all(obs_name != "AERONET-MERGED" for obs_name, _, _ in jobs)
+
+
+def test_merge_json():
+    target = {"od550aer": {"EMEP": [1, 2]}, "models": ["EMEP"], "n": 1}
+    source = {"od550aer": {"TM5": [3]}, "models": ["TM5", "EMEP"], "n": 2}
+    assert merge_json(target, source) == {
+        "od550aer": {"EMEP": [1, 2], "TM5": [3]}, "models": ["TM5", "EMEP"], "n": 2}
+
+
+def test_merge_file_replaces_outdated_model_entry(tmp_path):
+    existing = {
+        "EMEP": {"monthly_obs": [0.1, 0.2, 0.3], "monthly_mod": [0.5, 0.5, 0.5],
+                 "daily_obs": [1.0]},
+        "TM5": {"monthly_obs": [0.1, 0.2, 0.3], "monthly_mod": [0.4, 0.4, 0.4]},
+    }
+    new = {"EMEP": {"monthly_obs": [0.1, 0.2, 0.35], "monthly_mod": [0.6, 0.6, 0.6]}}
+    dst, src = tmp_path / "out" / "ts.json", tmp_path / "shard" / "ts.json"
+    for path, data in [(dst, existing), (src, new)]:
+        path.parent.mkdir()
+        path.write_text(json.dumps(data))
+    _merge_file(str(src), str(dst), {"EMEP", "TM5"})
+    assert json.loads(dst.read_text()) == {"EMEP": new["EMEP"], "TM5": existing["TM5"]}
@@ -0,0 +1,66 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+
+from station_grid_index import StationGridIndex, get_station_grid_index
+
+LATS = np.arange(-89.0, 90, 2.0)
+LONS = np.arange(-179.0, 180, 2.0)
+
+
+def _model(lats=LATS, lons=LONS):
+    values = np.random.default_rng(0).random((3, len(lats), len(lons)))
+    return xr.DataArray(values, dims=("time", "lat", "lon"),
+                        coords=dict(time=np.arange(3), lat=lats, lon=lons))
+
+
+def test_global_grid():
+    index = StationGridIndex.build(LATS, LONS, [59.9, -33.9, 0.2], [10.7, 151.2, 181.0],
+                                   station_names=["Oslo", "Sydney", "Dateline"])
+    assert index.lat_idx.tolist() == [74, 28, 45]
+    # 181 is wrapped to -179
+    assert index.lon_idx.tolist() == [95, 165, 0]
+    ts = index.extract(_model())
+    assert ts.dims == ("time", "station_name")
+    np.testing.assert_array_equal(ts.sel(station_name="Oslo"),
+                                  _model().sel(lat=59.9, lon=10.7, method="nearest"))
+
+
+def test_stations_outside_regional_grid():
+    lats, lons = np.arange(30.25, 72, 0.5), np.arange(-29.75, 45, 0.5)
+    # edge of the last cell is 72.0
+    index = StationGridIndex.build(lats, lons, [59.9, 10.0, 71.9, 72.1, 59.9],
+                                   [10.7, 10.7, 10.7, 10.7, -30.1],
+                                   station_names=["Oslo", "South", "North", "Arctic", "West"])
+    assert index.valid.tolist() == [True, False, True, False, False]
+    assert index.lat_idx.tolist() == [59, -1, 83, -1, -1]
+    assert index.lon_idx.tolist() == [81, -1, 81, -1, -1]
+    ts = index.extract(_model(lats, lons))
+    assert ts["station_name"].values.tolist() == ["Oslo", "North"]
+
+
+def test_stations_outside_curvilinear_grid():
+    pytest.importorskip("scipy")
+    lons, lats = np.meshgrid(np.arange(0.0, 10.5, 0.5), np.arange(50.0, 60.5, 0.5))
+    index = StationGridIndex.build(lats, lons, [55.1, 55.0, 61.0], [5.1, 12.0, 5.0])
+    assert index.valid.tolist() == [True, False, False]
+    assert (index.lat_idx[0], index.lon_idx[0]) == (10, 10)
+    ts = index.extract(_model(np.arange(50.0, 60.5, 0.5), np.arange(0.0, 10.5, 0.5)))
+    assert ts.sizes["station_name"] == 1
+
+
+def test_cache(tmp_path):
+    lats, lons = [59.9, 60.4], [10.7, 5.3]
+    index = get_station_grid_index(LATS, LONS, lats, lons, station_names=["A", "BC"],
+                                   cachedir=str(tmp_path / "grid_index"))
+    assert get_station_grid_index(LATS, LONS, lats, lons, station_names=["A", "BC"],
+                                  cachedir=str(tmp_path / "grid_index")) is index
+    # names are separated in the cache key
+    other = get_station_grid_index(LATS, LONS, lats, lons, station_names=["AB", "C"],
+                                   cachedir=str(tmp_path / "grid_index"))
+    assert other.station_names == ["AB", "C"]
+    files = list((tmp_path / "grid_index").glob("*.npz"))
+    assert len(files) == 2
+    loaded = StationGridIndex.load(files[0])
+    assert loaded.lat_idx.tolist() == index.lat_idx.tolist()
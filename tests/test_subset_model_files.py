@@ -0,0 +1,56 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("dask")
+pytest.importorskip("netCDF4")
+
+from subset_model_files import subset_file, subset_files
+
+
+@pytest.fixture
+def chunked_file(tmp_path):
+    lats = np.linspace(30, 79.5, 100)
+    lons = np.linspace(-20, 29.5, 100)
+    data = xr.Dataset(
+        {"SURF_ppb_O3": (("time", "lat", "lon"),
+                         np.random.default_rng(0).random((4, 100, 100)))},
+        coords={"time": np.arange(4), "lat": lats, "lon": lons},
+    )
+    path = tmp_path / "model.nc"
+    data.to_netcdf(path, encoding={"SURF_ppb_O3": {"chunksizes": (1, 30, 30)}})
+    return path, data
+
+
+@pytest.mark.parametrize("fmt", ["netcdf", "zarr"])
+def test_subset_file(tmp_path, chunked_file, fmt):
+    if fmt == "zarr":
+        pytest.importorskip("zarr")
+    path, data = chunked_file
+    outpath = tmp_path / ("subset.zarr" if fmt == "zarr" else "subset.nc")
+    # Scandinavia, leaves uneven chunks at the edges of the selection
+    subset_file(path, outpath, lat_range=(55, 71), lon_range=(4, 31), fmt=fmt)
+    opener = xr.open_zarr if fmt == "zarr" else xr.open_dataset
+    with opener(outpath) as sub:
+        expected = data.sel(lat=slice(55, 71), lon=slice(4, 31))
+        np.testing.assert_allclose(sub.SURF_ppb_O3.values, expected.SURF_ppb_O3.values)
+
+
+@pytest.mark.parametrize("chunks", [{"time": 1}, {"lat": 25}, {"time": 1, "lat": 500}])
+def test_subset_file_zarr_partial_chunks(tmp_path, chunked_file, chunks):
+    pytest.importorskip("zarr")
+    path, data = chunked_file
+    outpath = tmp_path / "subset.zarr"
+    subset_file(path, outpath, lat_range=(55, 71), lon_range=(4, 31), fmt="zarr",
+                chunks=chunks)
+    with xr.open_zarr(outpath) as sub:
+        expected = data.sel(lat=slice(55, 71), lon=slice(4, 31))
+        np.testing.assert_allclose(sub.SURF_ppb_O3.values, expected.SURF_ppb_O3.values)
+
+
+def test_subset_files_parallel(tmp_path, chunked_file):
+    path, data = chunked_file
+    outpaths = subset_files([path], tmp_path / "out", jobs=2, lat_range=(55, 71))
+    with xr.open_dataset(outpaths[0]) as sub:
+        np.testing.assert_allclose(sub.SURF_ppb_O3.values,
+                                   data.SURF_ppb_O3.sel(lat=slice(55, 71)).values)
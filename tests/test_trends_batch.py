@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("xarray")
+stats = pytest.importorskip("scipy.stats")
+
+from trends_batch import compute_trends_batch, sen_mk_trends, stack_station_series
+
+
+def _scipy_reference(values, slope_alpha):
+    t = np.flatnonzero(np.isfinite(values)).astype(float)
+    y = values[np.isfinite(values)]
+    slope, intercept, low, high = stats.theilslopes(y, t, alpha=slope_alpha)
+    return dict(m=slope, m_err=np.mean([abs(slope - low), abs(slope - high)]),
+                reg0=intercept + slope * t[0], pval=stats.kendalltau(t, y).pvalue)
+
+
+@pytest.mark.parametrize("nyrs", [20, 40])   # exact and asymptotic p-values
+def test_sen_mk_trends_scipy(nyrs):
+    rng = np.random.default_rng(0)
+    yearly = rng.normal(1, 0.1, (5, nyrs)) + 0.01 * np.arange(nyrs)
+    yearly[1, ::3] = np.nan
+    yearly[2, 5] = yearly[2, 9]   # tie
+    yearly[3, :nyrs - 5] = np.nan   # too few years
+    result = sen_mk_trends(yearly, slope_alpha=0.68, min_num_yrs=7)
+    for k in [0, 1, 2, 4]:
+        ref = _scipy_reference(yearly[k], 0.68)
+        for key, value in ref.items():
+            assert result[key][k] == pytest.approx(value, rel=1e-10), key
+    assert np.isnan(result["m"][3])
+    assert result["n"][3] == 5
+
+
+def test_compute_trends_batch_trends_engine():
+    pytest.importorskip("pyaerocom")
+    from pyaerocom.trends_engine import TrendsEngine
+
+    rng = np.random.default_rng(1)
+    time = pd.date_range("2000-01-01", "2019-12-01", freq="MS")
+    series = {
+        f"station{i}": pd.Series(
+            0.2 + 0.001 * i * np.arange(len(time)) / 12
+            + 0.05 * np.sin(2 * np.pi * time.month / 12) + rng.normal(0, 0.02, len(time)),
+            index=time)
+        for i in range(4)
+    }
+    # seasons are defined differently in TrendsEngine (cf. module docstring)
+    trends = compute_trends_batch(stack_station_series(series), ["2000-2019", "2005-2015"],
+                                  min_num_yrs=7)
+    for name, data in series.items():
+        for period in ["2000-2019", "2005-2015"]:
+            start, stop = (int(y) for y in period.split("-"))
+            ref = TrendsEngine.compute_trend(data, "monthly", start, stop, 7)
+            result = trends.sel(station_name=name, period=period, season="all")
+            for key in ["m", "m_err", "n", "pval", "reg0", "slp", "slp_err",
+                        "y_mean", "y_min", "y_max"]:
+                assert float(result[key]) == pytest.approx(ref[key], rel=1e-8), \
+                    (name, period, key)
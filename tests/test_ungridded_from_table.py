@@ -0,0 +1,71 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyaerocom")
+
+from ungridded_from_table import read_parquet_dataset, read_table, ungridded_from_long
+
+STATIONS = {"Oslo": (59.9, 10.7, 10.0), "Bergen": (60.4, 5.3, 20.0), "Tromso": (69.6, 18.9, 5.0)}
+
+
+@pytest.fixture
+def table():
+    """Long table (pyaro parquet layout) in random order"""
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2010-01-01", periods=20, freq="D")
+    rows = []
+    for name, (lat, lon, alt) in STATIONS.items():
+        for var, units in [("concpm10", "ug m-3"), ("concpm25", "ug m-3")]:
+            for time in times:
+                rows.append(dict(station=name, variable=var, units=units, start_time=time,
+                                 value=rng.random(), latitude=lat, longitude=lon, altitude=alt))
+    table = pd.DataFrame(rows)
+    return table.iloc[rng.permutation(len(table))].reset_index(drop=True)
+
+
+def _check_station_data(data, table, time_col="start_time"):
+    for (name, var), expected in table.groupby(["station", "variable"]):
+        stat = data.to_station_data(name, var)
+        assert stat.station_name == name
+        assert (stat.latitude, stat.longitude, stat.altitude) == STATIONS[name]
+        assert stat.var_info[var]["units"] == "ug m-3"
+        expected = expected.set_index(time_col)["value"].sort_index()
+        np.testing.assert_array_equal(stat[var].index.values, expected.index.values)
+        np.testing.assert_allclose(stat[var].values, expected.values)
+
+
+def test_csv_round_trip(table, tmp_path):
+    path = tmp_path / "table.csv"
+    table.to_csv(path, index=False)
+    long = read_table(str(path))
+    long["start_time"] = pd.to_datetime(long["start_time"])
+    data = ungridded_from_long(long, None, "daily", data_id="test", time_col="start_time")
+    assert sorted(data.unique_station_names) == sorted(STATIONS)
+    assert data.contains_vars == ["concpm10", "concpm25"]
+    _check_station_data(data, table)
+
+
+def test_parquet_round_trip(table, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "dataset"
+    path.mkdir()
+    for i in range(3):
+        table.iloc[i::3].to_parquet(path / f"part-{i}.parquet", index=False)
+    long = read_parquet_dataset(str(path), variables=["concpm10"], start="2010-01-05",
+                                stop="2010-01-15", lat_range=(59, 61))
+    data = ungridded_from_long(long, None, "daily", data_id="test")
+    expected = table[(table["variable"] == "concpm10") & (table["latitude"] < 61)
+                     & (table["start_time"] >= "2010-01-05") & (table["start_time"] < "2010-01-15")]
+    assert sorted(data.unique_station_names) == ["Bergen", "Oslo"]
+    assert data.contains_vars == ["concpm10"]
+    _check_station_data(data, expected)
+
+
+def test_sorted_table_keeps_order(table):
+    ordered = table.sort_values(["station", "variable", "start_time"])
+    data = ungridded_from_long(ordered, None, "daily", data_id="test", time_col="start_time")
+    np.testing.assert_array_equal(data._data[:, data._DATAINDEX], ordered["value"].values)
+    # same result as from unsorted table
+    unsorted = ungridded_from_long(table, None, "daily", data_id="test", time_col="start_time")
+    np.testing.assert_array_equal(unsorted._data, data._data)
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pyarrow")
+pytest.importorskip("pyaerocom")
+
+from pyaerocom.io import ReadUngridded
+
+from ungridded_parquet_cache import INFO_FILE, get_cache_dir, read_cached
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Count reads of ReadUngridded"""
+    calls = []
+    read = ReadUngridded.read
+
+    def counted(self, *args, **kwargs):
+        calls.append(kwargs)
+        return read(self, *args, **kwargs)
+
+    monkeypatch.setattr(ReadUngridded, "read", counted)
+    return calls
+
+
+def test_read_cached(synthetic_data, tmp_path, reads):
+    configs = [synthetic_data.pyaro_config]
+    data = read_cached("synobs", "concpm10", basedir=str(tmp_path), configs=configs)
+    assert len(reads) == 1
+    assert os.path.isdir(get_cache_dir("synobs", str(tmp_path), dict(configs=configs)))
+    cached = read_cached("synobs", "concpm10", start=2011, basedir=str(tmp_path),
+                         configs=configs)
+    assert len(reads) == 1
+    direct = ReadUngridded("synobs", configs=configs).read(vars_to_retrieve="concpm10")
+    for name in ["S1", "S2", "S3", "S4"]:
+        expected = direct.to_station_data(name, "concpm10")["concpm10"]
+        np.testing.assert_allclose(data.to_station_data(name, "concpm10")["concpm10"].values,
+                                   expected.values)
+        stat = cached.to_station_data(name, "concpm10")
+        assert stat.ts_type == "daily"
+        np.testing.assert_allclose(stat["concpm10"].values, expected["2011"].values)
+
+
+def test_read_kwargs_in_cache_key(synthetic_data, tmp_path, reads):
+    configs = [synthetic_data.pyaro_config]
+    read_cached("synobs", "concpm10", basedir=str(tmp_path), configs=configs)
+    filtered = read_cached("synobs", "concpm10", basedir=str(tmp_path), configs=configs,
+                           filter_post={"station_name": ["S1", "S2"]})
+    assert len(reads) == 2
+    assert sorted(filtered.unique_station_names) == ["S1", "S2"]
+    assert (get_cache_dir("synobs", str(tmp_path), dict(configs=configs))
+            != get_cache_dir("synobs", str(tmp_path),
+                             dict(configs=configs, filter_post={"station_name": ["S1", "S2"]})))
+    assert get_cache_dir("synobs", str(tmp_path)) == os.path.join(str(tmp_path), "synobs")
+
+
+def test_ts_type_of_stations(synthetic_data, tmp_path, reads):
+    configs = [synthetic_data.pyaro_config]
+    read_cached("synobs", "concpm10", basedir=str(tmp_path), configs=configs)
+    # frequency of stations as stored by write_cache
+    info_file = os.path.join(get_cache_dir("synobs", str(tmp_path), dict(configs=configs)),
+                             INFO_FILE)
+    with open(info_file) as f:
+        info = json.load(f)
+    info["ts_types"]["S1"] = "hourly"
+    with open(info_file, "w") as f:
+        json.dump(info, f)
+    data = read_cached("synobs", "concpm10", basedir=str(tmp_path), configs=configs)
+    assert len(reads) == 1
+    assert data.to_station_data("S1", "concpm10").ts_type == "hourly"
+    assert data.to_station_data("S2", "concpm10").ts_type == "daily"
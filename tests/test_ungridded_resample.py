@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("xarray")
+
+from ungridded_resample import resample_ungridded
+
+
+class FakeUngridded:
+    """Minimal stand-in with the data layout of UngriddedData"""
+
+    _METADATAKEYINDEX, _TIMEINDEX, _VARINDEX, _DATAINDEX = 0, 1, 2, 3
+
+    def __init__(self, blocks):
+        self.var_idx = {"concpm10": 0}
+        self.metadata = {}
+        rows = []
+        for key, (name, ts_type, times, values) in enumerate(blocks):
+            self.metadata[key] = dict(station_name=name, ts_type=ts_type,
+                                      latitude=60.0, longitude=10.0, altitude=0.0)
+            times = np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+            rows.extend((key, t, 0, v) for t, v in zip(times, values))
+        self._data = np.array(rows, dtype=np.float64)
+
+
+def test_station_with_several_ts_types_is_combined():
+    hours = np.arange("2020-01-01T00", "2020-01-03T00", dtype="datetime64[h]")
+    data = FakeUngridded([
+        ("A", "hourly", hours, np.ones(len(hours))),
+        ("A", "daily", ["2020-01-03", "2020-01-04"], [4.0, 6.0]),
+        ("B", "hourly", hours, np.full(len(hours), 2.0)),
+    ])
+    constraints = dict(monthly=dict(daily=4), daily=dict(hourly=12))
+    result = resample_ungridded(data, "concpm10", "monthly", min_num_obs=constraints)
+    # A: 2 days from hourly data (1, 1) and 2 daily values (4, 6)
+    assert result.sel(station_name="A").values.tolist() == [3.0]
+    # B: only 2 days, less than required
+    assert result.station_name.values.tolist() == ["A"]
+
+
+def test_missing_ts_type_warns():
+    data = FakeUngridded([("A", None, ["2020-01-01T00", "2020-01-01T01"], [1.0, 3.0])])
+    with pytest.warns(UserWarning, match="assuming hourly"):
+        result = resample_ungridded(data, "concpm10", "daily")
+    assert result.values.tolist() == [[2.0]]
+
+
+@pytest.mark.parametrize("ts_type,constraints", [
+    ("daily", dict(daily=dict(hourly=12))),
+    ("weekly", dict(weekly=dict(daily=4), daily=dict(hourly=12))),
+    ("monthly", dict(monthly=dict(daily=20), daily=dict(hourly=12))),
+])
+def test_same_as_time_resampler(ts_type, constraints):
+    pd = pytest.importorskip("pandas")
+    TimeResampler = pytest.importorskip("pyaerocom.time_resampler").TimeResampler
+    rng = np.random.default_rng(1)
+    hours = np.arange("2020-01-01T00", "2020-03-01T00", dtype="datetime64[h]")
+    values = rng.random(len(hours))
+    values[rng.random(len(hours)) < 0.4] = np.nan
+    data = FakeUngridded([("A", "hourly", hours, values)])
+    result = resample_ungridded(data, "concpm10", ts_type, min_num_obs=constraints)
+
+    series = pd.Series(values, index=pd.DatetimeIndex(hours))
+    expected = TimeResampler().resample(ts_type, input_data=series, from_ts_type="hourly",
+                                        min_num_obs=constraints, how="mean").dropna()
+    assert len(expected) > 0
+    np.testing.assert_array_equal(result.time.values, expected.index.values)
+    np.testing.assert_allclose(result.sel(station_name="A").values, expected.values)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+SQLite index of colocated data files (const.COLOCATEDDATADIR)
+
+Colocator writes one netCDF file per (variable, model, obs network,
+period, frequency, filter) combination, e.g.
+
+    od550aer_od550aer_MOD-IFS-OSUITE_REF-AeronetL1.5-d_20130101_20221231_daily_ALL-wMOUNTAINS.nc
+
+(model variable first, then observation variable), with a suffix
+_<start>-<end>km for vertical layers of profile data.
+
+Finding files via os.listdir and parsing filenames and netCDF headers
+becomes slow for archives of many experiments. Here, the metadata of all
+files (from the filename and the netCDF header) is stored in an SQLite
+database in the archive directory. The index is updated incrementally
+(only new or modified files are read) and can be queried by any metadata
+field. Matching files can be opened in parallel as one lazy dataset.
+
+Example::
+
+    from coldata_index import update_index, query, open_many
+
+    update_index()                                   # scan for changes
+    files = query(obs_var="od550aer", model_id="*OSUITE*", ts_type="daily",
+                  start="2015-01-01", stop="2016-01-01")
+    data = open_many(files)                          # dask-backed
+
+    python utils/coldata_index.py update
+    python utils/coldata_index.py query obs_var=od550aer model_id='*TM5*'
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+#: Name of index database in archive directory
+INDEX_FILE = "_coldata_index.sqlite"
+
+#: Filename convention of colocated data files (cf.
+#: ColocatedData._aerocom_savename)
+FILENAME_PATTERN = re.compile(
+    r"^(?P<mod_var>[^_]+)_(?P<obs_var>[^_]+)_MOD-(?P<model_id>.+)"
+    r"_REF-(?P<obs_id>.+)_(?P<start>\d{8})_(?P<stop>\d{8})"
+    r"_(?P<ts_type>[^_]+)_(?P<filter_name>[^_]+)"
+    r"(?:_(?P<layer_start>[\d.]+)-(?P<layer_end>[\d.]+)km)?\.nc$"
+)
+
+#: Columns of index table (name, SQL type)
+COLUMNS = [
+    ("path", "TEXT PRIMARY KEY"),
+    ("experiment", "TEXT"),
+    ("obs_var", "TEXT"),
+    ("mod_var", "TEXT"),
+    ("model_id", "TEXT"),
+    ("obs_id", "TEXT"),
+    ("start", "TEXT"),
+    ("stop", "TEXT"),
+    ("ts_type", "TEXT"),
+    ("filter_name", "TEXT"),
+    ("layer_start", "REAL"),
+    ("layer_end", "REAL"),
+    ("var_units", "TEXT"),
+    ("num_stations", "INTEGER"),
+    ("num_times", "INTEGER"),
+    ("size", "INTEGER"),
+    ("mtime", "REAL"),
+]
+FIELDS = [name for name, _ in COLUMNS]
+
+
+def get_basedir():
+    """Default archive directory (const.COLOCATEDDATADIR)"""
+    from pyaerocom import const
+
+    return const.COLOCATEDDATADIR
+
+
+def parse_filename(name):
+    """Metadata from name of colocated data file
+
+    Returns
+    -------
+    dict or None
+        metadata (start and stop as YYYY-MM-DD), or None if the name does
+        not follow the convention
+    """
+    match = FILENAME_PATTERN.match(os.path.basename(name))
+    if match is None:
+        return None
+    meta = match.groupdict()
+    for key in ("start", "stop"):
+        val = meta[key]
+        meta[key] = f"{val[:4]}-{val[4:6]}-{val[6:]}"
+    for key in ("layer_start", "layer_end"):
+        if meta[key] is not None:
+            meta[key] = float(meta[key])
+    return meta
+
+
+def read_header(path):
+    """Metadata from netCDF header (no data values are read)"""
+    import xarray as xr
+
+    with xr.open_dataarray(path, chunks={}) as data:
+        units = data.attrs.get("var_units")
+        return dict(
+            var_units=json.dumps(list(units)) if units is not None else None,
+            num_stations=data.sizes.get("station_name"),
+            num_times=data.sizes.get("time"),
+        )
+
+
+def _connect(basedir):
+    con = sqlite3.connect(os.path.join(basedir, INDEX_FILE), timeout=60)
+    existing = [row[1] for row in con.execute("PRAGMA table_info(files)")]
+    if existing and existing != FIELDS:
+        # index of an older version, rebuilt by the next update
+        con.execute("DROP TABLE files")
+    cols = ", ".join(f"{name} {sqltype}" for name, sqltype in COLUMNS)
+    con.execute(f"CREATE TABLE IF NOT EXISTS files ({cols})")
+    return con
+
+
+def _make_record(basedir, path, read_headers=True):
+    meta = parse_filename(path)
+    if meta is None:
+        return None
+    stat = os.stat(path)
+    rel = os.path.relpath(path, basedir)
+    meta.update(path=rel, experiment=os.path.dirname(rel), size=stat.st_size,
+                mtime=stat.st_mtime)
+    if read_headers:
+        try:
+            meta.update(read_header(path))
+        except Exception as e:  # keep filename metadata of unreadable files
+            print(f"Failed to read header of {path}: {e}")
+    return meta
+
+
+def _insert(con, records):
+    placeholders = ", ".join("?" for _ in FIELDS)
+    con.executemany(
+        f"INSERT OR REPLACE INTO files ({', '.join(FIELDS)}) VALUES ({placeholders})",
+        [tuple(rec.get(f) for f in FIELDS) for rec in records],
+    )
+
+
+def register_file(path, basedir=None, read_headers=True):
+    """Add or update a single file in the index (call after writing it)"""
+    basedir = basedir or get_basedir()
+    record = _make_record(basedir, os.path.abspath(path), read_headers)
+    if record is None:
+        raise ValueError(f"Invalid name of colocated data file: {path}")
+    with closing(_connect(basedir)) as con, con:
+        _insert(con, [record])
+
+
+def save_coldata(coldata, out_dir, basedir=None, **kwargs):
+    """Save ColocatedData (ColocatedData.to_netcdf) and register it in index"""
+    path = coldata.to_netcdf(out_dir, **kwargs)
+    register_file(path, basedir)
+    return path
+
+
+def update_index(basedir=None, read_headers=True, num_threads=8):
+    """Incrementally update index of archive directory
+
+    New and modified files (size or mtime changed) are (re)indexed, deleted
+    files are removed from the index.
+
+    Parameters
+    ----------
+    basedir : str, optional
+        archive directory (default: const.COLOCATEDDATADIR)
+    read_headers : bool
+        if True, number of stations and time steps and units are read from
+        the netCDF headers of new files
+    num_threads : int
+        number of threads reading headers
+
+    Returns
+    -------
+    tuple
+        number of added / updated and removed files
+    """
+    basedir = basedir or get_basedir()
+    with closing(_connect(basedir)) as con, con:
+        known = {path: (size, mtime) for path, size, mtime in
+                 con.execute("SELECT path, size, mtime FROM files")}
+        found, todo = set(), []
+        for root, _, files in os.walk(basedir):
+            for name in files:
+                if not name.endswith(".nc"):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, basedir)
+                found.add(rel)
+                stat = os.stat(path)
+                if known.get(rel) != (stat.st_size, stat.st_mtime):
+                    todo.append(path)
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            records = [rec for rec in pool.map(
+                lambda p: _make_record(basedir, p, read_headers), todo)
+                if rec is not None]
+        _insert(con, records)
+        removed = [(path,) for path in known if path not in found]
+        con.executemany("DELETE FROM files WHERE path = ?", removed)
+    return len(records), len(removed)
+
+
+def query(basedir=None, start=None, stop=None, **filters):
+    """Find colocated data files by metadata
+
+    Parameters
+    ----------
+    basedir : str, optional
+        archive directory (default: const.COLOCATEDDATADIR)
+    start, stop : str, optional
+        only files whose period overlaps with [start, stop] (YYYY-MM-DD)
+    **filters
+        field=value pairs (cf. COLUMNS), values may contain wildcards (*, ?)
+        or be lists of values
+
+    Returns
+    -------
+    list
+        matching records (dicts, path is absolute), sorted by path
+    """
+    basedir = basedir or get_basedir()
+    where, args = [], []
+    for key, value in filters.items():
+        if key not in FIELDS:
+            raise ValueError(f"Invalid field {key}, choose from {FIELDS}")
+        values = value if isinstance(value, (list, tuple)) else [value]
+        where.append("(" + " OR ".join(
+            f"{key} GLOB ?" if isinstance(v, str) else f"{key} = ?" for v in values) + ")")
+        args.extend(values)
+    if start is not None:
+        where.append("stop >= ?")
+        args.append(str(start))
+    if stop is not None:
+        where.append("start <= ?")
+        args.append(str(stop))
+    sql = f"SELECT {', '.join(FIELDS)} FROM files"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with closing(_connect(basedir)) as con:
+        rows = con.execute(sql + " ORDER BY path", args).fetchall()
+    records = [dict(zip(FIELDS, row)) for row in rows]
+    for rec in records:
+        rec["path"] = os.path.join(basedir, rec["path"])
+    return records
+
+
+def open_many(records, chunks=None, num_threads=8, dim="file"):
+    """Open colocated data files in parallel as one lazy DataArray
+
+    Parameters
+    ----------
+    records : list
+        records as returned by :func:`query` (or file paths)
+    chunks : dict, optional
+        dask chunks per file (default: one chunk per file)
+    num_threads : int
+        number of threads opening files
+    dim : str
+        name of new dimension along which files are concatenated
+
+    Returns
+    -------
+    xarray.DataArray
+        dask-backed data with dimensions (dim, data_source, time,
+        station_name), where time and stations are the union over all files
+        (NaN where a file has no data). The metadata of the records is
+        available as coordinates along dim.
+    """
+    import numpy as np
+    import xarray as xr
+
+    records = [r if isinstance(r, dict) else {"path": r} for r in records]
+    if not records:
+        raise ValueError("No files to open")
+
+    def _open(rec):
+        data = xr.open_dataarray(rec["path"], chunks=chunks or {})
+        data.name = "coldata"
+        return data
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        arrays = list(pool.map(_open, records))
+
+    # station coordinates are taken from the first file a station occurs in
+    station_coords = {}
+    for arr in arrays:
+        aux = [c for c in arr.coords if c not in arr.dims and arr[c].dims == ("station_name",)]
+        for i, name in enumerate(arr.station_name.values):
+            if name not in station_coords:
+                station_coords[name] = {c: arr[c].values[i] for c in aux}
+    arrays = [arr.reset_coords(drop=True).assign_coords(data_source=["obs", "model"])
+              for arr in arrays]
+    data = xr.concat(arrays, dim=dim, join="outer", coords="minimal",
+                     compat="override", combine_attrs="drop")
+    names = data.station_name.values
+    aux = sorted({c for coords in station_coords.values() for c in coords})
+    data = data.assign_coords({
+        c: ("station_name", [station_coords[n].get(c, np.nan) for n in names])
+        for c in aux
+    })
+    meta = {key: (dim, [rec.get(key) for rec in records])
+            for key in FIELDS if key in records[0]}
+    return data.assign_coords(meta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["update", "query"])
+    parser.add_argument("filters", nargs="*", metavar="FIELD=VALUE",
+                        help="Query filters, e.g. obs_var=od550aer model_id='*TM5*'")
+    parser.add_argument("--basedir", default=None,
+                        help="Archive directory (default: const.COLOCATEDDATADIR)")
+    parser.add_argument("--no-headers", action="store_true",
+                        help="Only index filename metadata")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        added, removed = update_index(args.basedir, not args.no_headers)
+        print(f"{added} files added or updated, {removed} removed")
+    else:
+        filters = dict(f.split("=", 1) for f in args.filters)
+        for rec in query(args.basedir, **filters):
+            print(rec["path"])
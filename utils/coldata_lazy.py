@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Out-of-core handling of colocated data (ColocatedData backed by dask)
+
+Colocated archives can be larger than memory, e.g. hourly data of many
+years and stations. The functions here open colocated netCDF files lazily,
+validate their structure from metadata only (without reading values),
+write them with chunked and compressed encoding and compute the standard
+statistics (NMB, MNMB, R, RMS, MB, FGE, ...) as dask reductions. All
+required sums are computed chunk by chunk and in parallel, in a single
+pass over the data, so only the (small) results are held in memory.
+
+Example::
+
+    from coldata_lazy import open_coldata, calc_statistics_lazy
+
+    coldata = open_coldata("my_colocated_data.nc", chunks={"time": 8760})
+    calc_statistics_lazy(coldata)                     # overall statistics
+    calc_statistics_lazy(coldata, dim="time")         # per station (maps)
+"""
+import argparse
+
+import numpy as np
+import xarray as xr
+
+from netcdf_helpers import attrs_from_netcdf, netcdf_attrs
+
+#: required dimensions of colocated data (3D or 4D)
+DIMS_3D = ("data_source", "time", "station_name")
+DIMS_4D = ("data_source", "time", "latitude", "longitude")
+
+
+def validate_structure_lazy(data):
+    """Validate structure of colocated data without loading values
+
+    Checks the same properties as
+    pyaerocom.colocation.colocated_data.validate_structure, but only uses
+    dimensions, coordinates and attributes, so that validating a dask-backed
+    array does not trigger any computation.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        colocated data
+
+    Raises
+    ------
+    ValueError
+        if structure is invalid
+
+    Returns
+    -------
+    xarray.DataArray
+        input data
+    """
+    if data.dims not in (DIMS_3D, DIMS_4D):
+        raise ValueError(f"Invalid dimensions {data.dims}, need {DIMS_3D} or {DIMS_4D}")
+    if data.sizes["data_source"] != 2:
+        raise ValueError(f"Need 2 data sources (obs, model), got {data.sizes['data_source']}")
+    if data.dims == DIMS_3D:
+        missing = [c for c in ("latitude", "longitude") if c not in data.coords]
+        if missing:
+            raise ValueError(f"Missing station coordinates {missing}")
+    if not np.issubdtype(data.time.dtype, np.datetime64):
+        raise ValueError(f"Invalid dtype {data.time.dtype} of time coordinate")
+    for attr in ("ts_type", "var_name"):
+        if attr not in data.attrs:
+            raise ValueError(f"Missing attribute {attr}")
+    return data
+
+
+def open_coldata(path, chunks=None):
+    """Open colocated data file lazily as ColocatedData
+
+    Parameters
+    ----------
+    path : str
+        netCDF file (e.g. written by pyaerocom or :func:`to_netcdf_chunked`)
+    chunks : dict, optional
+        dask chunks (default: chunking of file)
+
+    Returns
+    -------
+    ColocatedData
+        colocated data backed by dask arrays
+    """
+    from pyaerocom import ColocatedData
+
+    data = xr.open_dataarray(path, chunks=chunks or {})
+    data.attrs = attrs_from_netcdf(data)
+    return ColocatedData(data=validate_structure_lazy(data))
+
+
+def _as_dataarray(data):
+    return data if isinstance(data, xr.DataArray) else data.data
+
+
+def to_netcdf_chunked(data, path, chunks=None, complevel=4):
+    """Write colocated data with chunked and compressed encoding
+
+    Parameters
+    ----------
+    data : ColocatedData or xarray.DataArray
+        colocated data, may be backed by dask (written chunk by chunk)
+    path : str
+        output file
+    chunks : dict, optional
+        chunk size per dimension in the output file (default: dask chunks
+        of the data, or one chunk per dimension)
+    complevel : int
+        zlib compression level
+    """
+    data = _as_dataarray(data)
+    if chunks is not None:
+        data = data.chunk(chunks)
+    enc = dict(zlib=True, complevel=complevel)
+    if data.chunks is not None:
+        enc["chunksizes"] = tuple(c[0] for c in data.chunks)
+    data = data.copy(deep=False)
+    data.attrs = netcdf_attrs(data)
+    name = data.name or "__xarray_dataarray_variable__"
+    data.to_netcdf(path, encoding={name: enc})
+
+
+def calc_statistics_lazy(data, dim=None, min_num_valid=1):
+    """Compute statistics of colocated data with (parallel) dask reductions
+
+    Parameters
+    ----------
+    data : ColocatedData or xarray.DataArray
+        colocated data (first data source is observations, second model)
+    dim : str or list, optional
+        dimension(s) to reduce (default: all), e.g. "time" for statistics
+        per station
+    min_num_valid : int
+        results with fewer valid (obs, model) pairs are set to NaN
+
+    Returns
+    -------
+    dict or xarray.Dataset
+        statistics (keys as in pyaerocom.stats.calculate_statistics), as
+        dict of floats if all dimensions are reduced, else as Dataset
+    """
+    data = _as_dataarray(data)
+    # sums of squares of float32 data lose precision over long periods
+    obs = data.isel(data_source=0, drop=True).astype(np.float64)
+    mod = data.isel(data_source=1, drop=True).astype(np.float64)
+    dims = [dim] if isinstance(dim, str) else dim
+
+    valid = np.isfinite(obs) & np.isfinite(mod)
+    o = obs.where(valid, 0)
+    m = mod.where(valid, 0)
+    diff = m - o
+    denom = (m + o).where(valid & ((m + o) != 0))
+    sums = xr.Dataset({
+        # all points, as in pyaerocom.stats.calculate_statistics
+        "totnum": xr.ones_like(obs, dtype=np.int64).sum(dims),
+        "n": valid.sum(dims),
+        "so": o.sum(dims), "sm": m.sum(dims),
+        "soo": (o * o).sum(dims), "smm": (m * m).sum(dims),
+        "som": (o * m).sum(dims),
+        "sdiff": diff.sum(dims), "sabsdiff": abs(diff).sum(dims),
+        "sdiff2": (diff * diff).sum(dims),
+        "sfrac": (diff / denom).sum(dims),
+        "sabsfrac": abs(diff / denom).sum(dims),
+    }).compute()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = sums.n.where(sums.n >= min_num_valid)
+        obs_mean, mod_mean = sums.so / n, sums.sm / n
+        cov = sums.som / n - obs_mean * mod_mean
+        obs_var = sums.soo / n - obs_mean ** 2
+        mod_var = sums.smm / n - mod_mean ** 2
+        stats = xr.Dataset({
+            "totnum": sums.totnum,
+            "num_valid": sums.n,
+            "refdata_mean": obs_mean,
+            "refdata_std": np.sqrt(obs_var.clip(min=0)),
+            "data_mean": mod_mean,
+            "data_std": np.sqrt(mod_var.clip(min=0)),
+            "rms": np.sqrt(sums.sdiff2 / n),
+            "nmb": (sums.sdiff / n) / (sums.so / n),
+            "mnmb": 2 * sums.sfrac / n,
+            "mb": sums.sdiff / n,
+            "mab": sums.sabsdiff / n,
+            "fge": 2 * sums.sabsfrac / n,
+            "R": cov / np.sqrt(obs_var * mod_var),
+        })
+    if dims is None:
+        return {k: float(v) for k, v in stats.items()}
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("file", help="Colocated data netCDF file")
+    parser.add_argument("--chunks", nargs="+", default=None, metavar="DIM=SIZE",
+                        help="Dask chunks, e.g. time=8760 station_name=500")
+    parser.add_argument("--rechunk-to", default=None,
+                        help="Write chunked and compressed copy to this file")
+    args = parser.parse_args()
+
+    chunks = dict((k, int(v)) for k, v in (c.split("=") for c in args.chunks or []))
+    coldata = open_coldata(args.file, chunks or None)
+    for key, value in calc_statistics_lazy(coldata).items():
+        print(f"{key:<15}{value:.4g}")
+    if args.rechunk_to:
+        to_netcdf_chunked(coldata, args.rechunk_to)
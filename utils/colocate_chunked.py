@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Memory-bounded colocation of long (e.g. hourly multi-year) periods
+
+Colocator.run() builds the full ColocatedData array (data_source, time,
+station_name) of the requested period in memory. Here, the period is split
+into time blocks (e.g. years or months), which are colocated one after the
+other. The result of each block is written to a compressed netCDF file and
+released before the next block is processed, so peak memory is bounded by
+the block size rather than by the total period. Finally, all block files
+are opened lazily (dask) and concatenated along time, with stations that
+have no data in a block filled with NaN.
+
+Ungridded observations are read once for the full period and shared by
+all blocks (the colocation itself only uses the data of each block). Blocks
+that were completed are skipped, i.e. an interrupted run can be continued
+by calling it again with the same arguments. A block counts as completed
+when the results of all its (model variable, obs variable) pairs were
+written; this is recorded in a marker file (<outdir>/.blocks/<block>.json),
+which is written last.
+
+Example::
+
+    from colocate_chunked import colocate_chunked
+
+    setup = dict(model_id="EMEP", obs_id="EBASMC", obs_vars="concpm10",
+                 ts_type="hourly", model_ts_type_read="hourly",
+                 start="2010-01-01", stop="2021-01-01")
+    coldata = colocate_chunked(setup, "./coldata_blocks", freq="yearly")
+    coldata["concpm10"]["concpm10"].data    # dask-backed DataArray
+"""
+import argparse
+import gc
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from netcdf_helpers import netcdf_attrs
+
+#: pandas frequencies of time blocks
+BLOCK_FREQS = {"yearly": "YS", "monthly": "MS"}
+
+#: coordinates of the station dimension
+STATION_COORDS = ["latitude", "longitude", "altitude"]
+
+#: separator of model and obs variable in names of output subdirectories
+SEP = "__"
+
+#: subdirectory of output directory containing block completion markers
+MARKER_DIR = ".blocks"
+
+
+def get_time_blocks(start, stop, freq="yearly"):
+    """Split period into consecutive time blocks
+
+    Parameters
+    ----------
+    start, stop : str or pandas.Timestamp
+        start and (exclusive) stop of period
+    freq : str
+        block length, "yearly" or "monthly"
+
+    Returns
+    -------
+    list
+        list of (start, stop) timestamps of blocks
+    """
+    start, stop = pd.Timestamp(start), pd.Timestamp(stop)
+    if stop <= start:
+        raise ValueError(f"stop ({stop}) must be after start ({start})")
+    try:
+        edges = pd.date_range(start, stop, freq=BLOCK_FREQS[freq])
+    except KeyError:
+        raise ValueError(f"Invalid block frequency {freq}, choose from {list(BLOCK_FREQS)}")
+    edges = sorted({start, stop, *edges})
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _block_name(block):
+    return "{}-{}.nc".format(*(t.strftime("%Y%m%d%H") for t in block))
+
+
+def write_block(data, path, complevel=4):
+    """Write colocated data of one time block as compressed netCDF
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        colocated data (data_source, time, station_name)
+    path : str or Path
+        output file (written via temporary file, so that incomplete files
+        are not mistaken for finished blocks)
+    complevel : int
+        zlib compression level
+    """
+    data = data.copy(deep=False)
+    data.attrs = netcdf_attrs(data)
+    tmp = f"{path}.part"
+    data.to_netcdf(tmp, encoding={data.name or "__xarray_dataarray_variable__":
+                                  dict(zlib=True, complevel=complevel)})
+    os.replace(tmp, path)
+
+
+def _select_block(data, block):
+    # colocation periods may include the stop timestamp
+    time = data.time.values
+    mask = (time >= np.datetime64(block[0])) & (time < np.datetime64(block[1]))
+    return data.isel(time=mask)
+
+
+def _obs_vars(setup):
+    obs_vars = setup["obs_vars"]
+    return sorted([obs_vars] if isinstance(obs_vars, str) else obs_vars)
+
+
+def _marker_path(outdir, block):
+    return Path(outdir) / MARKER_DIR / f"{_block_name(block)[:-3]}.json"
+
+
+def block_complete(setup, block, outdir):
+    """Check if results of all variable pairs of a block were written"""
+    try:
+        with open(_marker_path(outdir, block)) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not set(_obs_vars(setup)) <= set(marker["obs_vars"]):
+        return False
+    return all((Path(outdir) / rel).exists() for rel in marker["files"])
+
+
+def _share_obs(colocator, obs_cache):
+    # ungridded obs are read for the full period (independent of start and
+    # stop), so they can be shared by all blocks
+    if not colocator.obs_is_ungridded:
+        return
+    read = colocator.get_obs_data
+
+    def get_obs_data(obs_var):
+        if obs_var not in obs_cache:
+            obs_cache[obs_var] = read(obs_var)
+        return obs_cache[obs_var]
+
+    colocator.get_obs_data = get_obs_data
+
+
+def colocate_block(setup, block, outdir, complevel=4, obs_cache=None):
+    """Colocate one time block and write results
+
+    Parameters
+    ----------
+    setup : dict
+        keyword arguments of pyaerocom.ColocationSetup
+    block : tuple
+        (start, stop) of block
+    outdir : Path
+        output directory, results are written into one subdirectory per
+        (model variable, obs variable) pair, named <model_var>__<obs_var>
+    complevel : int
+        zlib compression level
+    obs_cache : dict, optional
+        ungridded observations (obs variable -> UngriddedData) shared
+        between blocks, filled on first use
+
+    Returns
+    -------
+    list
+        written files
+    """
+    from pyaerocom import ColocationSetup, Colocator
+
+    setup = dict(setup, start=block[0], stop=block[1], save_coldata=False,
+                 keep_data=True)
+    colocator = Colocator(ColocationSetup(**setup))
+    if obs_cache is not None:
+        _share_obs(colocator, obs_cache)
+    colocator.run()
+    written = []
+    for mod_var, obs_data in colocator.data.items():
+        for obs_var, coldata in obs_data.items():
+            vardir = outdir / f"{mod_var}{SEP}{obs_var}"
+            vardir.mkdir(parents=True, exist_ok=True)
+            path = vardir / _block_name(block)
+            write_block(_select_block(coldata.data, block), path, complevel)
+            written.append(path)
+    del colocator
+    gc.collect()
+    # the block is complete only once all pairs are written
+    marker = _marker_path(outdir, block)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{marker}.part"
+    with open(tmp, "w") as f:
+        json.dump(dict(obs_vars=_obs_vars(setup),
+                       files=[str(p.relative_to(outdir)) for p in written]), f)
+    os.replace(tmp, marker)
+    return written
+
+
+def open_blocks(files, chunks=None):
+    """Lazily open and concatenate colocated block files along time
+
+    Parameters
+    ----------
+    files : list
+        netCDF files of time blocks
+    chunks : dict, optional
+        dask chunks per file (default: one chunk per file)
+
+    Returns
+    -------
+    xarray.DataArray
+        dask-backed colocated data
+    """
+    blocks = [xr.open_dataarray(f, chunks=chunks or {}) for f in sorted(files)]
+    # stations may differ between blocks, the union is used and station
+    # coordinates are taken from the first block a station occurs in
+    stations = {}
+    for block in blocks:
+        coords = {c: block[c].values for c in STATION_COORDS if c in block.coords}
+        for i, name in enumerate(block.station_name.values):
+            if name not in stations:
+                stations[name] = {c: vals[i] for c, vals in coords.items()}
+    names = sorted(stations)
+    blocks = [
+        b.drop_vars([c for c in STATION_COORDS if c in b.coords]).reindex(station_name=names)
+        for b in blocks
+    ]
+    data = xr.concat(blocks, dim="time", coords="minimal", compat="override",
+                     combine_attrs="override")
+    coords = {c: ("station_name", [stations[n].get(c, np.nan) for n in names])
+              for c in STATION_COORDS}
+    data = data.assign_coords(coords)
+    data.attrs["start"] = str(data.time.values[0])
+    data.attrs["stop"] = str(data.time.values[-1])
+    return data
+
+
+def colocate_chunked(setup, outdir, freq="yearly", complevel=4, chunks=None,
+                     overwrite=False):
+    """Colocate period block by block and return lazily loaded results
+
+    Parameters
+    ----------
+    setup : dict
+        keyword arguments of pyaerocom.ColocationSetup, including start and
+        stop of the full period
+    outdir : str or Path
+        directory for block files
+    freq : str
+        block length, "yearly" or "monthly"
+    complevel : int
+        zlib compression level of block files
+    chunks : dict, optional
+        dask chunks used when opening the block files
+    overwrite : bool
+        if True, existing block files are recomputed
+
+    Returns
+    -------
+    dict
+        nested dict (model variable -> obs variable -> ColocatedData), like
+        Colocator.data, where data is backed by dask arrays
+    """
+    from pyaerocom import ColocatedData
+
+    outdir = Path(outdir)
+    obs_cache = {}
+    for block in get_time_blocks(setup["start"], setup["stop"], freq):
+        if not overwrite and block_complete(setup, block, outdir):
+            print(f"Skipping {block[0]} - {block[1]} (exists)")
+            continue
+        print(f"Colocating {block[0]} - {block[1]}")
+        colocate_block(setup, block, outdir, complevel, obs_cache)
+    obs_cache.clear()
+
+    result = {}
+    for vardir in sorted(p for p in outdir.iterdir()
+                         if p.is_dir() and p.name != MARKER_DIR):
+        files = list(vardir.glob("*.nc"))
+        if not files:
+            continue
+        data = open_blocks(files, chunks)
+        mod_var, obs_var = vardir.name.split(SEP, 1)
+        result.setdefault(mod_var, {})[obs_var] = ColocatedData(data=data)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("setup", help="JSON file with ColocationSetup arguments")
+    parser.add_argument("--outdir", required=True, help="Directory for block files")
+    parser.add_argument("--freq", default="yearly", choices=list(BLOCK_FREQS),
+                        help="Length of time blocks")
+    parser.add_argument("--complevel", default=4, type=int, help="Compression level")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Recompute existing blocks")
+    args = parser.parse_args()
+
+    with open(args.setup) as f:
+        setup = json.load(f)
+    colocate_chunked(setup, args.outdir, args.freq, args.complevel,
+                     overwrite=args.overwrite)
@@ -1,40 +1,132 @@
+import argparse
+import hashlib
+import sys
+
 import requests
-import xarray as xr
 from pathlib import Path
 
+from subset_model_files import subset_file
+
 EMEP_URL = "https://thredds.met.no/thredds/fileServer/data/EMEP/2024_Reporting/EMEP01_rv5.3_month.1999met_1999emis_rep2024.nc"
 DOWNLOAD_OUTNAME = "Base_month_full.nc"
 DOWNLOAD_PATH = Path("./tmp/") / DOWNLOAD_OUTNAME
 
-Path("./tmp").mkdir(exist_ok=True)
-
 NEW_OUTNAME = "Base_month.nc"
 NEW_PATH = Path("./tmp/") / NEW_OUTNAME
 
-if not DOWNLOAD_PATH.exists():
-    print("Downloading EMEP data")
-    query_parameters = {"downloadformat": "nc"}
+CHUNK_SIZE = 1024**2  # bytes per chunk written to disk
 
-    response = requests.get(EMEP_URL, params=query_parameters)
+min_lat, max_lat = 57, 72
+min_lon, max_lon = 3, 24
 
-    with open(DOWNLOAD_PATH, mode="wb") as f:
-        f.write(response.content)
+variables = ["SURF_ug_PM10_rh50", "SURF_ppb_O3"]
 
 
-data = xr.open_dataset(DOWNLOAD_PATH)
+def _print_progress(done, total):
+    if total:
+        msg = f"\r{done / 1024**2:.1f} / {total / 1024**2:.1f} MB ({100 * done / total:.0f}%)"
+    else:
+        msg = f"\r{done / 1024**2:.1f} MB"
+    sys.stdout.write(msg)
+    sys.stdout.flush()
 
-min_lat, max_lat = 57, 72
-min_lon, max_lon = 3, 24
 
-LatIndexer, LonIndexer = "lat", "lon"
-slicedata = data.sel(
-    **{LatIndexer: slice(min_lat, max_lat), LonIndexer: slice(min_lon, max_lon)}
-)
+def _content_range_total(response):
+    # size of file from e.g. "bytes */1234" (None if unknown)
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def download_file(url, path, params=None, sha256=None, chunk_size=CHUNK_SIZE,
+                  timeout=60):
+    """Download file in chunks, resuming a previously interrupted download
+
+    The data is streamed into ``<path>.part``, which is renamed to ``path``
+    once the download is complete and its size (and checksum, if provided)
+    has been verified. If the ``.part`` file exists, the download is resumed
+    using an HTTP Range request (or restarted if the server does not support
+    ranges, or does not report the size of a ``.part`` file that is already
+    complete). A ``.part`` file that is larger than the file on the server
+    or fails the checksum is deleted.
+
+    Parameters
+    ----------
+    url : str
+        URL of file
+    path : Path
+        output file
+    params : dict, optional
+        query parameters passed to the request
+    sha256 : str, optional
+        expected SHA-256 hex digest of file
+    chunk_size : int
+        number of bytes read and written at a time
+    timeout : float
+        timeout of connection in s
+
+    Returns
+    -------
+    Path
+        output file
+    """
+    path = Path(path)
+    part = path.with_name(path.name + ".part")
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with requests.get(url, params=params, headers=headers, stream=True,
+                      timeout=timeout) as response:
+        if response.status_code == 416:  # range not satisfiable: complete?
+            total = _content_range_total(response)
+            if total is None:
+                part.unlink()
+                return download_file(url, path, params, sha256, chunk_size, timeout)
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:  # server ignored range
+                offset = 0
+            length = response.headers.get("Content-Length")
+            total = offset + int(length) if length is not None else None
+            done = offset
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    _print_progress(done, total)
+            print()
+
+    size = part.stat().st_size
+    if total is not None and size > total:
+        part.unlink()
+        raise IOError(f"Download of {url} is larger than the file ({size} > {total} "
+                      f"bytes), file deleted")
+    if total is not None and size != total:
+        raise IOError(f"Incomplete download of {url}: got {size} of {total} "
+                      f"bytes (rerun to resume)")
+    if sha256 is not None:
+        hasher = hashlib.sha256()
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+        if hasher.hexdigest() != sha256:
+            part.unlink()
+            raise IOError(f"Checksum mismatch for {url}, file deleted")
+    part.replace(path)
+    return path
 
-variables = ["SURF_ug_PM10_rh50", "SURF_ppb_O3"]
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download and subset EMEP tutorial file")
+    parser.add_argument("--sha256", default=None,
+                        help="Expected SHA-256 hex digest of the full file")
+    args = parser.parse_args()
 
-reduceddata = slicedata[variables]
+    Path("./tmp").mkdir(exist_ok=True)
 
+    if not DOWNLOAD_PATH.exists():
+        print("Downloading EMEP data")
+        download_file(EMEP_URL, DOWNLOAD_PATH, params={"downloadformat": "nc"},
+                      sha256=args.sha256)
 
-reduceddata.to_netcdf(NEW_PATH)
+    subset_file(DOWNLOAD_PATH, NEW_PATH, variables=variables,
+                lat_range=(min_lat, max_lat), lon_range=(min_lon, max_lon))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Persistent inventory of gridded data files (const.DATA_SEARCH_DIRS)
+
+ReadGridded scans the data directory of a model and parses all filenames
+when it is instantiated, and browse_database walks all data search
+directories. On large archives (e.g. on lustre) with hundreds of thousands
+of files, this takes minutes. Here, the metadata of all files (data ID,
+variable, year, frequency, vertical code, mtime) is stored in an SQLite
+database in the cache directory. The inventory is updated incrementally:
+the listing of a directory is only read again if the modification time of
+the directory changed (i.e. files were added, removed or renamed), all
+other directories only require one stat call.
+
+Filenames are parsed according to the aerocom3 and aerocom2 conventions
+(cf. pyaerocom.io.FileConventionRead), e.g.
+
+    aerocom3_TM5-met2010_AP3-CTRL2019_od550aer_Column_2010_monthly.nc
+    ECMWF_OSUITE.daily.od550aer.2018.nc
+
+The data ID of a file is the name of its directory (the parent directory
+for files in "renamed" subdirectories), as in browse_database.
+
+Example::
+
+    from file_inventory import update_inventory, browse, find_files, years_avail
+
+    update_inventory()                    # fast if nothing changed
+    browse("*TM5*")                       # matching data IDs
+    years_avail("TM5-met2010_CTRL-TEST", "od550aer")
+    find_files("TM5*", var_name="od550aer", ts_type="monthly", year=(2010, 2012))
+
+    python utils/file_inventory.py update
+    python utils/file_inventory.py browse '*TM5*'
+"""
+import argparse
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+from manage_cachedir import mark_used, using_cache
+
+#: Name of inventory database in cache directory
+INVENTORY_FILE = "file_inventory.sqlite"
+
+#: Columns of file table
+FILE_FIELDS = ["path", "dir", "data_id", "var_name", "year", "ts_type",
+               "vert_code", "mtime"]
+
+
+def get_db_path():
+    """Default location of inventory (<const.CACHEDIR>/file_inventory.sqlite)"""
+    from pyaerocom import const
+
+    return os.path.join(const.CACHEDIR, INVENTORY_FILE)
+
+
+def get_search_dirs():
+    """Default data search directories (const.DATA_SEARCH_DIRS)"""
+    from pyaerocom import const
+
+    return list(const.DATA_SEARCH_DIRS)
+
+
+def parse_filename(name):
+    """Metadata from filename (aerocom3 or aerocom2 convention)
+
+    Returns
+    -------
+    dict or None
+        var_name, year, ts_type, vert_code (None for aerocom2), or None if
+        the name does not follow one of the conventions
+    """
+    if not name.endswith(".nc"):
+        return None
+    stem = name[:-3]
+    if stem.startswith("aerocom3_"):
+        parts = stem.split("_")
+        # data IDs may contain underscores, so parse from the right
+        if len(parts) < 6 or not parts[-2].isdigit():
+            return None
+        return dict(var_name=parts[-4], vert_code=parts[-3], year=int(parts[-2]),
+                    ts_type=parts[-1])
+    parts = stem.split(".")
+    if len(parts) >= 4 and parts[-1].isdigit():
+        return dict(var_name=parts[-2], vert_code=None, year=int(parts[-1]),
+                    ts_type=parts[-3])
+    return None
+
+
+def _data_id(dirpath):
+    name = os.path.basename(dirpath)
+    if name == "renamed":
+        name = os.path.basename(os.path.dirname(dirpath))
+    return name
+
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    con = sqlite3.connect(db_path, timeout=60)
+    con.execute("CREATE TABLE IF NOT EXISTS dirs "
+                "(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)")
+    con.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                "dir TEXT, data_id TEXT, var_name TEXT, year INTEGER, "
+                "ts_type TEXT, vert_code TEXT, mtime REAL)")
+    con.execute("CREATE INDEX IF NOT EXISTS files_data_id ON files (data_id, var_name)")
+    con.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+    return con
+
+
+@contextmanager
+def _open(db_path):
+    """Connection to inventory, protected against pruning of the cache
+    directory (cf. manage_cachedir)"""
+    root = os.path.dirname(os.path.abspath(db_path))
+    with using_cache(root), closing(_connect(db_path)) as con:
+        yield con
+    mark_used(db_path, root)
+
+
+def _remove_dir(con, path):
+    """Remove directory and everything below from inventory"""
+    # prefix comparison, since paths may contain LIKE wildcards (_ and %)
+    prefix = path.rstrip(os.sep) + os.sep
+    args = (path, len(prefix), prefix)
+    con.execute("DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?", args)
+    con.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", args)
+
+
+def _scan_dir(con, path, known):
+    """Update one directory, return list of its subdirectories"""
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        _remove_dir(con, path)
+        return [], 0
+    if known.get(path) == mtime:
+        # listing unchanged, subdirectories are taken from the inventory
+        subdirs = [p for (p,) in con.execute("SELECT path FROM dirs WHERE parent = ?", (path,))]
+        return subdirs, 0
+    subdirs, records = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=True):
+                subdirs.append(entry.path)
+                continue
+            meta = parse_filename(entry.name)
+            if meta is None:
+                continue
+            records.append((entry.path, path, _data_id(path), meta["var_name"],
+                            meta["year"], meta["ts_type"], meta["vert_code"],
+                            entry.stat().st_mtime))
+    con.execute("DELETE FROM files WHERE dir = ?", (path,))
+    con.executemany(f"INSERT OR REPLACE INTO files ({', '.join(FILE_FIELDS)}) "
+                    f"VALUES ({', '.join('?' for _ in FILE_FIELDS)})", records)
+    # subdirectories that were removed
+    for (old,) in con.execute("SELECT path FROM dirs WHERE parent = ?", (path,)).fetchall():
+        if old not in subdirs:
+            _remove_dir(con, old)
+    con.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                (path, os.path.dirname(path), mtime))
+    return subdirs, 1
+
+
+def update_inventory(search_dirs=None, db_path=None):
+    """Incrementally update inventory of data search directories
+
+    Parameters
+    ----------
+    search_dirs : list, optional
+        directories (default: const.DATA_SEARCH_DIRS)
+    db_path : str, optional
+        inventory database (default: <const.CACHEDIR>/file_inventory.sqlite)
+
+    Returns
+    -------
+    int
+        number of directories whose listing was (re)read
+    """
+    search_dirs = [os.path.abspath(d) for d in (search_dirs or get_search_dirs())]
+    db_path = db_path or get_db_path()
+    num_scanned = 0
+    with _open(db_path) as con, con:
+        known = dict(con.execute("SELECT path, mtime FROM dirs"))
+        # search directories that were removed from the list
+        roots = [p for (p,) in con.execute("SELECT path FROM dirs WHERE parent = ''")]
+        for root in roots:
+            if root not in search_dirs:
+                _remove_dir(con, root)
+        todo = list(search_dirs)
+        while todo:
+            path = todo.pop()
+            subdirs, scanned = _scan_dir(con, path, known)
+            if path in search_dirs:
+                con.execute("UPDATE dirs SET parent = '' WHERE path = ?", (path,))
+            todo.extend(subdirs)
+            num_scanned += scanned
+    return num_scanned
+
+
+def _glob(value):
+    return "GLOB" if any(c in str(value) for c in "*?[") else "="
+
+
+def find_files(data_id=None, var_name=None, year=None, ts_type=None,
+               vert_code=None, db_path=None):
+    """Find files in inventory
+
+    Parameters
+    ----------
+    data_id, var_name, ts_type, vert_code : str, optional
+        values to match (may contain wildcards)
+    year : int or tuple, optional
+        year or (first, last) year
+    db_path : str, optional
+        inventory database
+
+    Returns
+    -------
+    list
+        matching records (dicts with keys FILE_FIELDS), sorted by path
+    """
+    where, args = [], []
+    for key, value in dict(data_id=data_id, var_name=var_name, ts_type=ts_type,
+                           vert_code=vert_code).items():
+        if value is not None:
+            where.append(f"{key} {_glob(value)} ?")
+            args.append(value)
+    if year is not None:
+        first, last = (year, year) if isinstance(year, int) else year
+        where.append("year BETWEEN ? AND ?")
+        args.extend([first, last])
+    sql = f"SELECT {', '.join(FILE_FIELDS)} FROM files"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with _open(db_path or get_db_path()) as con:
+        rows = con.execute(sql + " ORDER BY path", args).fetchall()
+    return [dict(zip(FILE_FIELDS, row)) for row in rows]
+
+
+def browse(pattern="*", db_path=None):
+    """Data IDs matching a wildcard pattern (cf. browse_database)
+
+    Returns
+    -------
+    dict
+        data ID -> data directory
+    """
+    with _open(db_path or get_db_path()) as con:
+        rows = con.execute("SELECT DISTINCT data_id, dir FROM files WHERE data_id GLOB ? "
+                           "ORDER BY data_id", (pattern,)).fetchall()
+    return dict(rows)
+
+
+def years_avail(data_id, var_name=None, ts_type=None, db_path=None):
+    """Sorted list of years available for a data ID (and variable)"""
+    return sorted({rec["year"] for rec in find_files(
+        data_id, var_name=var_name, ts_type=ts_type, db_path=db_path)})
+
+
+def get_file_info(data_id, db_path=None):
+    """Table of files of a data ID (cf. ReadGridded.file_info)
+
+    Returns
+    -------
+    pandas.DataFrame
+        columns filename, data_id, var_name, ts_type, year, vert_code, mtime
+    """
+    import pandas as pd
+
+    recs = find_files(data_id, db_path=db_path)
+    info = pd.DataFrame(recs, columns=FILE_FIELDS)
+    info.insert(0, "filename", info.pop("path").map(os.path.basename))
+    return info.drop(columns="dir")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["update", "browse", "files"])
+    parser.add_argument("pattern", nargs="?", default="*",
+                        help="Data ID (wildcards allowed) for browse and files")
+    parser.add_argument("--var", default=None, help="Variable (command files)")
+    parser.add_argument("--dirs", nargs="+", default=None,
+                        help="Search directories (default: const.DATA_SEARCH_DIRS)")
+    parser.add_argument("--db", default=None, help="Inventory database")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        num = update_inventory(args.dirs, args.db)
+        print(f"{num} directories (re)scanned")
+    elif args.command == "browse":
+        for data_id, data_dir in browse(args.pattern, args.db).items():
+            print(f"{data_id:<50}{data_dir}")
+    else:
+        for rec in find_files(args.pattern, var_name=args.var, db_path=args.db):
+            print(rec["path"])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Lazy (dask) evaluation of derived model variables (model_read_aux)
+
+The functions of derived variables in model_read_aux (e.g.
+calc_elecmentalcarbon in evaluations/scripts/add_custom_variables.py or the
+cube methods in suppl/ex_cfg_eval_iface/cube_read_methods.py) are called
+with the input variables as returned by the reader, and all arithmetic is
+done on fully loaded arrays. Here, the inputs are converted into chunked
+dask arrays before the function is called, so that the derived variable is
+a lazy expression that is evaluated chunk by chunk when it is written or
+reduced, and neither the inputs nor the result are ever fully held in
+memory. Functions only need to use operations that work on dask arrays
+(arithmetic, numpy ufuncs, xarray methods), which is the case for all
+examples in this repository.
+
+:func:`lazy_aux` wraps a function for use in model_read_aux; inputs may
+be xarray.DataArray (e.g. ReadMscwCtm) or iris cubes (ReadGridded), and the
+result is of the same type. :func:`compute_aux` evaluates a derived variable
+directly from model files and streams it into a netCDF file.
+
+Example::
+
+    from lazy_aux import lazy_aux, compute_aux
+
+    model_read_aux = {
+        "elementalcarbon": {
+            "vars_required": ["concecCoarse", "concecFine"],
+            "fun": lazy_aux(calc_elecmentalcarbon, chunks={"time": 744}),
+        }
+    }
+
+    compute_aux("Base_hour.nc", calc_elecmentalcarbon,
+                ["SURF_ug_ECCOARSE", "SURF_ug_ECFINE"],
+                outfile="elementalcarbon_hour.nc", chunks={"time": 744})
+"""
+import argparse
+import functools
+
+import xarray as xr
+
+#: Default dask chunks of inputs
+DEFAULT_CHUNKS = "auto"
+
+
+def _is_cube(data):
+    return type(data).__module__.startswith("iris")
+
+
+def to_lazy(data, chunks=None):
+    """Convert input variable into chunked dask-backed DataArray
+
+    Parameters
+    ----------
+    data : xarray.DataArray or iris.cube.Cube
+        input variable (data that is not loaded yet, e.g. opened with
+        xarray.open_dataset or a lazy iris cube, is not loaded)
+    chunks : dict or str, optional
+        dask chunks (dimension name -> size, dimensions that do not exist
+        are ignored), default: chunking of data if it is already a dask
+        array, else automatic chunking
+
+    Returns
+    -------
+    xarray.DataArray
+        dask-backed data
+    """
+    if _is_cube(data):
+        # keeps the lazy data of the cube
+        data = xr.DataArray.from_iris(data)
+    if isinstance(chunks, dict):
+        chunks = {dim: size for dim, size in chunks.items() if dim in data.dims}
+    if chunks is None:
+        if data.chunks is not None:
+            return data
+        chunks = DEFAULT_CHUNKS
+    return data.chunk(chunks)
+
+
+def lazy_aux(fun, chunks=None):
+    """Wrap function of derived variable for lazy evaluation
+
+    Parameters
+    ----------
+    fun : callable
+        function of derived variable (called with DataArrays)
+    chunks : dict or str, optional
+        dask chunks of inputs (cf. :func:`to_lazy`)
+
+    Returns
+    -------
+    callable
+        function that can be used in model_read_aux, returns a lazy
+        DataArray, or a lazy iris cube if the inputs are cubes
+    """
+
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+        cubes = any(_is_cube(arg) for arg in args)
+        result = fun(*(to_lazy(arg, chunks) for arg in args), **kwargs)
+        if cubes and isinstance(result, xr.DataArray):
+            return result.to_iris()
+        return result
+
+    return wrapper
+
+
+def compute_aux(paths, fun, vars_required, outfile=None, chunks=None,
+                var_name=None):
+    """Evaluate derived variable lazily from model files
+
+    Parameters
+    ----------
+    paths : str or list
+        model file(s) (several files are concatenated along time)
+    fun : callable
+        function of derived variable
+    vars_required : list
+        names of input variables in the files, in the order of the
+        arguments of fun
+    outfile : str, optional
+        if provided, the result is written chunk by chunk into this file and
+        returned as lazily opened DataArray
+    chunks : dict or str, optional
+        dask chunks of inputs (default: automatic)
+    var_name : str, optional
+        name of result
+
+    Returns
+    -------
+    xarray.DataArray
+        dask-backed derived variable
+    """
+    chunks = DEFAULT_CHUNKS if chunks is None else chunks
+    if isinstance(paths, (list, tuple)):
+        ds = xr.open_mfdataset(paths, chunks=chunks, combine="by_coords")
+    else:
+        ds = xr.open_dataset(paths, chunks=chunks)
+    result = fun(*(to_lazy(ds[var], chunks) for var in vars_required))
+    if var_name is not None:
+        result = result.rename(var_name)
+    if outfile is None:
+        return result
+    result.to_netcdf(outfile)
+    return xr.open_dataarray(outfile, chunks=chunks)
+
+
+if __name__ == "__main__":
+    import importlib
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fun", help="Function of derived variable as module:name")
+    parser.add_argument("outfile", help="Output netCDF file")
+    parser.add_argument("paths", nargs="+", help="Model file(s)")
+    parser.add_argument("--vars", nargs="+", required=True,
+                        help="Input variables (arguments of function)")
+    parser.add_argument("--var-name", default=None, help="Name of result")
+    parser.add_argument("--chunks", nargs="+", default=None, metavar="DIM=SIZE",
+                        help="Dask chunks, e.g. time=744")
+    args = parser.parse_args()
+
+    module, name = args.fun.split(":")
+    fun = getattr(importlib.import_module(module), name)
+    chunks = dict((k, int(v)) for k, v in (c.split("=") for c in args.chunks or []))
+    compute_aux(args.paths, fun, args.vars, args.outfile, chunks or None,
+                args.var_name)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Inspect and prune the pyaerocom cache directory (const.CACHEDIR)
+
+The cache directory grows without bound (pickled ungridded reads and the
+parquet cache from ungridded_parquet_cache.py). This script shows the size
+and hit / miss statistics of the cache and removes entries by age and / or
+least recent use until a size limit is met, e.g.::
+
+    python utils/manage_cachedir.py info
+    python utils/manage_cachedir.py prune --max-size 20G --max-age 30
+
+Limits can also be configured via the environment variables
+PYAEROCOM_CACHE_MAX_SIZE (e.g. 20G) and PYAEROCOM_CACHE_MAX_AGE (days), in
+which case they are enforced automatically after each write into the
+parquet cache.
+
+Pruning is safe while other processes use the cache: processes reading or
+writing cache entries hold a shared lock (see :func:`using_cache`), and
+entries are only removed while holding the exclusive lock. Only one
+process prunes at a time and entries used within the last hour (see
+--min-age) are never evicted. The time of last use of each entry is
+recorded in the statistics file (see :func:`mark_used`), since access
+times are not updated on many file systems (noatime / relatime).
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+#: Name of file containing cache statistics
+STATS_FILE = "_cache_stats.json"
+
+#: Name of lock file (shared while cache is used, exclusive while entries
+#: are removed)
+LOCK_FILE = ".cache.lock"
+
+#: Name of lock file of pruning processes
+PRUNE_LOCK_FILE = ".prune.lock"
+
+#: Name of lock file of statistics file
+STATS_LOCK_FILE = ".stats.lock"
+
+#: Subdirectories of the cache directory that contain one entry per file or
+#: subdirectory (e.g. parquet/<obs_id>, region_masks/<hash>.npz)
+GROUPED_DIRS = ["parquet", "grid_index", "region_masks"]
+
+#: Files belonging to an SQLite database (e.g. file_inventory.sqlite),
+#: which are treated as part of the database entry
+SQLITE_SUFFIXES = ["-journal", "-wal", "-shm"]
+
+_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def get_cachedir():
+    """Default cache directory (const.CACHEDIR)"""
+    from pyaerocom import const
+
+    return const.CACHEDIR
+
+
+def parse_size(size):
+    """Convert size string (e.g. 500M, 20G) into number of bytes"""
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in _UNITS:
+        return int(float(size[:-1]) * _UNITS[size[-1]])
+    return int(size)
+
+
+def format_size(nbytes):
+    """Convert number of bytes into human readable string"""
+    for unit in ["", "K", "M", "G"]:
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f} {unit}B"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+@contextmanager
+def _locked(cachedir, name=LOCK_FILE, shared=False, blocking=True):
+    os.makedirs(cachedir, exist_ok=True)
+    with open(os.path.join(cachedir, name), "a") as lock:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def using_cache(cachedir=None):
+    """Context manager for reading or writing cache entries
+
+    Holds a shared lock on the cache directory, so that no entries are
+    removed by :func:`prune` in the meantime. Must not be held while
+    calling :func:`prune` or :func:`enforce_limits`.
+    """
+    if cachedir is None:
+        cachedir = get_cachedir()
+    with _locked(cachedir, shared=True):
+        yield
+
+
+def _sqlite_files(path):
+    return [path] + [f"{path}{suffix}" for suffix in SQLITE_SUFFIXES
+                     if os.path.exists(f"{path}{suffix}")]
+
+
+def _entry_info(path, last_used=0):
+    """Size and time of last use (max of recorded use and mtime) of entry"""
+    try:
+        if not os.path.isdir(path):
+            size = 0
+            for name in _sqlite_files(path):
+                st = os.stat(name)
+                size += st.st_size
+                last_used = max(last_used, st.st_mtime)
+            return size, last_used
+        size, last_used = 0, max(last_used, os.stat(path).st_mtime)
+        for root, _, files in os.walk(path):
+            for name in files:
+                st = os.stat(os.path.join(root, name))
+                size += st.st_size
+                last_used = max(last_used, st.st_mtime)
+        return size, last_used
+    except FileNotFoundError:  # removed by another process
+        return 0, 0
+
+
+def list_entries(cachedir=None):
+    """List cache entries
+
+    Each file in the cache directory is one entry, as is each directory
+    (except for :attr:`GROUPED_DIRS`, in which each file or subdirectory is
+    one entry). Hidden files, the statistics file and journal files of
+    SQLite databases are not listed separately.
+
+    Returns
+    -------
+    list
+        (path, size in bytes, time of last use) of each entry
+    """
+    if cachedir is None:
+        cachedir = get_cachedir()
+    paths = []
+    names = os.listdir(cachedir)
+    for name in names:
+        if name.startswith(".") or name == STATS_FILE:
+            continue
+        if any(name.endswith(suffix) and name[:-len(suffix)] in names
+               for suffix in SQLITE_SUFFIXES):
+            continue
+        path = os.path.join(cachedir, name)
+        if name in GROUPED_DIRS and os.path.isdir(path):
+            paths.extend(os.path.join(path, sub) for sub in os.listdir(path)
+                         if not sub.startswith("."))
+        else:
+            paths.append(path)
+    used = read_stats(cachedir).get("last_used", {})
+    return [(path, *_entry_info(path, used.get(os.path.relpath(path, cachedir), 0)))
+            for path in sorted(paths)]
+
+
+def read_stats(cachedir=None):
+    """Read cache statistics (hits, misses, bytes_saved)"""
+    if cachedir is None:
+        cachedir = get_cachedir()
+    try:
+        with open(os.path.join(cachedir, STATS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict(hits=0, misses=0, bytes_saved=0, last_used={})
+
+
+def _update_stats(cachedir, update):
+    with _locked(cachedir, STATS_LOCK_FILE):
+        stats = read_stats(cachedir)
+        update(stats)
+        tmp = os.path.join(cachedir, f".{STATS_FILE}.{os.getpid()}")
+        with open(tmp, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp, os.path.join(cachedir, STATS_FILE))
+
+
+def mark_used(path, cachedir=None):
+    """Record use of a cache entry (cf. :func:`prune`)
+
+    Parameters
+    ----------
+    path : str
+        cache entry (file or directory, e.g. <cachedir>/parquet/<obs_id>)
+    cachedir : str, optional
+        cache directory
+    """
+    if cachedir is None:
+        cachedir = get_cachedir()
+    key = os.path.relpath(path, cachedir)
+
+    def update(stats):
+        stats.setdefault("last_used", {})[key] = time.time()
+
+    _update_stats(cachedir, update)
+
+
+def record_access(hit, nbytes=0, cachedir=None):
+    """Update cache statistics
+
+    Parameters
+    ----------
+    hit : bool
+        whether the data was found in the cache
+    nbytes : int
+        size of the data loaded from the cache (only used if hit is True)
+    cachedir : str, optional
+        cache directory
+    """
+    if cachedir is None:
+        cachedir = get_cachedir()
+
+    def update(stats):
+        if hit:
+            stats["hits"] += 1
+            stats["bytes_saved"] += int(nbytes)
+        else:
+            stats["misses"] += 1
+
+    _update_stats(cachedir, update)
+
+
+def _remove(path):
+    # called with exclusive lock, i.e. the entry is not in use
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+    removed = False
+    for name in _sqlite_files(path):
+        try:
+            os.remove(name)
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def prune(cachedir=None, max_size=None, max_age=None, min_age=3600,
+          dry_run=False):
+    """Remove cache entries by age and least recent use
+
+    Parameters
+    ----------
+    cachedir : str, optional
+        cache directory (default: const.CACHEDIR)
+    max_size : int or str, optional
+        maximum total size of cache (e.g. 20G). Least recently used
+        entries are removed until the cache is smaller.
+    max_age : float, optional
+        entries not used for more than max_age days are removed
+    min_age : float
+        entries used within the last min_age seconds are never removed
+    dry_run : bool
+        if True, only print what would be removed
+
+    Returns
+    -------
+    list
+        removed entries (empty if another process is pruning)
+    """
+    if cachedir is None:
+        cachedir = get_cachedir()
+    if max_size is not None:
+        max_size = parse_size(max_size)
+    now = time.time()
+    removed = []
+    with _locked(cachedir, PRUNE_LOCK_FILE, blocking=False) as acquired:
+        if not acquired:
+            print("Cache is being pruned by another process")
+            return removed
+        # waits until no other process uses the cache
+        with _locked(cachedir, shared=dry_run):
+            entries = sorted(list_entries(cachedir), key=lambda e: e[2])
+            total = sum(e[1] for e in entries)
+            for path, size, last_used in entries:  # least recently used first
+                if now - last_used < min_age:
+                    break
+                too_old = max_age is not None and now - last_used > max_age * 86400
+                too_big = max_size is not None and total > max_size
+                if not (too_old or too_big):
+                    continue
+                print(f"{'Would remove' if dry_run else 'Removing'}: {path} "
+                      f"({format_size(size)})")
+                if dry_run or _remove(path):
+                    removed.append(path)
+                    total -= size
+        if not dry_run:
+            # forget removed entries
+            keys = {os.path.relpath(path, cachedir) for path in removed}
+            _update_stats(cachedir, lambda stats: stats.update(last_used={
+                k: v for k, v in stats.get("last_used", {}).items() if k not in keys}))
+    return removed
+
+
+def enforce_limits(cachedir=None):
+    """Prune cache according to PYAEROCOM_CACHE_MAX_SIZE / _MAX_AGE
+
+    Does nothing if none of the environment variables is set.
+    """
+    max_size = os.environ.get("PYAEROCOM_CACHE_MAX_SIZE")
+    max_age = os.environ.get("PYAEROCOM_CACHE_MAX_AGE")
+    if max_size is None and max_age is None:
+        return []
+    return prune(cachedir, max_size=max_size,
+                 max_age=None if max_age is None else float(max_age))
+
+
+def print_info(cachedir=None, num=10):
+    """Print size, statistics and least recently used entries of cache"""
+    if cachedir is None:
+        cachedir = get_cachedir()
+    entries = list_entries(cachedir)
+    stats = read_stats(cachedir)
+    total = sum(e[1] for e in entries)
+    accesses = stats["hits"] + stats["misses"]
+    print(f"Cache directory: {cachedir}")
+    print(f"Entries: {len(entries)}, total size: {format_size(total)}")
+    print(f"Hits: {stats['hits']}, misses: {stats['misses']}"
+          + (f" (hit rate {100 * stats['hits'] / accesses:.0f}%)" if accesses else "")
+          + f", loaded from cache: {format_size(stats['bytes_saved'])}")
+    print(f"\nLeast recently used entries (max. {num}):")
+    for path, size, last_used in sorted(entries, key=lambda e: e[2])[:num]:
+        used = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used))
+        print(f"{used}  {format_size(size):>10}  {os.path.relpath(path, cachedir)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cachedir", default=None,
+                        help="Cache directory (default: const.CACHEDIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="Show size and statistics of cache")
+    info.add_argument("-n", default=10, type=int,
+                      help="Number of least recently used entries listed")
+    pr = sub.add_parser("prune", help="Remove old / least recently used entries")
+    pr.add_argument("--max-size", default=os.environ.get("PYAEROCOM_CACHE_MAX_SIZE"),
+                    help="Maximum size of cache, e.g. 20G")
+    pr.add_argument("--max-age", type=float,
+                    default=os.environ.get("PYAEROCOM_CACHE_MAX_AGE"),
+                    help="Remove entries not used for more than this many days")
+    pr.add_argument("--min-age", type=float, default=3600,
+                    help="Never remove entries used within this many seconds")
+    pr.add_argument("--dry-run", action="store_true",
+                    help="Only show what would be removed")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print_info(args.cachedir, args.n)
+    else:
+        removed = prune(args.cachedir, max_size=args.max_size,
+                        max_age=args.max_age, min_age=args.min_age,
+                        dry_run=args.dry_run)
+        print(f"{len(removed)} entries {'would be ' if args.dry_run else ''}removed")
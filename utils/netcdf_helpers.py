@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Helpers for writing and reading colocated data (ColocatedData) as netCDF
+
+The metadata is converted with the methods of ColocatedData (dicts are
+stored as strings under the key "CONV!<key>", None as "None"), so that
+files written here can be read with ColocatedData.read_netcdf and vice
+versa.
+"""
+
+
+def _coldata(data):
+    from pyaerocom import ColocatedData
+
+    return ColocatedData(data=data)
+
+
+def netcdf_attrs(data):
+    """Attributes of colocated data in a form that can be stored in netCDF
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        colocated data
+
+    Returns
+    -------
+    dict
+        converted attributes (cf. ColocatedData._prepare_meta_to_netcdf)
+    """
+    return _coldata(data)._prepare_meta_to_netcdf()
+
+
+def attrs_from_netcdf(data):
+    """Attributes of colocated data read from netCDF
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        colocated data, as opened from netCDF
+
+    Returns
+    -------
+    dict
+        converted attributes (cf. ColocatedData._meta_from_netcdf)
+    """
+    return _coldata(data)._meta_from_netcdf(data.attrs)
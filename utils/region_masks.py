@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Cached region masks and vectorised station to region assignment
+
+Regional filters (e.g. Filter("NAFRICA"), HTAP regions) and regional
+statistics (regions_how="country") derive masks for every variable, model
+and frequency again, although they only depend on the grid and the set of
+regions. Here, boolean masks and normalised area weights of a set of
+regions are computed once per (grid, region set) and cached in memory and
+on disk (<const.CACHEDIR>/region_masks/<hash>.npz). Regional means of
+gridded data then are a single tensor contraction for all regions.
+
+Regions can be given as
+
+- names of pyaerocom default regions (rectangles, e.g. EUROPE, NAFRICA),
+- names of HTAP regions (masks from pyaerocom.helpers_landsea_masks),
+- polygons (shapely geometries, e.g. countries read from a shapefile).
+
+For ungridded data, stations are assigned to polygon regions with a
+vectorised point-in-polygon query on a spatial index (shapely STRtree)
+instead of looking up each station separately.
+
+Example::
+
+    from region_masks import get_region_masks, regional_means, assign_stations
+
+    masks = get_region_masks(model.lat.values, model.lon.values,
+                             ["EUROPE", "NAFRICA", "EAS"])
+    means = regional_means(model, masks)             # (time, region)
+
+    countries = {name: geom for name, geom in ...}   # shapely geometries
+    region_idx = assign_stations(station_lats, station_lons, countries)
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from manage_cachedir import mark_used, using_cache
+
+#: In-memory cache of masks
+_CACHE = {}
+
+
+class RegionMasks:
+    """Masks and area weights of a set of regions on one grid
+
+    Attributes
+    ----------
+    regions : list
+        region names
+    masks : ndarray
+        boolean masks (region, lat, lon)
+    weights : ndarray
+        area weights (region, lat, lon), zero outside of region, normalised
+        to sum 1 per region (regions without grid cells are all zero)
+    """
+
+    def __init__(self, regions, masks, weights):
+        self.regions = list(regions)
+        self.masks = np.asarray(masks, dtype=bool)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def __getitem__(self, region):
+        return self.masks[self.regions.index(region)]
+
+    def save(self, path):
+        np.savez_compressed(path, regions=np.array(self.regions, dtype=str),
+                            masks=self.masks, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            # names are stored as numpy unicode array
+            return cls([str(name) for name in f["regions"]], f["masks"], f["weights"])
+
+
+def cell_areas(lats, lons):
+    """Relative areas of grid cells of a regular grid (lat, lon)"""
+    lats = np.asarray(lats, dtype=np.float64)
+    dlat = np.abs(np.gradient(lats)) if len(lats) > 1 else np.ones(1)
+    dlon = np.abs(np.gradient(np.asarray(lons, dtype=np.float64))) if len(lons) > 1 else np.ones(1)
+    return (np.cos(np.deg2rad(lats)) * dlat)[:, None] * dlon[None, :]
+
+
+def _region_ranges(name):
+    """Latitude and longitude range of a pyaerocom default region"""
+    from pyaerocom.region import Region
+
+    reg = Region(name)
+    if reg.lat_range is None or reg.lon_range is None:
+        raise ValueError(f"Region {name} has no lat/lon range (e.g. WORLD), "
+                         f"use a region with a defined rectangle or a polygon")
+    return reg.lat_range, reg.lon_range
+
+
+def _rect_mask(lats, lons, lat_range, lon_range):
+    lat_ok = (lats >= lat_range[0]) & (lats <= lat_range[1])
+    lons = (np.asarray(lons) + 180) % 360 - 180
+    lon0, lon1 = lon_range
+    if lon0 <= lon1:
+        lon_ok = (lons >= lon0) & (lons <= lon1)
+    else:  # crosses date line
+        lon_ok = (lons >= lon0) | (lons <= lon1)
+    return lat_ok[:, None] & lon_ok[None, :]
+
+
+def _htap_mask(lats, lons, region):
+    from pyaerocom.helpers_landsea_masks import load_region_mask_xr
+
+    mask = load_region_mask_xr(region)
+    mlat, mlon = mask.dims[-2], mask.dims[-1]
+    lat_idx = np.abs(mask[mlat].values[None, :] - np.asarray(lats)[:, None]).argmin(axis=1)
+    wrapped = (np.asarray(lons) + 180) % 360 - 180
+    mask_lons = (mask[mlon].values + 180) % 360 - 180
+    lon_idx = np.abs(mask_lons[None, :] - wrapped[:, None]).argmin(axis=1)
+    return mask.values[np.ix_(lat_idx, lon_idx)] > 0
+
+
+def _polygon_mask(lats, lons, geometry):
+    import shapely
+
+    lon2d, lat2d = np.meshgrid((np.asarray(lons) + 180) % 360 - 180, lats)
+    return shapely.contains_xy(geometry, lon2d, lat2d)
+
+
+def compute_mask(lats, lons, region):
+    """Boolean mask (lat, lon) of one region on a regular grid
+
+    Parameters
+    ----------
+    lats, lons : ndarray
+        1D grid coordinates
+    region : str or shapely geometry
+        name of pyaerocom region or HTAP region, or polygon
+
+    Returns
+    -------
+    ndarray
+        mask
+    """
+    if not isinstance(region, str):
+        return _polygon_mask(lats, lons, region)
+    from pyaerocom import const
+
+    if region in getattr(const, "HTAP_REGIONS", []):
+        return _htap_mask(lats, lons, region)
+    return _rect_mask(np.asarray(lats), lons, *_region_ranges(region))
+
+
+def _regions_key(regions):
+    parts = []
+    for name, region in regions.items():
+        parts.append(name)
+        # polygons are identified by their geometry
+        parts.append(region if isinstance(region, str) else region.wkb_hex)
+    return "|".join(parts)
+
+
+def _compute_masks(lats, lons, regions):
+    masks = np.stack([compute_mask(lats, lons, region) for region in regions.values()])
+    weights = masks * cell_areas(lats, lons)[None]
+    total = weights.sum(axis=(1, 2), keepdims=True)
+    weights = np.divide(weights, total, out=np.zeros_like(weights), where=total > 0)
+    return RegionMasks(list(regions), masks, weights)
+
+
+def get_region_masks(lats, lons, regions, cachedir=None):
+    """Get masks and area weights of regions (cached)
+
+    Parameters
+    ----------
+    lats, lons : ndarray
+        1D coordinates of a regular grid
+    regions : list or dict
+        region names, or dict mapping names to region names or polygons
+    cachedir : str, optional
+        directory for on-disk cache (default: <const.CACHEDIR>/region_masks
+        if pyaerocom is available, else no on-disk cache)
+
+    Returns
+    -------
+    RegionMasks
+        masks of all regions
+    """
+    if not isinstance(regions, dict):
+        regions = {name: name for name in regions}
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    hasher = hashlib.sha1()
+    for arr in (lats, lons):
+        hasher.update(str(arr.shape).encode())
+        hasher.update(np.ascontiguousarray(arr).tobytes())
+    hasher.update(_regions_key(regions).encode())
+    key = hasher.hexdigest()
+    if key in _CACHE:
+        return _CACHE[key]
+
+    if cachedir is None:
+        try:
+            from pyaerocom import const
+
+            cachedir = os.path.join(const.CACHEDIR, "region_masks")
+        except ImportError:
+            pass
+    if cachedir is None:
+        result = _compute_masks(lats, lons, regions)
+    else:
+        path = os.path.join(cachedir, f"{key}.npz")
+        # locks and usage statistics are kept in the cache directory
+        # (parent of cachedir, cf. manage_cachedir)
+        root = os.path.dirname(os.path.abspath(cachedir))
+        with using_cache(root):
+            if os.path.exists(path):
+                result = RegionMasks.load(path)
+            else:
+                result = _compute_masks(lats, lons, regions)
+                os.makedirs(cachedir, exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.npz"
+                result.save(tmp)
+                os.replace(tmp, path)
+        mark_used(path, root)
+    _CACHE[key] = result
+    return result
+
+
+def regional_means(data, masks, lat_dim=None, lon_dim=None):
+    """Area weighted means of all regions in one batched reduction
+
+    Grid cells without data (NaN) are excluded and the weights are
+    renormalised accordingly (per region and time step).
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        gridded data (..., lat, lon), e.g. GriddedData.to_xarray()
+    masks : RegionMasks
+        masks on the grid of data
+    lat_dim, lon_dim : str, optional
+        names of horizontal dimensions (default: last two dimensions)
+
+    Returns
+    -------
+    xarray.DataArray
+        regional means (..., region)
+    """
+    import xarray as xr
+
+    lat_dim = data.dims[-2] if lat_dim is None else lat_dim
+    lon_dim = data.dims[-1] if lon_dim is None else lon_dim
+    weights = xr.DataArray(masks.weights, dims=("region", lat_dim, lon_dim),
+                           coords={"region": masks.regions})
+    valid = data.notnull()
+    total = xr.dot(data.fillna(0), weights, dims=[lat_dim, lon_dim])
+    norm = xr.dot(valid.astype(np.float64), weights, dims=[lat_dim, lon_dim])
+    return total / norm.where(norm > 0)
+
+
+def assign_stations(lats, lons, regions):
+    """Assign stations to regions with a vectorised point-in-polygon query
+
+    Parameters
+    ----------
+    lats, lons : ndarray
+        station coordinates
+    regions : dict
+        region name -> shapely geometry (regions should not overlap,
+        otherwise the first matching region is used)
+
+    Returns
+    -------
+    ndarray
+        region name of each station (None if not in any region)
+    """
+    import shapely
+    from shapely.strtree import STRtree
+
+    names = list(regions)
+    tree = STRtree([regions[name] for name in names])
+    lons = (np.asarray(lons, dtype=np.float64) + 180) % 360 - 180
+    points = shapely.points(lons, np.asarray(lats, dtype=np.float64))
+    point_idx, geom_idx = tree.query(points, predicate="intersects")
+    result = np.full(len(points), None, dtype=object)
+    # keep first match of each station
+    order = np.lexsort((geom_idx, point_idx))
+    point_idx, geom_idx = point_idx[order], geom_idx[order]
+    first = np.unique(point_idx, return_index=True)[1]
+    result[point_idx[first]] = np.asarray(names, dtype=object)[geom_idx[first]]
+    return result
+
+
+def assign_stations_rect(lats, lons, regions):
+    """Boolean membership (station, region) of pyaerocom (rectangular)
+    regions for all stations at once"""
+    lats = np.asarray(lats, dtype=np.float64)[:, None]
+    lons = ((np.asarray(lons, dtype=np.float64) + 180) % 360 - 180)[:, None]
+    ranges = [_region_ranges(name) for name in regions]
+    lat0 = np.array([lat_range[0] for lat_range, _ in ranges])
+    lat1 = np.array([lat_range[1] for lat_range, _ in ranges])
+    lon0 = np.array([lon_range[0] for _, lon_range in ranges])
+    lon1 = np.array([lon_range[1] for _, lon_range in ranges])
+    lon_ok = np.where(lon0 <= lon1, (lons >= lon0) & (lons <= lon1),
+                      (lons >= lon0) | (lons <= lon1))
+    return (lats >= lat0) & (lats <= lat1) & lon_ok
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Precomputed station to grid cell mapping for batched time series extraction
+
+Extracting model time series at station locations one station at a time
+(cf. GriddedData.to_time_series) searches the grid for every station. Here,
+the grid indices of all stations are computed once (index arithmetic for
+regular grids, nearest neighbour search on a KD-tree for curvilinear or
+irregular grids) and all time series are then extracted with one
+vectorised indexing operation. Stations outside the grid (e.g. of a
+regional model) get index -1 and are dropped on extraction, as in pyaerocom.
+The mapping only depends on the grid and the station coordinates, so it is
+cached in memory and on disk and can be reused for all variables and models
+that share a grid.
+
+Example::
+
+    import xarray as xr
+    from station_grid_index import get_station_grid_index
+
+    model = xr.open_dataarray("Base_day.nc")           # (time, lat, lon)
+    index = get_station_grid_index(model.lat.values, model.lon.values,
+                                   station_lats, station_lons,
+                                   station_names=names)
+    ts = index.extract(model)                          # (time, station_name)
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from manage_cachedir import mark_used, using_cache
+
+#: Version of the mapping (part of the cache key)
+INDEX_VERSION = 2
+
+#: In-memory cache of computed mappings
+_CACHE = {}
+
+
+def _hash_arrays(*arrays):
+    hasher = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        hasher.update(str(arr.shape).encode())
+        hasher.update(arr.tobytes())
+    return hasher.hexdigest()
+
+
+def _wrap_lons(lons, grid_lons):
+    """Convert station longitudes to the convention of the grid (0/360)"""
+    lons = np.asarray(lons, dtype=np.float64)
+    if np.nanmax(grid_lons) > 180:
+        return lons % 360
+    return (lons + 180) % 360 - 180
+
+
+def _nearest_regular(coord, values):
+    """Indices of nearest grid points on an (ir)regular 1D axis
+
+    Values outside the grid cells (more than half a step beyond the first
+    or last grid point) get index -1.
+    """
+    coord = np.asarray(coord, dtype=np.float64)
+    ascending = coord[-1] >= coord[0]
+    c = coord if ascending else coord[::-1]
+    steps = np.diff(c)
+    if len(c) > 1 and np.allclose(steps, steps[0]):
+        # equidistant: direct index arithmetic
+        idx = np.rint((values - c[0]) / steps[0]).astype(int)
+        idx = np.clip(idx, 0, len(c) - 1)
+    else:
+        right = np.clip(np.searchsorted(c, values), 1, len(c) - 1)
+        left = right - 1
+        idx = np.where(np.abs(values - c[left]) <= np.abs(c[right] - values),
+                       left, right)
+    if len(c) > 1:
+        outside = ((values < c[0] - steps[0] / 2)
+                   | (values > c[-1] + steps[-1] / 2) | np.isnan(values))
+    else:
+        outside = np.isnan(values)
+    idx = idx if ascending else len(c) - 1 - idx
+    return np.where(outside, -1, idx)
+
+
+def _outside_curvilinear(grid_xyz, shape, flat, dist):
+    """Stations farther from the nearest grid point than its neighbours"""
+    iy, ix = np.unravel_index(flat, shape)
+    grid_xyz = grid_xyz.reshape(shape + (3,))
+    cell = np.zeros(len(flat))
+    for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        ny = np.clip(iy + dy, 0, shape[0] - 1)
+        nx = np.clip(ix + dx, 0, shape[1] - 1)
+        step = np.linalg.norm(grid_xyz[ny, nx] - grid_xyz[iy, ix], axis=-1)
+        cell = np.maximum(cell, step)
+    return dist > cell
+
+
+def _to_xyz(lats, lons):
+    lat, lon = np.deg2rad(lats), np.deg2rad(lons)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+class StationGridIndex:
+    """Grid indices of a set of stations
+
+    Attributes
+    ----------
+    lat_idx, lon_idx : ndarray
+        index of each station along the first and second horizontal grid
+        dimension (latitude / longitude for regular grids, y / x for
+        curvilinear grids), -1 for stations outside the grid
+    station_names : list
+        names of stations (or None)
+    """
+
+    def __init__(self, lat_idx, lon_idx, station_names=None):
+        self.lat_idx = np.asarray(lat_idx, dtype=int)
+        self.lon_idx = np.asarray(lon_idx, dtype=int)
+        self.station_names = (None if station_names is None
+                              else list(station_names))
+
+    @property
+    def valid(self):
+        """Mask of stations inside the grid"""
+        return (self.lat_idx >= 0) & (self.lon_idx >= 0)
+
+    @classmethod
+    def build(cls, grid_lats, grid_lons, station_lats, station_lons,
+              station_names=None):
+        """Compute grid indices of stations
+
+        Parameters
+        ----------
+        grid_lats, grid_lons : ndarray
+            1D coordinates of a regular grid or 2D coordinates of a
+            curvilinear grid
+        station_lats, station_lons : ndarray
+            station coordinates
+        station_names : list, optional
+            station names (used as coordinate in :func:`extract`)
+
+        Returns
+        -------
+        StationGridIndex
+            mapping
+        """
+        grid_lats = np.asarray(grid_lats, dtype=np.float64)
+        grid_lons = np.asarray(grid_lons, dtype=np.float64)
+        lats = np.asarray(station_lats, dtype=np.float64)
+        lons = _wrap_lons(station_lons, grid_lons)
+        if grid_lats.ndim == 1 and grid_lons.ndim == 1:
+            lat_idx = _nearest_regular(grid_lats, lats)
+            step = np.abs(np.diff(grid_lons)).mean() if len(grid_lons) > 1 else 0
+            if np.ptp(grid_lons) + step >= 359.99:
+                # global grid: account for periodicity, e.g. 359.9 is
+                # closest to 0 (grid_lons assumed ascending)
+                lon_idx = _nearest_regular(
+                    np.concatenate([grid_lons, grid_lons[:1] + 360]),
+                    np.where(lons < grid_lons.min(), lons + 360, lons))
+                lon_idx[lon_idx == len(grid_lons)] = 0
+            else:
+                lon_idx = _nearest_regular(grid_lons, lons)
+        elif grid_lats.shape == grid_lons.shape and grid_lats.ndim == 2:
+            from scipy.spatial import cKDTree
+
+            grid_xyz = _to_xyz(grid_lats.ravel(), grid_lons.ravel())
+            tree = cKDTree(grid_xyz)
+            dist, flat = tree.query(_to_xyz(lats, lons))
+            lat_idx, lon_idx = np.unravel_index(flat, grid_lats.shape)
+            outside = _outside_curvilinear(grid_xyz, grid_lats.shape, flat, dist)
+            lat_idx = np.where(outside, -1, lat_idx)
+            lon_idx = np.where(outside, -1, lon_idx)
+        else:
+            raise ValueError("Grid coordinates must be 1D (regular grid) or "
+                             "2D with same shape (curvilinear grid)")
+        invalid = (lat_idx < 0) | (lon_idx < 0)
+        return cls(np.where(invalid, -1, lat_idx), np.where(invalid, -1, lon_idx),
+                   station_names)
+
+    def save(self, path):
+        """Save mapping to .npz file"""
+        names = (np.array([], dtype=str) if self.station_names is None
+                 else np.array(self.station_names, dtype=str))
+        np.savez(path, lat_idx=self.lat_idx, lon_idx=self.lon_idx,
+                 station_names=names, has_names=self.station_names is not None)
+
+    @classmethod
+    def load(cls, path):
+        """Load mapping from .npz file"""
+        with np.load(path) as f:
+            names = list(f["station_names"]) if f["has_names"] else None
+            return cls(f["lat_idx"], f["lon_idx"], names)
+
+    def extract(self, data, lat_dim=None, lon_dim=None, dim="station_name"):
+        """Extract time series of all stations in one indexing operation
+
+        Parameters
+        ----------
+        data : xarray.DataArray or GriddedData
+            gridded data (GriddedData is converted using to_xarray)
+        lat_dim, lon_dim : str, optional
+            names of horizontal dimensions (default: second to last and
+            last dimension)
+        dim : str
+            name of the new station dimension
+
+        Returns
+        -------
+        xarray.DataArray
+            data at station locations, where the horizontal dimensions are
+            replaced by the station dimension (stations outside the grid
+            are dropped)
+        """
+        import xarray as xr
+
+        if not isinstance(data, xr.DataArray):
+            data = data.to_xarray()
+        lat_dim = data.dims[-2] if lat_dim is None else lat_dim
+        lon_dim = data.dims[-1] if lon_dim is None else lon_dim
+        valid = self.valid
+        coords = ({} if self.station_names is None
+                  else {dim: np.asarray(self.station_names, dtype=object)[valid]})
+        return data.isel({
+            lat_dim: xr.DataArray(self.lat_idx[valid], dims=dim, coords=coords),
+            lon_dim: xr.DataArray(self.lon_idx[valid], dims=dim, coords=coords),
+        })
+
+
+def get_station_grid_index(grid_lats, grid_lons, station_lats, station_lons,
+                           station_names=None, cachedir=None):
+    """Get cached station to grid mapping (compute if not cached)
+
+    Parameters
+    ----------
+    grid_lats, grid_lons, station_lats, station_lons, station_names
+        see :func:`StationGridIndex.build`
+    cachedir : str, optional
+        directory for on-disk cache (default: <const.CACHEDIR>/grid_index
+        if pyaerocom is available, else no on-disk cache)
+
+    Returns
+    -------
+    StationGridIndex
+        mapping
+    """
+    key = f"{_hash_arrays(grid_lats, grid_lons, station_lats, station_lons)}-v{INDEX_VERSION}"
+    if station_names is not None:
+        names = json.dumps([str(name) for name in station_names])
+        key = hashlib.sha1(f"{key}\n{names}".encode()).hexdigest()
+    if key in _CACHE:
+        return _CACHE[key]
+    if cachedir is None:
+        try:
+            from pyaerocom import const
+
+            cachedir = os.path.join(const.CACHEDIR, "grid_index")
+        except ImportError:
+            pass
+    if cachedir is None:
+        index = StationGridIndex.build(grid_lats, grid_lons, station_lats,
+                                       station_lons, station_names)
+    else:
+        path = os.path.join(cachedir, f"{key}.npz")
+        # locks and usage statistics are kept in the cache directory
+        # (parent of cachedir, cf. manage_cachedir)
+        root = os.path.dirname(os.path.abspath(cachedir))
+        with using_cache(root):
+            if os.path.exists(path):
+                index = StationGridIndex.load(path)
+            else:
+                index = StationGridIndex.build(grid_lats, grid_lons, station_lats,
+                                               station_lons, station_names)
+                os.makedirs(cachedir, exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.npz"
+                index.save(tmp)
+                os.replace(tmp, path)
+        mark_used(path, root)
+    _CACHE[key] = index
+    return index
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Extract variables, region and time range from (large) model netCDF files
+
+Files are opened lazily using dask, so only the requested subset is read
+from disk, chunk by chunk, while writing the compressed output. This can be
+used to prepare reduced model input for pyaerocom (e.g. for ReadMscwCtm)
+without loading full files into memory.
+
+Example (all yearly EMEP files of a directory, 4 files at a time)::
+
+    python utils/subset_model_files.py /path/to/EMEP/2018 --outdir ./tmp \\
+        --vars SURF_ug_PM10_rh50 SURF_ppb_O3 --region EUROPE --jobs 4
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+LAT_NAMES = ["lat", "latitude"]
+LON_NAMES = ["lon", "longitude"]
+
+
+def get_region_ranges(region):
+    """Get latitude and longitude range of a pyaerocom region
+
+    Parameters
+    ----------
+    region : str
+        name of region, e.g. EUROPE, ASIA (cf. pyaerocom.region_defs)
+
+    Returns
+    -------
+    tuple
+        (lat_range, lon_range)
+    """
+    from pyaerocom.region import Region
+
+    reg = Region(region)
+    return tuple(reg.lat_range), tuple(reg.lon_range)
+
+
+def _find_coord(data, names):
+    for name in names:
+        if name in data.coords:
+            return name
+    raise ValueError(f"None of the coordinates {names} found in dataset")
+
+
+def _coord_slice(coord, vmin, vmax):
+    # account for coordinates stored in descending order
+    if coord.size > 1 and coord[0] > coord[-1]:
+        return slice(vmax, vmin)
+    return slice(vmin, vmax)
+
+
+def subset_dataset(data, variables=None, lat_range=None, lon_range=None,
+                   start=None, stop=None):
+    """Lazily select variables, lat/lon box and time range of a dataset
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        input dataset
+    variables : list, optional
+        variables to keep (default: all)
+    lat_range, lon_range : tuple, optional
+        (min, max) of latitude and longitude
+    start, stop : str, optional
+        start and stop time (e.g. "2018-01-01")
+
+    Returns
+    -------
+    xarray.Dataset
+        subset
+    """
+    if variables:
+        data = data[variables]
+    sel = {}
+    if lat_range is not None:
+        lat = _find_coord(data, LAT_NAMES)
+        sel[lat] = _coord_slice(data[lat].values, *lat_range)
+    if lon_range is not None:
+        lon = _find_coord(data, LON_NAMES)
+        sel[lon] = _coord_slice(data[lon].values, *lon_range)
+    if (start is not None or stop is not None) and "time" in data.coords:
+        sel["time"] = slice(start, stop)
+    return data.sel(**sel)
+
+
+def _encoding(data, complevel, chunks):
+    enc = {}
+    for name, var in data.data_vars.items():
+        # chunking of the input file may not be valid for the subset
+        for key in ("chunksizes", "original_shape", "contiguous"):
+            var.encoding.pop(key, None)
+        if not np.issubdtype(var.dtype, np.number):
+            continue
+        enc[name] = dict(zlib=True, complevel=complevel)
+        if chunks:
+            enc[name]["chunksizes"] = tuple(
+                min(chunks.get(dim, size), size)
+                for dim, size in zip(var.dims, var.shape))
+    return enc
+
+
+def subset_file(inpath, outpath, variables=None, lat_range=None,
+                lon_range=None, start=None, stop=None, fmt="netcdf",
+                complevel=4, chunks=None):
+    """Write subset of a model file as compressed netCDF or Zarr
+
+    Parameters
+    ----------
+    inpath : str or Path
+        input netCDF file
+    outpath : str or Path
+        output file (netCDF) or directory (Zarr)
+    variables, lat_range, lon_range, start, stop
+        see :func:`subset_dataset`
+    fmt : str
+        output format, "netcdf" or "zarr"
+    complevel : int
+        zlib compression level (netCDF only)
+    chunks : dict, optional
+        dask chunks (dimension name -> size) used for reading and for the
+        chunking of the output (default: chunking of input file for netCDF,
+        automatic even chunks for Zarr)
+
+    Returns
+    -------
+    Path
+        output path
+    """
+    with xr.open_dataset(inpath, chunks=chunks or {}) as data:
+        sub = subset_dataset(data, variables, lat_range, lon_range, start, stop)
+        if fmt == "zarr":
+            # selections leave uneven dask chunks, which Zarr cannot store,
+            # so all dimensions are rechunked
+            sub = sub.chunk({dim: (chunks or {}).get(dim, "auto") for dim in sub.dims})
+            for var in sub.variables.values():
+                for key in ("chunks", "preferred_chunks", "chunksizes",
+                            "original_shape", "contiguous"):
+                    var.encoding.pop(key, None)
+            sub.to_zarr(outpath, mode="w")
+        elif fmt == "netcdf":
+            sub.to_netcdf(outpath, encoding=_encoding(sub, complevel, chunks))
+        else:
+            raise ValueError(f"Invalid output format {fmt}")
+    return Path(outpath)
+
+
+def _subset_file_single_threaded(*args, **kwargs):
+    # files are processed in parallel processes, additional dask threads in
+    # each process would oversubscribe the CPUs
+    import dask
+
+    with dask.config.set(scheduler="synchronous"):
+        return subset_file(*args, **kwargs)
+
+
+def find_files(paths, pattern="*.nc"):
+    """Expand input paths (files and directories) into list of files"""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(path.glob(pattern)))
+        else:
+            files.append(path)
+    return files
+
+
+def subset_files(files, outdir, jobs=1, fmt="netcdf", **kwargs):
+    """Subset several files, optionally in parallel processes
+
+    Parameters
+    ----------
+    files : list
+        input files
+    outdir : str or Path
+        output directory (output files have the same names as input files,
+        with suffix .zarr in case of Zarr output)
+    jobs : int
+        number of files processed concurrently (in separate processes, each
+        using the single-threaded dask scheduler, default: 1, i.e. one file
+        at a time using the threaded dask scheduler)
+    fmt : str
+        output format, "netcdf" or "zarr"
+    **kwargs
+        passed to :func:`subset_file`
+
+    Returns
+    -------
+    list
+        output paths
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    suffix = ".zarr" if fmt == "zarr" else ".nc"
+    outpaths = [outdir / (Path(f).stem + suffix) for f in files]
+    if jobs <= 1:
+        for inpath, outpath in zip(files, outpaths):
+            print(f"Processing {inpath}")
+            subset_file(inpath, outpath, fmt=fmt, **kwargs)
+        return outpaths
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(_subset_file_single_threaded, inpath, outpath, fmt=fmt,
+                        **kwargs): inpath
+            for inpath, outpath in zip(files, outpaths)
+        }
+        for future in as_completed(futures):
+            print(f"Processed {futures[future]} -> {future.result()}")
+    return outpaths
+
+
+def _parse_chunks(items):
+    chunks = {}
+    for item in items or []:
+        dim, size = item.split("=")
+        chunks[dim] = int(size)
+    return chunks or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("inputs", nargs="+",
+                        help="Input netCDF files or directories")
+    parser.add_argument("--outdir", required=True, help="Output directory")
+    parser.add_argument("--vars", nargs="+", default=None,
+                        help="Variables to keep (default: all)")
+    parser.add_argument("--region", default=None,
+                        help="Name of pyaerocom region (e.g. EUROPE)")
+    parser.add_argument("--lat", nargs=2, type=float, default=None,
+                        metavar=("MIN", "MAX"), help="Latitude range")
+    parser.add_argument("--lon", nargs=2, type=float, default=None,
+                        metavar=("MIN", "MAX"), help="Longitude range")
+    parser.add_argument("--start", default=None, help="Start time")
+    parser.add_argument("--stop", default=None, help="Stop time")
+    parser.add_argument("--format", default="netcdf",
+                        choices=["netcdf", "zarr"], help="Output format")
+    parser.add_argument("--complevel", default=4, type=int,
+                        help="Compression level (netCDF)")
+    parser.add_argument("--chunks", nargs="+", default=None,
+                        metavar="DIM=SIZE",
+                        help="Dask / output chunks, e.g. time=1 lat=500")
+    parser.add_argument("--pattern", default="*.nc",
+                        help="Filename pattern for input directories")
+    parser.add_argument("--jobs", "-j", default=1, type=int,
+                        help="Number of files processed in parallel (default: "
+                        "one file at a time, using dask threads)")
+    args = parser.parse_args()
+
+    lat_range, lon_range = args.lat, args.lon
+    if args.region is not None:
+        reg_lat, reg_lon = get_region_ranges(args.region)
+        lat_range = lat_range or reg_lat
+        lon_range = lon_range or reg_lon
+
+    files = find_files(args.inputs, args.pattern)
+    subset_files(files, args.outdir, jobs=args.jobs, fmt=args.format,
+                 variables=args.vars, lat_range=lat_range,
+                 lon_range=lon_range, start=args.start, stop=args.stop,
+                 complevel=args.complevel, chunks=_parse_chunks(args.chunks))
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Vectorised trend computation for many stations, periods and seasons
+
+TrendsEngine.compute_trend processes the time series of one station (and
+one period and season) at a time. Here, the monthly series of all stations
+are passed as one (station, time) array. Yearly (seasonal) means, Sen
+slopes with confidence intervals (as scipy.stats.theilslopes) and
+Mann-Kendall p-values (as scipy.stats.kendalltau) are then computed for
+all stations at once using numpy array operations on all pairs of years.
+Stations can be processed in chunks, optionally in several processes.
+
+The output has the quantities of TrendsEngine.compute_trend (m, m_err,
+n, pval, slp, slp_err, reg0, y_mean, y_min, y_max), with the same values
+for the same yearly series, i.e. slp and slp_err are in percent per year
+relative to the trend line at the first year with data. The yearly values
+may differ from those of TrendsEngine: for season "all", TrendsEngine only
+uses years with data in all four seasons (here, min_num_months applies),
+and its seasonal slices of monthly data also include the first month after
+the season (e.g. September for summer).
+
+Example::
+
+    from trends_batch import compute_trends_batch, stack_station_series
+
+    data = stack_station_series({name: stat.resample_time(
+        "od550aer", ts_type="monthly")["od550aer"] for name, stat in ...})
+    trends = compute_trends_batch(data, periods=["1995-2014", "2002-2017"],
+                                  slope_alpha=0.68, n_workers=8)
+    trends.slp.sel(period="2002-2017", season="all")
+"""
+import functools
+import math
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.stats import kendalltau, norm, theilslopes
+
+#: months of seasons (winter includes December of the previous year)
+SEASONS = {
+    "all": list(range(1, 13)),
+    "spring": [3, 4, 5],
+    "summer": [6, 7, 8],
+    "autumn": [9, 10, 11],
+    "winter": [12, 1, 2],
+}
+
+#: maximum number of years for exact Mann-Kendall p-values (as in
+#: scipy.stats.kendalltau)
+MAX_EXACT_MK = 33
+
+#: output variables
+TREND_VARS = ["m", "m_err", "n", "pval", "slp", "slp_err", "reg0",
+              "y_mean", "y_min", "y_max"]
+
+
+@contextmanager
+def _quiet():
+    # all-NaN slices are expected (stations without data in a period)
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        yield
+
+
+def stack_station_series(series, dim="station_name"):
+    """Combine monthly series of several stations into (station, time) array
+
+    Parameters
+    ----------
+    series : dict
+        station name -> pandas.Series with monthly DatetimeIndex
+    dim : str
+        name of station dimension
+
+    Returns
+    -------
+    xarray.DataArray
+        monthly data of all stations (NaN where a station has no data)
+    """
+    frame = pd.DataFrame({name: s.resample("MS").mean() for name, s in series.items()})
+    frame.index.name = "time"
+    frame.columns.name = dim
+    return xr.DataArray(frame).transpose(dim, "time")
+
+
+def parse_period(period):
+    """Start and stop year of period string, e.g. "1995-2014" """
+    start, stop = (int(y) for y in str(period).split("-"))
+    if stop < start:
+        raise ValueError(f"Invalid period {period}")
+    return start, stop
+
+
+def monthly_to_yearly(values, season="all", avg_how="mean", min_num_months=1):
+    """Seasonal or annual means of monthly data
+
+    Parameters
+    ----------
+    values : ndarray
+        monthly data (station, 12 * num_years), starting in January
+    season : str
+        season (cf. SEASONS)
+    avg_how : str
+        "mean" or "median"
+    min_num_months : int
+        minimum number of valid months per year and season
+
+    Returns
+    -------
+    ndarray
+        yearly data (station, num_years)
+    """
+    nstat = values.shape[0]
+    monthly = values.reshape(nstat, -1, 12)
+    months = []
+    for month in SEASONS[season]:
+        vals = monthly[:, :, month - 1]
+        if season == "winter" and month == 12:
+            # December is assigned to the winter of the following year
+            vals = np.concatenate([np.full((nstat, 1), np.nan), vals[:, :-1]], axis=1)
+        months.append(vals)
+    months = np.stack(months, axis=-1)
+    agg = np.nanmedian if avg_how == "median" else np.nanmean
+    with _quiet():
+        yearly = agg(months, axis=-1)
+    yearly[np.isfinite(months).sum(axis=-1) < min_num_months] = np.nan
+    return yearly
+
+
+@functools.lru_cache(maxsize=None)
+def _kendall_cdf(n):
+    """Exact cumulative distribution of the number of discordant pairs of n
+    values without ties (as used by scipy.stats.kendalltau)"""
+    counts = np.zeros(n * (n - 1) // 2 + 1)
+    counts[0] = 1
+    for j in range(2, n + 1):
+        # the j-th value adds 0 ... j - 1 discordant pairs
+        prev = counts.copy()
+        for k in range(1, j):
+            counts[k:] += prev[:len(prev) - k]
+    return np.cumsum(counts) / math.factorial(n)
+
+
+def _mk_pval(n, dis, s, sigma):
+    """Two-sided p-value of Kendall's tau for series without ties (as
+    scipy.stats.kendalltau with method="auto")"""
+    pval = 2 * norm.sf(np.abs(s) / sigma)
+    tot = n * (n - 1) // 2
+    c = np.minimum(dis, tot - dis)
+    for k in np.unique(n[(n <= MAX_EXACT_MK) | (c <= 1)]):
+        if k < 3:
+            pval[n == k] = 1
+            continue
+        idx = np.flatnonzero(n == k)
+        if k <= MAX_EXACT_MK:
+            pval[idx] = 2 * _kendall_cdf(k)[c[idx]]
+        else:
+            small = idx[c[idx] <= 1]
+            pval[small] = [2 / math.factorial(k - ci) if k - ci < 171 else 0
+                           for ci in c[small]]
+    return np.clip(pval, 0, 1)
+
+
+def _scipy_trend(values, slope_alpha):
+    """Slope, slope error, intercept and p-value of one series (used for
+    series with ties)"""
+    t = np.flatnonzero(np.isfinite(values)).astype(float)
+    y = values[np.isfinite(values)]
+    slope, intercept, low, high = theilslopes(y, t, alpha=slope_alpha)
+    return slope, np.mean([abs(slope - low), abs(slope - high)]), intercept, \
+        kendalltau(t, y).pvalue
+
+
+def sen_mk_trends(yearly, slope_alpha=0.68, min_num_yrs=7):
+    """Sen slopes and Mann-Kendall test for several series of yearly values
+
+    The results are the same as those of TrendsEngine.compute_trend, i.e.
+    the slope, its confidence interval and the intercept are computed as in
+    scipy.stats.theilslopes, the p-value as in scipy.stats.kendalltau (exact
+    for up to 33 years without ties, else normal approximation) and slp_err
+    by propagating the slope error and the mean absolute residual of the
+    trend line. Series with ties (equal yearly values) are computed with
+    scipy directly.
+
+    Parameters
+    ----------
+    yearly : ndarray
+        yearly values (station, num_years) of one period, may contain NaN
+    slope_alpha : float
+        confidence degree of slope interval (as in scipy.stats.theilslopes)
+    min_num_yrs : int
+        minimum number of valid years, other stations are NaN
+
+    Returns
+    -------
+    dict
+        arrays (station,) of m, m_err, n, pval, slp, slp_err, reg0,
+        y_mean, y_min, y_max, where reg0 is the value of the trend line in
+        the first year with data, and slp and slp_err are relative to reg0
+    """
+    nstat, nyrs = yearly.shape
+    t = np.arange(nyrs, dtype=float)
+    i, j = np.triu_indices(nyrs, k=1)
+    dy = yearly[:, j] - yearly[:, i]
+    slopes = dy / (j - i)
+    valid_pairs = np.isfinite(slopes)
+    valid = np.isfinite(yearly)
+    n = valid.sum(axis=1)
+    t_valid = np.where(valid, t, np.nan)
+    out = {}
+    with _quiet():
+        m = np.nanmedian(slopes, axis=1)
+        # intercept as in scipy.stats.theilslopes (method="separate")
+        intercept = np.nanmedian(yearly, axis=1) - m * np.nanmedian(t_valid, axis=1)
+
+        # confidence interval of slope (cf. scipy.stats.theilslopes)
+        alpha = 1 - slope_alpha if slope_alpha > 0.5 else slope_alpha
+        z = -norm.ppf(alpha / 2)
+        nt = valid_pairs.sum(axis=1)
+        sigma = np.sqrt(n * (n - 1) * (2 * n + 5) / 18)
+        ordered = np.sort(np.where(valid_pairs, slopes, np.inf), axis=1)
+        last = np.maximum(nt - 1, 0)
+        upper = np.clip(np.round((nt + z * sigma) / 2).astype(int), 0, last)
+        lower = np.clip(np.round((nt - z * sigma) / 2).astype(int) - 1, 0, last)
+        lo = np.take_along_axis(ordered, lower[:, None], axis=1)[:, 0]
+        hi = np.take_along_axis(ordered, upper[:, None], axis=1)[:, 0]
+        m_err = (np.abs(m - lo) + np.abs(m - hi)) / 2
+
+        # Mann-Kendall test
+        dis = (valid_pairs & (dy < 0)).sum(axis=1)
+        s = (valid_pairs & (dy > 0)).sum(axis=1) - dis
+        pval = _mk_pval(n, dis, s, sigma)
+
+        # series with ties need tie corrections
+        ties = (valid_pairs & (dy == 0)).any(axis=1) & (n >= 3)
+        for k in np.flatnonzero(ties):
+            m[k], m_err[k], intercept[k], pval[k] = _scipy_trend(yearly[k], slope_alpha)
+
+        reg0 = intercept + m * np.nanmin(t_valid, axis=1)
+        residual = np.nanmean(np.abs(yearly - (intercept[:, None] + m[:, None] * t)), axis=1)
+
+        out["m"] = m
+        out["m_err"] = m_err
+        out["n"] = n.astype(float)
+        out["pval"] = pval
+        out["reg0"] = reg0
+        out["slp"] = m / reg0 * 100
+        out["slp_err"] = np.sqrt((m_err / reg0) ** 2 + (m * residual / reg0 ** 2) ** 2) * 100
+        out["y_mean"] = np.nanmean(yearly, axis=1)
+        out["y_min"] = np.nanmin(yearly, axis=1)
+        out["y_max"] = np.nanmax(yearly, axis=1)
+    invalid = n < max(min_num_yrs, 2)
+    for key, arr in out.items():
+        if key != "n":
+            arr[invalid] = np.nan
+    return out
+
+
+def _compute_chunk(values, first_year, periods, seasons, slope_alpha,
+                   min_num_yrs, avg_how, min_num_months):
+    nstat = values.shape[0]
+    result = {var: np.full((nstat, len(periods), len(seasons)), np.nan)
+              for var in TREND_VARS}
+    for k, season in enumerate(seasons):
+        yearly = monthly_to_yearly(values, season, avg_how, min_num_months)
+        for p, (start, stop) in enumerate(periods):
+            sub = np.full((nstat, stop - start + 1), np.nan)
+            lo, hi = max(start, first_year), min(stop, first_year + yearly.shape[1] - 1)
+            if hi >= lo:
+                sub[:, lo - start:hi - start + 1] = yearly[:, lo - first_year:hi - first_year + 1]
+            for var, arr in sen_mk_trends(sub, slope_alpha, min_num_yrs).items():
+                result[var][:, p, k] = arr
+    return result
+
+
+def compute_trends_batch(data, periods, seasons=("all",), slope_alpha=0.68,
+                         min_num_yrs=7, avg_how="mean", min_num_months=1,
+                         n_workers=1, chunk_size=500):
+    """Compute trends of all stations, periods and seasons
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        monthly data with dimensions (station, time), cf.
+        :func:`stack_station_series`
+    periods : list
+        periods, e.g. ["1995-2014", "2001-2010"] (cf. trends config)
+    seasons : list
+        seasons (cf. SEASONS)
+    slope_alpha : float
+        confidence degree of slope error (0.68 corresponds to 1 sigma)
+    min_num_yrs : int
+        minimum number of years with data in a period
+    avg_how : str
+        aggregation of months into years ("mean" or "median")
+    min_num_months : int
+        minimum number of months with data per year (and season)
+    n_workers : int
+        number of processes (stations are split into chunks of chunk_size)
+    chunk_size : int
+        number of stations per chunk
+
+    Returns
+    -------
+    xarray.Dataset
+        trend quantities with dimensions (station, period, season)
+    """
+    stat_dim = data.dims[0]
+    series = data.to_pandas().T.resample("MS").mean()
+    first_year = series.index[0].year
+    full = pd.date_range(f"{first_year}-01-01",
+                         f"{series.index[-1].year}-12-01", freq="MS")
+    values = series.reindex(full).to_numpy(dtype=float).T
+    periods = list(periods)
+    period_years = [parse_period(p) for p in periods]
+    seasons = list(seasons)
+
+    args = (first_year, period_years, seasons, slope_alpha, min_num_yrs,
+            avg_how, min_num_months)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if n_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_compute_chunk, chunks, *[[a] * len(chunks) for a in args]))
+    else:
+        results = [_compute_chunk(chunk, *args) for chunk in chunks]
+
+    coords = {stat_dim: data[stat_dim].values, "period": periods, "season": seasons}
+    dims = (stat_dim, "period", "season")
+    return xr.Dataset({
+        var: (dims, np.concatenate([r[var] for r in results], axis=0))
+        for var in TREND_VARS
+    }, coords=coords)
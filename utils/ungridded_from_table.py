@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Bulk conversion of station tables (CSV / parquet) into UngriddedData
+
+Unlike creating one StationData object per station and calling
+UngriddedData.from_station_data (cf. add_station_data.ipynb), the data array
+of UngriddedData is filled directly, in one vectorised step for all
+stations. This scales to tables with thousands of stations.
+
+Two table layouts are supported:
+
+- wide: one column per station, one row per timestamp (plus a separate
+  block / table with station metadata), as in
+  demo_datasets/AERONET_V2_SDA_od550gt1aer2010_EastAsia.csv
+- long: one row per measurement with columns for station name, time,
+  value and optionally variable name (e.g. parquet files as used by the
+  pyaro parquet reader). For parquet datasets, variable, time and
+  lat / lon filters are applied while reading (see read_parquet_dataset),
+  bypassing the per-variable record arrays of pyaro.
+
+Example::
+
+    from ungridded_from_table import read_wide_csv, ungridded_from_wide
+
+    meta, data = read_wide_csv(
+        "demo_datasets/AERONET_V2_SDA_od550gt1aer2010_EastAsia.csv",
+        meta_block=(3, 27), data_block=(28, None))
+    ungridded = ungridded_from_wide(data, meta, var_name="od550gt1aer",
+                                    units="1", ts_type="monthly")
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+from pyaerocom.ungriddeddata import UngriddedData
+
+#: Names of station metadata columns used for the coordinates
+COORD_COLS = ["latitude", "longitude", "altitude"]
+
+
+def _read_block(lines, block, **kwargs):
+    first, last = block
+    return pd.read_csv(io.StringIO("".join(lines[first:last])), **kwargs)
+
+
+def read_wide_csv(path, meta_block, data_block, **kwargs):
+    """Read CSV file with a station metadata block and a wide data block
+
+    The file is only read once, both blocks are then parsed from memory.
+
+    Parameters
+    ----------
+    path : str
+        CSV file
+    meta_block : tuple
+        (first, last) line index (0-based, last excluded, None for end of
+        file) of the metadata block. The first line of the block is the
+        header, the first column holds the station names.
+    data_block : tuple
+        (first, last) line index of the data block. The first line of the
+        block is the header (station names), the first column holds the
+        timestamps.
+    **kwargs
+        additional keyword args passed to :func:`pandas.read_csv` for both
+        blocks
+
+    Returns
+    -------
+    tuple
+        DataFrames with station metadata (index: station name) and data
+        (index: time, columns: station names)
+    """
+    with open(path) as f:
+        lines = f.readlines()
+    meta = _read_block(lines, meta_block, index_col=0, **kwargs)
+    meta.columns = [col.strip().lower() for col in meta.columns]
+    data = _read_block(lines, data_block, index_col=0, parse_dates=True,
+                       **kwargs)
+    return meta, data
+
+
+def read_table(path, columns=None):
+    """Read long-format station table from CSV or parquet file
+
+    Parameters
+    ----------
+    path : str
+        CSV or parquet (.pq, .parquet) file
+    columns : list, optional
+        columns to be read (parquet files are only read partially)
+
+    Returns
+    -------
+    pandas.DataFrame
+        table
+    """
+    if os.path.splitext(path)[-1] in (".pq", ".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def read_parquet_dataset(paths, variables=None, start=None, stop=None,
+                         lat_range=None, lon_range=None, columns=None,
+                         time_col="start_time"):
+    """Read filtered subset of (multi-file) parquet station dataset
+
+    Filters are pushed down into the parquet reader, i.e. row groups whose
+    statistics do not match the filters are skipped and only the required
+    columns are read. Files are memory-mapped and read in parallel.
+
+    Parameters
+    ----------
+    paths : str or list
+        parquet file(s) or directory, in the format of the pyaro parquet
+        reader (columns variable, units, station, latitude, longitude,
+        altitude, start_time, end_time, value, ...)
+    variables : list, optional
+        variables to be read
+    start, stop : str or datetime, optional
+        time window (applied to time_col)
+    lat_range, lon_range : tuple, optional
+        (min, max) latitude and longitude of stations to be read
+    columns : list, optional
+        columns to be read (default: columns required by
+        :func:`ungridded_from_long`)
+    time_col : str
+        name of time column
+
+    Returns
+    -------
+    pandas.DataFrame
+        long-format table with time column renamed to "time"
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(paths, format="parquet", partitioning="hive",
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+    if columns is None:
+        columns = ["station", "variable", "units", time_col, "value"]
+        columns += [c for c in COORD_COLS if c in dataset.schema.names]
+    expr = None
+    conditions = []
+    if variables is not None:
+        conditions.append(ds.field("variable").isin(list(variables)))
+    if start is not None:
+        conditions.append(ds.field(time_col) >= pd.Timestamp(start))
+    if stop is not None:
+        conditions.append(ds.field(time_col) < pd.Timestamp(stop))
+    for col, rng in (("latitude", lat_range), ("longitude", lon_range)):
+        if rng is not None:
+            conditions.append((ds.field(col) >= rng[0]) &
+                              (ds.field(col) <= rng[1]))
+    for cond in conditions:
+        expr = cond if expr is None else expr & cond
+    table = dataset.to_table(columns=columns, filter=expr, use_threads=True)
+    # avoid intermediate copies when converting from arrow
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    return df.rename(columns={time_col: "time"})
+
+
+def ungridded_from_wide(data, meta, var_name, units, ts_type, data_id=None,
+                        dropna=True):
+    """Create UngriddedData from a wide station table
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        data with time index and one column per station
+    meta : pandas.DataFrame
+        station metadata indexed by station name, with columns latitude,
+        longitude and (optionally) altitude. Additional columns (e.g.
+        country) are added to the station metadata.
+    var_name : str
+        name of variable
+    units : str
+        units of variable
+    ts_type : str
+        frequency of data (e.g. monthly)
+    data_id : str, optional
+        ID of dataset (defaults to var_name)
+    dropna : bool
+        if True, NaN values are not added
+
+    Returns
+    -------
+    UngriddedData
+        data of all stations
+    """
+    stations = np.asarray(data.columns)
+    missing = set(stations).difference(meta.index)
+    if missing:
+        raise ValueError(f"No metadata available for stations {sorted(missing)}")
+    ntime, nstat = data.shape
+    # station-major order, i.e. data of each station is contiguous
+    long = pd.DataFrame({
+        "station": np.repeat(stations, ntime),
+        "time": np.tile(data.index.values, nstat),
+        "value": data.values.T.ravel(),
+        "variable": var_name,
+        "units": units,
+    })
+    if dropna:
+        long = long[long["value"].notna()]
+    return ungridded_from_long(long, meta, ts_type,
+                               data_id=var_name if data_id is None else data_id)
+
+
+def _is_sorted(key, times):
+    # True if rows are sorted by key and, within each key, by time
+    same = np.diff(key) == 0
+    return bool(np.all(np.diff(key) >= 0) and np.all(np.diff(times)[same] >= 0))
+
+
+def ungridded_from_long(table, meta, ts_type, data_id, var_name=None,
+                        station_col="station", time_col="time",
+                        value_col="value", var_col="variable",
+                        units_col="units"):
+    """Create UngriddedData from a long station table
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        table with one row per measurement
+    meta : pandas.DataFrame, optional
+        station metadata indexed by station name, with columns latitude,
+        longitude and (optionally) altitude. If None, the coordinates are
+        taken from the columns of the same name in table (first occurrence
+        per station).
+    ts_type : str or dict
+        frequency of data (e.g. hourly), or dict with the frequency of each
+        station (station name -> frequency)
+    data_id : str
+        ID of dataset
+    var_name : str, optional
+        name of variable, required if table has no variable column
+    station_col, time_col, value_col, var_col, units_col : str
+        names of columns in table
+
+    Returns
+    -------
+    UngriddedData
+        data of all stations and variables
+    """
+    if var_col not in table:
+        if var_name is None:
+            raise ValueError(f"Table has no column {var_col}, please "
+                             f"specify var_name")
+        table = table.assign(**{var_col: var_name})
+    if meta is None:
+        cols = [c for c in COORD_COLS if c in table]
+        meta = table.groupby(station_col, sort=False)[cols].first()
+    stat_codes, stations = pd.factorize(table[station_col], sort=True)
+    var_codes, variables = pd.factorize(table[var_col], sort=True)
+    times = pd.to_datetime(table[time_col].values).values
+    times = times.astype("datetime64[s]").astype(np.int64)
+    values = table[value_col].values
+    num = len(table)
+    # sort by station, variable and time, such that the indices of each
+    # station / variable combination are contiguous. Only the columns that
+    # are used are reordered, and not at all if the table is already sorted
+    # (e.g. written per station).
+    key = stat_codes.astype(np.int64) * len(variables) + var_codes
+    if not _is_sorted(key, times):
+        order = np.lexsort((times, key))
+        stat_codes, var_codes, key = stat_codes[order], var_codes[order], key[order]
+        times, values = times[order], values[order]
+
+    obj = UngriddedData(num_points=num)
+    arr = obj._data
+    arr[:, obj._METADATAKEYINDEX] = stat_codes
+    arr[:, obj._TIMEINDEX] = times
+    arr[:, obj._VARINDEX] = var_codes
+    arr[:, obj._DATAINDEX] = values
+
+    meta = meta.reindex(stations)
+    for col, idx in zip(COORD_COLS, (obj._LATINDEX, obj._LONINDEX,
+                                     obj._ALTITUDEINDEX)):
+        if col in meta:
+            arr[:, idx] = meta[col].values[stat_codes]
+
+    if units_col in table:
+        units = table.groupby(var_col)[units_col].first().to_dict()
+    else:
+        units = {}
+    obj.var_idx = {var: i for i, var in enumerate(variables)}
+    if num == 0:
+        return obj
+
+    # start / stop row of each (station, variable) combination
+    bounds = np.flatnonzero(np.diff(key)) + 1
+    starts = np.concatenate([[0], bounds])
+    stops = np.concatenate([bounds, [num]])
+    extra_cols = [c for c in meta.columns if c not in COORD_COLS]
+    for start, stop in zip(starts, stops):
+        meta_key = int(stat_codes[start])
+        var = variables[var_codes[start]]
+        if meta_key not in obj.metadata:
+            name = stations[meta_key]
+            info = meta.loc[name]
+            md = dict(data_id=data_id, station_name=name,
+                      ts_type=ts_type[name] if isinstance(ts_type, dict) else ts_type,
+                      variables=[], var_info={})
+            for col in COORD_COLS:
+                md[col] = float(info[col]) if col in meta else np.nan
+            for col in extra_cols:
+                md[col] = info[col]
+            obj.metadata[meta_key] = md
+            obj.meta_idx[meta_key] = {}
+        md = obj.metadata[meta_key]
+        md["variables"].append(var)
+        md["var_info"][var] = {"units": units.get(var, "1")}
+        obj.meta_idx[meta_key][var] = np.arange(start, stop)
+    return obj
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert long-format station table (CSV / parquet) "
+                    "into UngriddedData and print a summary")
+    parser.add_argument("path", help="CSV or parquet file (or directory)")
+    parser.add_argument("--data-id", default="custom", help="ID of dataset")
+    parser.add_argument("--ts-type", default="hourly", help="Frequency")
+    parser.add_argument("--vars", nargs="+", default=None,
+                        help="Variables to read (parquet only)")
+    parser.add_argument("--start", default=None, help="Start time (parquet only)")
+    parser.add_argument("--stop", default=None, help="Stop time (parquet only)")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path) or args.path.endswith((".pq", ".parquet")):
+        table = read_parquet_dataset(args.path, variables=args.vars,
+                                     start=args.start, stop=args.stop)
+    else:
+        table = read_table(args.path)
+    data = ungridded_from_long(table, None, args.ts_type, data_id=args.data_id)
+    print(data)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Parquet cache for ungridded observation reads
+
+As an alternative to the pickle files that pyaerocom writes into
+const.CACHEDIR, the data returned by ReadUngridded is stored as parquet
+dataset, partitioned by variable and year, using the column layout of the
+pyaro parquet reader (the partition keys var_name and year are stored in
+addition to the data columns, so that the files remain complete). This
+means that
+
+- subsequent reads only load the variables and years that are needed
+  (memory-mapped, see ungridded_from_table.read_parquet_dataset)
+- the cache can be read with ReadUngridded through a PyaroConfig with
+  reader_id="parquet" (see get_pyaro_config)
+- the cache can be shared across machines and Python versions
+
+Data read with different read options (e.g. filter_post, files or a pyaro
+config) is cached separately (cf. :func:`get_cache_dir`).
+
+Example::
+
+    from ungridded_parquet_cache import read_cached
+
+    data = read_cached("AeronetSunV3Lev2.daily", "od550aer", start=2010)
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyaerocom
+from pyaerocom import const
+from pyaerocom.io import ReadUngridded
+from pyaerocom import TsType
+
+from manage_cachedir import enforce_limits, mark_used, record_access, using_cache
+from ungridded_from_table import COORD_COLS, read_parquet_dataset, ungridded_from_long
+
+#: Name of file containing information about cached dataset (the leading
+#: underscore makes pyarrow ignore it when reading the dataset)
+INFO_FILE = "_cache_info.json"
+
+#: Version of cache layout (caches of other versions are rebuilt)
+CACHE_VERSION = 2
+
+#: Hive partition keys of parquet dataset
+PARTITION_COLS = ["var_name", "year"]
+
+
+def _json_default(obj):
+    # e.g. PyaroConfig
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return repr(obj)
+
+
+def get_cache_dir(obs_id, basedir=None, read_kwargs=None):
+    """Directory of parquet cache of an observation dataset
+
+    Parameters
+    ----------
+    obs_id : str
+        ID of observation dataset
+    basedir : str, optional
+        base directory of parquet cache (default: <const.CACHEDIR>/parquet)
+    read_kwargs : dict, optional
+        options used to read the data (cf. :func:`read_cached`), data read
+        with options is cached in <obs_id>-<hash of options>
+    """
+    if basedir is None:
+        basedir = os.path.join(const.CACHEDIR, "parquet")
+    name = obs_id
+    if read_kwargs:
+        key = json.dumps(read_kwargs, sort_keys=True, default=_json_default)
+        name = f"{obs_id}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+    return os.path.join(basedir, name)
+
+
+def _data_columns(data):
+    """Valid data points of UngriddedData as dict of arrays
+
+    Supports the 2D array of UngriddedData and the structured array of
+    UngriddedDataStructured (returned e.g. by the pyaro reader), which has
+    no station coordinates per data point.
+    """
+    if hasattr(data, "_dra"):
+        arr = data._dra.data
+        arr = arr[~np.isnan(arr["data"])]
+        return {
+            "meta_key": arr["meta_id"].astype(int),
+            "var_code": arr["var_id"].astype(int),
+            "start_time": arr["start_time"].astype("datetime64[s]"),
+            "value": arr["data"].astype(float),
+        }
+    arr = data._data
+    arr = arr[~np.isnan(arr[:, data._DATAINDEX])]
+    return {
+        "meta_key": arr[:, data._METADATAKEYINDEX].astype(int),
+        "var_code": arr[:, data._VARINDEX].astype(int),
+        "start_time": arr[:, data._TIMEINDEX].astype("datetime64[s]"),
+        "latitude": arr[:, data._LATINDEX],
+        "longitude": arr[:, data._LONINDEX],
+        "altitude": arr[:, data._ALTITUDEINDEX],
+        "value": arr[:, data._DATAINDEX],
+    }
+
+
+def ungridded_to_table(data):
+    """Convert UngriddedData into long table in pyaro parquet layout
+
+    Parameters
+    ----------
+    data : UngriddedData
+        data to be converted
+
+    Returns
+    -------
+    pandas.DataFrame
+        table with columns variable, units, station, latitude, longitude,
+        altitude, start_time, end_time, value
+    """
+    cols = _data_columns(data)
+    meta_keys = cols["meta_key"]
+    var_codes = cols["var_code"]
+
+    keys = np.array(sorted(data.metadata), dtype=int)
+    lookup = np.searchsorted(keys, meta_keys)
+    stations = np.array([data.metadata[k]["station_name"] for k in keys],
+                        dtype=object)
+    ts_types = np.array([data.metadata[k].get("ts_type", "daily")
+                         for k in keys], dtype=object)
+    var_names = {idx: var for var, idx in data.var_idx.items()}
+    units = {}
+    for md in data.metadata.values():
+        for var, info in md.get("var_info", {}).items():
+            # var_info may also contain station coordinates
+            if isinstance(info, dict):
+                units.setdefault(str(var), str(info.get("units", "1")))
+
+    if "latitude" not in cols:
+        # station coordinates are stored in metadata
+        for coord in COORD_COLS:
+            values = np.array([data.metadata[k].get(coord, np.nan) for k in keys],
+                              dtype=float)
+            cols[coord] = values[lookup]
+    table = pd.DataFrame({
+        "variable": pd.Series(var_codes).map(var_names).values,
+        "station": stations[lookup],
+        "latitude": cols["latitude"],
+        "longitude": cols["longitude"],
+        "altitude": cols["altitude"],
+        "start_time": pd.to_datetime(cols["start_time"]),
+        "value": cols["value"],
+        "ts_type": ts_types[lookup].astype(str),
+    })
+    # the same data point may be stored in several metadata blocks of a
+    # station (e.g. by the pyaro reader of ReadUngridded)
+    table = table.drop_duplicates(["variable", "station", "start_time"], ignore_index=True)
+    table["units"] = table["variable"].map(units).fillna("1")
+    # end of measurement interval from frequency of each station
+    end = table["start_time"].copy()
+    station_ts_type = table.pop("ts_type").values
+    for ts_type in np.unique(station_ts_type):
+        mask = station_ts_type == ts_type
+        freq = TsType(ts_type).to_pandas_freq()
+        end[mask] = table.loc[mask, "start_time"] + pd.tseries.frequencies.to_offset(freq)
+    table["end_time"] = end
+    return table
+
+
+def write_cache(data, obs_id, basedir=None, revision=None, read_kwargs=None):
+    """Write UngriddedData into parquet cache
+
+    Parameters
+    ----------
+    data : UngriddedData
+        data to be cached
+    obs_id : str
+        ID of observation dataset
+    basedir : str, optional
+        base directory of parquet cache (default: <const.CACHEDIR>/parquet)
+    revision : str, optional
+        data revision of dataset (cache is invalid if revision changes)
+    read_kwargs : dict, optional
+        options used to read the data (cf. :func:`get_cache_dir`)
+
+    Returns
+    -------
+    str
+        cache directory
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    cachedir = get_cache_dir(obs_id, basedir, read_kwargs)
+    table = ungridded_to_table(data)
+    # partition columns are removed from the files, so the variable column
+    # (required by the pyaro parquet reader) is partitioned by a copy
+    table["var_name"] = table["variable"]
+    table["year"] = table["start_time"].dt.year
+    ds.write_dataset(pa.Table.from_pandas(table, preserve_index=False),
+                     cachedir, format="parquet",
+                     partitioning=PARTITION_COLS,
+                     partitioning_flavor="hive",
+                     existing_data_behavior="delete_matching")
+    info = read_cache_info(obs_id, basedir, read_kwargs)
+    info["version"] = CACHE_VERSION
+    info["pyaerocom"] = pyaerocom.__version__
+    info["revision"] = revision
+    ts_types = info.get("ts_types", {})
+    for md in data.metadata.values():
+        if md.get("ts_type") is not None:
+            ts_types[md["station_name"]] = md["ts_type"]
+    info["ts_types"] = ts_types
+    info["variables"] = sorted(set(info.get("variables", [])) | set(data.var_idx))
+    with open(os.path.join(cachedir, INFO_FILE), "w") as f:
+        json.dump(info, f, indent=2)
+    return cachedir
+
+
+def read_cache_info(obs_id, basedir=None, read_kwargs=None):
+    """Read information about cached dataset (empty dict if not cached)"""
+    try:
+        with open(os.path.join(get_cache_dir(obs_id, basedir, read_kwargs), INFO_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _get_revision(reader, obs_id):
+    try:
+        return str(reader.get_lowlevel_reader(obs_id).data_revision)
+    except Exception:
+        return None
+
+
+def read_cached(obs_id, vars_to_retrieve, start=None, stop=None,
+                basedir=None, configs=None, **kwargs):
+    """Read ungridded data, using parquet cache if possible
+
+    If all requested variables are cached (and the data revision of the
+    dataset has not changed), only the requested variables and time window
+    are loaded from the cache. Otherwise, the data is read with
+    ReadUngridded and written into the cache.
+
+    Parameters
+    ----------
+    obs_id : str
+        ID of observation dataset
+    vars_to_retrieve : str or list
+        variables to be read
+    start, stop : str or int, optional
+        time window to be loaded from the cache
+    basedir : str, optional
+        base directory of parquet cache
+    configs : PyaroConfig or list, optional
+        pyaro config(s) passed to ReadUngridded (e.g. for datasets that are
+        read with pyaro)
+    **kwargs
+        additional keyword args passed to :func:`ReadUngridded.read` (e.g.
+        filter_post)
+
+    Returns
+    -------
+    UngriddedData
+        data
+    """
+    if isinstance(vars_to_retrieve, str):
+        vars_to_retrieve = [vars_to_retrieve]
+    reader = ReadUngridded(obs_id, configs=configs)
+    revision = _get_revision(reader, obs_id)
+    read_kwargs = dict(kwargs)
+    if configs is not None:
+        read_kwargs["configs"] = configs
+    if start is not None:
+        start = pd.Timestamp(str(start))
+    if stop is not None:
+        stop = pd.Timestamp(str(stop))
+    cachedir = get_cache_dir(obs_id, basedir, read_kwargs)
+    # statistics and locks are stored in the parent of the parquet base
+    # directory (cf. manage_cachedir)
+    root = os.path.dirname(os.path.dirname(cachedir))
+    with using_cache(root):
+        info = read_cache_info(obs_id, basedir, read_kwargs)
+        if info and (info.get("revision") != revision
+                     or info.get("version") != CACHE_VERSION):
+            # data revision or cache layout changed, all cached variables
+            # are outdated
+            shutil.rmtree(cachedir)
+            info = {}
+        cached = (info.get("revision") == revision
+                  and set(vars_to_retrieve) <= set(info.get("variables", [])))
+        if cached:
+            table = read_parquet_dataset(cachedir, variables=vars_to_retrieve,
+                                         start=start, stop=stop)
+    if not cached:
+        # read without holding the lock, which would block pruning
+        data = reader.read(vars_to_retrieve=vars_to_retrieve, **kwargs)
+        with using_cache(root):
+            write_cache(data, obs_id, basedir, revision, read_kwargs)
+            info = read_cache_info(obs_id, basedir, read_kwargs)
+            table = read_parquet_dataset(cachedir, variables=vars_to_retrieve,
+                                         start=start, stop=stop)
+    mark_used(cachedir, root)
+    record_access(cached, table.memory_usage().sum(), root)
+    if not cached:
+        enforce_limits(root)
+    table["variable"] = table["variable"].astype(str)
+    # frequency of each station, as in the original data
+    station_ts_types = info.get("ts_types", {})
+    ts_types = {name: station_ts_types.get(name, "daily") for name in table["station"].unique()}
+    return ungridded_from_long(table, None, ts_types, data_id=obs_id)
+
+
+def get_pyaro_config(obs_id, basedir=None, name=None, read_kwargs=None):
+    """Get PyaroConfig to read cached dataset via ReadUngridded
+
+    Parameters
+    ----------
+    obs_id : str
+        ID of cached observation dataset
+    basedir : str, optional
+        base directory of parquet cache
+    name : str, optional
+        name of config (default: <obs_id>-parquet)
+    read_kwargs : dict, optional
+        options the data was read with (cf. :func:`get_cache_dir`)
+
+    Returns
+    -------
+    PyaroConfig
+        config that can be passed to ReadUngridded(configs=[config])
+    """
+    from pyaerocom.io.pyaro.pyaro_config import PyaroConfig
+
+    return PyaroConfig(
+        name=f"{obs_id}-parquet" if name is None else name,
+        reader_id="parquet",
+        filename_or_obj_or_url=get_cache_dir(obs_id, basedir, read_kwargs),
+        filters={},
+    )
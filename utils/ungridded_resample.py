@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Vectorised time resampling of UngriddedData for all stations at once
+
+StationData.resample_time and UngriddedData.to_station_data resample one
+station and variable at a time using pandas. Here, the values of one
+variable are taken directly from the data array of UngriddedData and
+resampled for all stations together, using group-by-station and time bin
+index arithmetic on sorted arrays. Hierarchical constraints on the minimum
+number of observations (e.g. DEFAULT_RESAMPLE_CONSTRAINTS in the eval
+configs: yearly <- monthly <- daily <- hourly) and custom aggregators per
+resampling step (e.g. resample_how={"vmro3max": {"daily": {"hourly":
+"max"}}}) are applied in the same way as in pyaerocom: the data is
+resampled through all intermediate frequencies that have a constraint.
+Time bins and their labels are the same as in pyaerocom's TimeResampler
+(pandas frequencies TS_TYPE_TO_PANDAS_FREQ, labels shifted by
+PANDAS_RESAMPLE_OFFSETS): e.g. daily values are labelled 12:00, monthly
+values with the 15th of the month, and weeks (pandas W-MON) run from
+Tuesday to Monday and are labelled with Monday 00:00.
+
+Example::
+
+    from ungridded_resample import resample_ungridded
+
+    constraints = dict(yearly=dict(monthly=1),
+                       monthly=dict(daily=1, weekly=1, hourly=1),
+                       daily=dict(hourly=1))
+    monthly = resample_ungridded(data, "vmro3max", "monthly",
+                                 min_num_obs=constraints,
+                                 how={"daily": {"hourly": "max"}})
+    monthly.sel(station_name="Birkenes II")
+"""
+import warnings
+
+import numpy as np
+import xarray as xr
+
+#: supported frequencies, from high to low resolution
+TS_TYPES = ["hourly", "daily", "weekly", "monthly", "yearly"]
+
+#: supported aggregators
+AGGREGATORS = ["mean", "median", "max", "min", "sum"]
+
+#: Offsets (s) of labels of resampled values from the start of their time
+#: bin, as in pyaerocom (weekly values are labelled with the last day)
+LABEL_OFFSETS = {"hourly": 1800, "daily": 12 * 3600, "weekly": 6 * 86400,
+                 "monthly": 14 * 86400, "yearly": 181 * 86400}
+
+
+def floor_time(times, ts_type):
+    """Start of time bins of a frequency
+
+    Parameters
+    ----------
+    times : ndarray
+        datetime64 array
+    ts_type : str
+        frequency (cf. TS_TYPES), weeks start on Tuesday (as pandas
+        frequency W-MON, which includes all of Monday in the week ending on
+        Monday)
+
+    Returns
+    -------
+    ndarray
+        datetime64[s] array
+    """
+    times = np.asarray(times, dtype="datetime64[s]")
+    if ts_type == "hourly":
+        binned = times.astype("datetime64[h]")
+    elif ts_type == "daily":
+        binned = times.astype("datetime64[D]")
+    elif ts_type == "weekly":
+        days = times.astype("datetime64[D]")
+        # 1970-01-01 was a Thursday
+        binned = days - ((days.astype(np.int64) - 5) % 7).astype("timedelta64[D]")
+    elif ts_type == "monthly":
+        binned = times.astype("datetime64[M]")
+    elif ts_type == "yearly":
+        binned = times.astype("datetime64[Y]")
+    else:
+        raise ValueError(f"Invalid ts_type {ts_type}, choose from {TS_TYPES}")
+    return binned.astype("datetime64[s]")
+
+
+def label_time(bins, ts_type):
+    """pyaerocom time labels of time bins (cf. :attr:`LABEL_OFFSETS`)"""
+    return (np.asarray(bins, dtype="datetime64[s]")
+            + np.timedelta64(LABEL_OFFSETS[ts_type], "s"))
+
+
+def get_resample_steps(from_ts_type, to_ts_type, min_num_obs=None, how="mean"):
+    """Resampling steps from one frequency to a lower one
+
+    Parameters
+    ----------
+    from_ts_type, to_ts_type : str
+        input and output frequency
+    min_num_obs : dict or int, optional
+        hierarchical constraints {to: {from: num}} (as
+        DEFAULT_RESAMPLE_CONSTRAINTS), or one minimum number for a direct
+        resampling
+    how : str or dict
+        aggregator, or {to: {from: aggregator}} (default for other steps
+        is mean)
+
+    Returns
+    -------
+    list
+        (from, to, min_num, how) for each step
+    """
+    i0, i1 = TS_TYPES.index(from_ts_type), TS_TYPES.index(to_ts_type)
+    if i1 < i0:
+        raise ValueError(f"Cannot resample from {from_ts_type} to higher "
+                         f"resolution {to_ts_type}")
+    if i0 == i1:
+        return []
+    chain = [from_ts_type]
+    if isinstance(min_num_obs, dict):
+        # as in pyaerocom, intermediate steps need a constraint
+        for t in TS_TYPES[i0 + 1:i1]:
+            if chain[-1] in min_num_obs.get(t, {}):
+                chain.append(t)
+    chain.append(to_ts_type)
+    steps = []
+    for src, dst in zip(chain[:-1], chain[1:]):
+        if isinstance(min_num_obs, dict):
+            min_num = min_num_obs.get(dst, {}).get(src, 0)
+        else:
+            min_num = min_num_obs or 0
+        agg = how.get(dst, {}).get(src, "mean") if isinstance(how, dict) else how
+        if agg not in AGGREGATORS:
+            raise ValueError(f"Invalid aggregator {agg}, choose from {AGGREGATORS}")
+        steps.append((src, dst, min_num, agg))
+    return steps
+
+
+def resample_arrays(station_idx, times, values, ts_type, min_num=0, how="mean"):
+    """Resample values of many stations to one frequency (one step)
+
+    Parameters
+    ----------
+    station_idx : ndarray
+        station index of each value
+    times : ndarray
+        time of each value (datetime64)
+    values : ndarray
+        values (NaN values are ignored)
+    ts_type : str
+        output frequency
+    min_num : int
+        minimum number of values per station and time bin
+    how : str
+        aggregator (cf. AGGREGATORS)
+
+    Returns
+    -------
+    tuple
+        station_idx, times (labels as in pyaerocom, cf.
+        :func:`label_time`) and values of the resampled data
+    """
+    valid = np.isfinite(values)
+    station_idx, times, values = station_idx[valid], times[valid], values[valid]
+    bins = floor_time(times, ts_type).astype(np.int64)
+    # sort by station, bin (and value, for median)
+    order = np.lexsort((values, bins, station_idx))
+    station_idx, bins, values = station_idx[order], bins[order], values[order]
+    if len(values) == 0:
+        return station_idx, label_time(bins.astype("datetime64[s]"), ts_type), values
+    new_group = np.r_[True, (np.diff(station_idx) != 0) | (np.diff(bins) != 0)]
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.r_[starts, len(values)])
+    if how == "mean":
+        result = np.add.reduceat(values, starts) / counts
+    elif how == "sum":
+        result = np.add.reduceat(values, starts)
+    elif how == "max":
+        result = np.maximum.reduceat(values, starts)
+    elif how == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif how == "median":
+        # values are sorted within groups
+        result = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    else:
+        raise ValueError(f"Invalid aggregator {how}, choose from {AGGREGATORS}")
+    keep = counts >= min_num
+    return (station_idx[starts][keep],
+            label_time(bins[starts][keep].astype("datetime64[s]"), ts_type), result[keep])
+
+
+def get_station_table(data):
+    """Stations of UngriddedData and station index of each metadata block
+
+    Metadata blocks of the same station (e.g. several files or instruments)
+    are merged, as in UngriddedData.to_station_data.
+
+    Returns
+    -------
+    tuple
+        (list of station names, dict meta key -> station index, dict of
+        station coordinates, dict meta key -> ts_type)
+    """
+    names, station_of_meta, ts_types = [], {}, {}
+    index = {}
+    coords = {"latitude": [], "longitude": [], "altitude": []}
+    for key in sorted(data.metadata):
+        meta = data.metadata[key]
+        name = meta["station_name"]
+        if name not in index:
+            index[name] = len(names)
+            names.append(name)
+            for coord in coords:
+                value = meta.get(coord)
+                coords[coord].append(np.nan if value is None else value)
+        station_of_meta[key] = index[name]
+        ts_types[key] = meta.get("ts_type")
+    return names, station_of_meta, coords, ts_types
+
+
+def _combine(station_idx, times, values, src_types, ts_type, min_num_obs, how):
+    # resample data of higher input frequencies to ts_type and merge with
+    # the data in ts_type
+    if np.all(src_types == ts_type):
+        return station_idx, times, values
+    parts = []
+    for src in np.unique(src_types):
+        mask = src_types == src
+        s_idx, t, v = station_idx[mask], times[mask], values[mask]
+        for _, dst, min_num, agg in get_resample_steps(src, ts_type, min_num_obs, how):
+            s_idx, t, v = resample_arrays(s_idx, t, v, dst, min_num, agg)
+        parts.append((s_idx, t, v))
+    s_idx, t, v = (np.concatenate(arrs) for arrs in zip(*parts))
+    return resample_arrays(s_idx, t, v, ts_type)
+
+
+def resample_ungridded(data, var_name, ts_type, min_num_obs=None, how="mean",
+                       from_ts_type=None, start=None, stop=None):
+    """Resample one variable of all stations of UngriddedData
+
+    Parameters
+    ----------
+    data : UngriddedData
+        data
+    var_name : str
+        variable
+    ts_type : str
+        output frequency
+    min_num_obs : dict or int, optional
+        hierarchical constraints (cf. :func:`get_resample_steps`)
+    how : str or dict
+        aggregator(s) (cf. :func:`get_resample_steps`), e.g. the entry of
+        a variable in resample_how of an eval config
+    from_ts_type : str, optional
+        frequency of input data (default: ts_type in metadata of each
+        station, stations with different frequencies are resampled
+        separately). Stations with metadata blocks of different frequencies
+        (e.g. hourly and daily files) are combined at their lowest
+        frequency: data of higher frequency is first resampled to that
+        frequency, and values of the same time bin are averaged.
+    start, stop : str, optional
+        time range of output
+
+    Returns
+    -------
+    xarray.DataArray
+        resampled data (station_name, time) with station coordinates
+    """
+    if var_name not in data.var_idx:
+        raise ValueError(f"Variable {var_name} not in data")
+    arr = data._data
+    arr = arr[arr[:, data._VARINDEX] == data.var_idx[var_name]]
+    meta_keys = arr[:, data._METADATAKEYINDEX].astype(int)
+    times = arr[:, data._TIMEINDEX].astype(np.int64).astype("datetime64[s]")
+    values = arr[:, data._DATAINDEX].astype(np.float64)
+
+    names, station_of_meta, coords, meta_ts_types = get_station_table(data)
+    keys = np.array(sorted(station_of_meta), dtype=int)
+    lookup = np.searchsorted(keys, meta_keys)
+    station_idx = np.array([station_of_meta[k] for k in keys], dtype=np.int64)[lookup]
+    if from_ts_type is not None:
+        src_types = np.full(len(values), from_ts_type, dtype=object)
+    else:
+        missing = sorted({names[station_of_meta[k]] for k in keys if not meta_ts_types[k]})
+        if missing:
+            warnings.warn(f"No ts_type in metadata of {len(missing)} station(s) "
+                          f"(e.g. {missing[0]}), assuming hourly data")
+        src_types = np.array([meta_ts_types[k] or "hourly" for k in keys], dtype=object)[lookup]
+    # lowest input frequency of each station
+    src_rank = np.array([TS_TYPES.index(src) for src in src_types], dtype=np.int64)
+    station_rank = np.full(len(names), -1, dtype=np.int64)
+    np.maximum.at(station_rank, station_idx, src_rank)
+    station_types = np.asarray(TS_TYPES, dtype=object)[station_rank[station_idx]]
+
+    out_station, out_time, out_value = [], [], []
+    for src in np.unique(station_types):
+        mask = station_types == src
+        s_idx, t, v = _combine(station_idx[mask], times[mask], values[mask],
+                               src_types[mask], src, min_num_obs, how)
+        steps = get_resample_steps(src, ts_type, min_num_obs, how)
+        if not steps:
+            # already in output frequency
+            s_idx, t, v = resample_arrays(s_idx, t, v, ts_type)
+        for _, dst, min_num, agg in steps:
+            s_idx, t, v = resample_arrays(s_idx, t, v, dst, min_num, agg)
+        out_station.append(s_idx)
+        out_time.append(t)
+        out_value.append(v)
+    s_idx = np.concatenate(out_station)
+    t = np.concatenate(out_time)
+    v = np.concatenate(out_value)
+
+    if start is not None:
+        keep = t >= np.datetime64(start)
+        s_idx, t, v = s_idx[keep], t[keep], v[keep]
+    if stop is not None:
+        keep = t < np.datetime64(stop)
+        s_idx, t, v = s_idx[keep], t[keep], v[keep]
+
+    # scatter into (station, time) array
+    used = np.unique(s_idx)
+    all_times = np.unique(t)
+    result = np.full((len(used), len(all_times)), np.nan)
+    result[np.searchsorted(used, s_idx), np.searchsorted(all_times, t)] = v
+    station_coords = {c: ("station_name", np.asarray(vals, dtype=float)[used])
+                      for c, vals in coords.items()}
+    return xr.DataArray(
+        result,
+        dims=("station_name", "time"),
+        coords={"station_name": np.asarray(names, dtype=object)[used],
+                "time": all_times.astype("datetime64[ns]"), **station_coords},
+        name=var_name,
+        attrs={"ts_type": ts_type, "var_name": var_name},
+    )